@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+
+from starlette.responses import JSONResponse
+
+import config
+from auth import bearer_user_id
+from request_metrics import admission_decisions, admission_in_flight, admission_wait_seconds, admission_waiting, rate_limit_backend_errors, route_label
+
+logger = logging.getLogger(__name__)
+
+# Checkout and the cart writes leading up to it may use the reserved slots.
+PRIORITY_ROUTES = {
+    ("POST", "/checkout/{user_id}"),
+    ("POST", "/{user_id}/cart/add"),
+    ("POST", "/{user_id}/cart/add-many"),
+    ("PUT", "/{user_id}/cart/update/{cart_item_id}"),
+    ("DELETE", "/{user_id}/cart/remove/{cart_item_id}"),
+}
+# Served however busy the process is, so an overload stays observable and
+# health checks don't fail a worker for being busy.
+EXEMPT_PATH_PREFIXES = ("/metrics", "/health")
+
+
+class TokenBuckets:
+    """In-process backend: one bucket per key, least recently used evicted first."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # key -> (tokens, monotonic time they were counted at)
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token from key's bucket: 0, or the seconds until one is due."""
+        now = time.monotonic()
+        tokens, counted_at = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - counted_at) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# The same bucket as TokenBuckets.take, on the Redis server's clock. Scripts
+# calling TIME before writing need Redis 5 or later.
+TAKE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'counted_at')
+local tokens = tonumber(bucket[1]) or burst
+local counted_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - counted_at) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'counted_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisTokenBuckets:
+    """Shared backend for any asyncio client with Redis' script commands.
+
+    Buckets are shared by every worker using the same server; a bucket left
+    alone long enough to refill expires.
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str):
+        import redis.asyncio
+
+        return cls(redis.asyncio.Redis.from_url(url))
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        return float(await self._take(keys=[self.prefix + key], args=[rate, burst]))
+
+
+class ConcurrencyLimit:
+    """At most limit requests at once, the last reserved slots for priority ones.
+
+    Requests that find no free slot queue for up to ADMISSION_QUEUE_TIMEOUT
+    seconds; freed slots go to queued priority requests first. Runs on the
+    event loop only.
+    """
+
+    def __init__(self, limit: int, reserved: int):
+        self.limit = limit
+        self.reserved = reserved
+        self.in_flight = 0
+        self._queues = {True: deque(), False: deque()}
+
+    def _capacity(self, priority: bool) -> int:
+        return self.limit if priority else self.limit - self.reserved
+
+    def waiting(self) -> int:
+        return len(self._queues[True]) + len(self._queues[False])
+
+    async def acquire(self, priority: bool):
+        """Take a slot: "admitted", "queued" (after waiting), or None if none came free."""
+        if self.limit <= 0:
+            return "admitted"
+        ahead = self._queues[True] if priority else self._queues[True] or self._queues[False]
+        if not ahead and self.in_flight < self._capacity(priority):
+            self.in_flight += 1
+            self._publish()
+            return "admitted"
+        if config.ADMISSION_QUEUE_TIMEOUT <= 0:
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(waiter)
+        self._publish()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, config.ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.CancelledError:
+            # Granted a slot just as the client went away.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                self._discard(waiter, priority)
+            self._publish()
+        admission_wait_seconds.observe(time.perf_counter() - started)
+        return "queued"
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        self.in_flight -= 1
+        for priority in (True, False):
+            queue = self._queues[priority]
+            while queue and self.in_flight < self._capacity(priority):
+                waiter = queue.popleft()
+                if not waiter.done():
+                    self.in_flight += 1
+                    waiter.set_result(None)
+        self._publish()
+
+    def _discard(self, waiter, priority: bool):
+        try:
+            self._queues[priority].remove(waiter)
+        except ValueError:
+            pass
+
+    def _publish(self):
+        admission_in_flight.value = self.in_flight
+        admission_waiting.value = self.waiting()
+
+
+def build_buckets():
+    if config.RATE_LIMIT_PER_SECOND <= 0 or config.RATE_LIMIT_BACKEND == "none":
+        return None
+    if config.RATE_LIMIT_BACKEND == "redis":
+        return RedisTokenBuckets.from_url(config.RATE_LIMIT_URL)
+    return TokenBuckets(config.RATE_LIMIT_MAX_KEYS)
+
+
+buckets = build_buckets()
+limiter = ConcurrencyLimit(config.ADMISSION_MAX_CONCURRENT, config.ADMISSION_RESERVED_SLOTS)
+_backend_failing = False
+
+
+async def rate_limit_wait(scope, route: str) -> float:
+    """Seconds until the caller may use this route again; 0 lets the request in now."""
+    global _backend_failing
+    if buckets is None:
+        return 0.0
+    user_id = bearer_user_id(dict(scope["headers"]))
+    caller = f"user:{user_id}" if user_id is not None else f"addr:{(scope.get('client') or ('unknown',))[0]}"
+    try:
+        wait = await buckets.take(f"{caller}:{scope['method']} {route}", config.RATE_LIMIT_PER_SECOND, config.RATE_LIMIT_BURST)
+    except Exception as exc:
+        # A rate limiter outage should not become a site outage.
+        rate_limit_backend_errors.inc()
+        if not _backend_failing:
+            logger.warning("rate limit backend unavailable, not limiting: %r", exc)
+        _backend_failing = True
+        return 0.0
+    _backend_failing = False
+    return wait
+
+
+def stats() -> dict:
+    return {
+        "max_concurrent": limiter.limit,
+        "reserved_slots": limiter.reserved,
+        "in_flight": limiter.in_flight,
+        "waiting": limiter.waiting(),
+        "rate_limit_backend": type(buckets).__name__ if buckets is not None else None,
+        "decisions": {f"{decision}/{priority}": int(counter.value) for (decision, priority), counter in admission_decisions.collect()},
+    }
+
+
+class AdmissionMiddleware:
+    """Turns requests away before they pile up on the connection pool.
+
+    A caller over its rate for a route gets 429. Past ADMISSION_MAX_CONCURRENT
+    running requests, others queue briefly and then get 503, checkout and
+    cart writes ahead of browsing. Both answers carry Retry-After.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        route = route_label(scope)
+        priority = (scope["method"], route) in PRIORITY_ROUTES
+        priority_label = "high" if priority else "normal"
+
+        wait = await rate_limit_wait(scope, route)
+        if wait > 0:
+            admission_decisions.labels("rate_limited", priority_label).inc()
+            response = JSONResponse(status_code=429, content={"detail": "Too many requests, retry later"}, headers={"Retry-After": str(math.ceil(wait))})
+            await response(scope, receive, send)
+            return
+
+        decision = await limiter.acquire(priority)
+        if decision is None:
+            admission_decisions.labels("overloaded", priority_label).inc()
+            response = JSONResponse(status_code=503, content={"detail": "Server busy, retry shortly"}, headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+        admission_decisions.labels(decision, priority_label).inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -18,7 +18,10 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-from database import engine
+from database import engine, SQLALCHEMY_DATABASE_URL
+
+# Migrate the database the application is configured for (DATABASE_URL).
+config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL.replace("%", "%%"))
 
 from models import Base
 target_metadata = Base.metadata
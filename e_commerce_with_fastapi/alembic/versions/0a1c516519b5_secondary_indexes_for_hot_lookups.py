@@ -0,0 +1,64 @@
+"""secondary indexes for hot lookups
+
+Revision ID: 0a1c516519b5
+Revises: 67a4185e8019
+Create Date: 2026-10-18 10:03:27.194520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a1c516519b5'
+down_revision: Union[str, None] = '67a4185e8019'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Product filters carry id so the listing's ORDER BY id comes straight off the
+# index. products.price is covered by ix_products_price_id, and cart_items.cart_id
+# by the leading column of uq_cart_items_cart_id_product_id.
+INDEXES = [
+    ('ix_products_category_id_id', 'products', ['category_id', 'id'], {}),
+    ('ix_products_stock_id', 'products', ['stock', 'id'], {}),
+    ('ix_products_in_stock', 'products', ['id'], {'postgresql_where': sa.text('stock > 0')}),
+    ('ix_carts_user_id', 'carts', ['user_id'], {}),
+    ('uq_cart_items_cart_id_product_id', 'cart_items', ['cart_id', 'product_id'], {'unique': True}),
+    ('ix_cart_items_product_id', 'cart_items', ['product_id'], {}),
+    ('ix_orders_user_id', 'orders', ['user_id'], {}),
+    ('ix_order_items_order_id', 'order_items', ['order_id'], {}),
+]
+
+
+def upgrade() -> None:
+    # Fold duplicate cart lines into the oldest one so the unique index can be built.
+    op.execute("""
+        UPDATE cart_items SET quantity = dup.total
+        FROM (
+            SELECT min(id) AS keep_id, sum(quantity) AS total
+            FROM cart_items
+            GROUP BY cart_id, product_id
+            HAVING count(*) > 1
+        ) AS dup
+        WHERE cart_items.id = dup.keep_id
+    """)
+    op.execute("""
+        DELETE FROM cart_items USING cart_items AS older
+        WHERE cart_items.cart_id = older.cart_id
+          AND cart_items.product_id = older.product_id
+          AND cart_items.id > older.id
+    """)
+
+    # CONCURRENTLY keeps the tables writable while the indexes build, but cannot
+    # run inside a transaction block.
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **options)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,59 @@
+"""order history
+
+Revision ID: 2b8d6f0e5a17
+Revises: 7c3e9a4f1d28
+Create Date: 2026-10-18 15:47:12.836104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2b8d6f0e5a17'
+down_revision: Union[str, None] = '7c3e9a4f1d28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # created_at held datetime.utcnow().isoformat() strings (mostly the value
+    # from when the process started). The type change rewrites orders.
+    op.alter_column('orders', 'created_at',
+               existing_type=sa.String(),
+               type_=sa.DateTime(timezone=True),
+               postgresql_using="COALESCE(NULLIF(created_at, '')::timestamp AT TIME ZONE 'UTC', now())",
+               server_default=sa.text('now()'),
+               nullable=False)
+
+    op.create_table('user_order_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('order_count', sa.BigInteger(), nullable=False),
+    sa.Column('total_spent', sa.Numeric(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.execute("""
+        INSERT INTO user_order_stats (user_id, order_count, total_spent)
+        SELECT user_id, count(*), sum(total_price) FROM orders GROUP BY user_id
+    """)
+
+    # The new index leads with user_id, which makes ix_orders_user_id redundant.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_user_id_created_at', 'orders', ['user_id', 'created_at', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_orders_user_id', table_name='orders', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_user_id', 'orders', ['user_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_orders_user_id_created_at', table_name='orders', postgresql_concurrently=True, if_exists=True)
+    op.drop_table('user_order_stats')
+    op.alter_column('orders', 'created_at',
+               existing_type=sa.DateTime(timezone=True),
+               type_=sa.String(),
+               postgresql_using="to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US')",
+               server_default=None,
+               nullable=True)
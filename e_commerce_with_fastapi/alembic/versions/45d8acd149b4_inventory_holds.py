@@ -0,0 +1,52 @@
+"""inventory holds
+
+Revision ID: 45d8acd149b4
+Revises: 2b8d6f0e5a17
+Create Date: 2026-10-18 07:05:41.764909
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '45d8acd149b4'
+down_revision: Union[str, None] = '2b8d6f0e5a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Shards start empty: each product's rows are created from products.stock
+    # the first time it is held or sold.
+    op.create_table('inventory_holds',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cart_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['cart_id'], ['carts.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_inventory_holds_cart_id_product_id', 'inventory_holds', ['cart_id', 'product_id'], unique=False)
+    op.create_index(op.f('ix_inventory_holds_expires_at'), 'inventory_holds', ['expires_at'], unique=False)
+    op.create_index(op.f('ix_inventory_holds_product_id'), 'inventory_holds', ['product_id'], unique=False)
+    op.create_table('inventory_shards',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('available', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'shard')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_shards')
+    op.drop_index(op.f('ix_inventory_holds_product_id'), table_name='inventory_holds')
+    op.drop_index(op.f('ix_inventory_holds_expires_at'), table_name='inventory_holds')
+    op.drop_index('ix_inventory_holds_cart_id_product_id', table_name='inventory_holds')
+    op.drop_table('inventory_holds')
@@ -0,0 +1,58 @@
+"""one cart per user
+
+Revision ID: 5e2b7c91d4a0
+Revises: 0a1c516519b5
+Create Date: 2026-10-18 11:26:05.318842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2b7c91d4a0'
+down_revision: Union[str, None] = '0a1c516519b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+KEEPERS = """
+    SELECT user_id, min(id) AS keep_id FROM carts GROUP BY user_id HAVING count(*) > 1
+"""
+
+
+def upgrade() -> None:
+    # Fold every extra cart of a user into their oldest cart, adding up the
+    # quantities of products that appear in both, then drop the extras.
+    op.execute(f"""
+        WITH keepers AS ({KEEPERS})
+        INSERT INTO cart_items (cart_id, product_id, quantity)
+        SELECT keepers.keep_id, cart_items.product_id, sum(cart_items.quantity)
+        FROM cart_items
+        JOIN carts ON carts.id = cart_items.cart_id
+        JOIN keepers ON keepers.user_id = carts.user_id AND carts.id <> keepers.keep_id
+        GROUP BY keepers.keep_id, cart_items.product_id
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+    """)
+    op.execute(f"""
+        WITH keepers AS ({KEEPERS})
+        DELETE FROM cart_items USING carts, keepers
+        WHERE cart_items.cart_id = carts.id AND carts.user_id = keepers.user_id AND carts.id <> keepers.keep_id
+    """)
+    op.execute(f"""
+        WITH keepers AS ({KEEPERS})
+        DELETE FROM carts USING keepers
+        WHERE carts.user_id = keepers.user_id AND carts.id <> keepers.keep_id
+    """)
+
+    # The unique index also serves lookups by user_id, replacing ix_carts_user_id.
+    with op.get_context().autocommit_block():
+        op.create_index('uq_carts_user_id', 'carts', ['user_id'], unique=True, postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_carts_user_id', table_name='carts', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_carts_user_id', 'carts', ['user_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('uq_carts_user_id', table_name='carts', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,31 @@
+"""keyset pagination indexes for products
+
+Revision ID: 67a4185e8019
+Revises: 3404afd7e44d
+Create Date: 2026-10-18 09:12:41.508113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '67a4185e8019'
+down_revision: Union[str, None] = '3404afd7e44d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_price_id', 'products', ['price', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_products_name_id', 'products', ['name', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_products_name_id', table_name='products', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_products_price_id', table_name='products', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,44 @@
+"""cart summary
+
+Revision ID: 9e4b1c7a2f35
+Revises: 45d8acd149b4
+Create Date: 2026-10-18 19:12:08.412377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b1c7a2f35'
+down_revision: Union[str, None] = '45d8acd149b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cart_items', sa.Column('name', sa.String(), nullable=True))
+    op.add_column('cart_items', sa.Column('price', sa.Numeric(), nullable=True))
+    op.execute("""
+        UPDATE cart_items SET name = products.name, price = products.price
+        FROM products WHERE products.id = cart_items.product_id
+    """)
+    op.alter_column('cart_items', 'name', existing_type=sa.String(), nullable=False)
+    op.alter_column('cart_items', 'price', existing_type=sa.Numeric(), nullable=False)
+
+    op.add_column('carts', sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('carts', sa.Column('subtotal', sa.Numeric(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE carts SET item_count = lines.item_count, subtotal = lines.subtotal
+        FROM (SELECT cart_id, sum(quantity) AS item_count, sum(quantity * price) AS subtotal FROM cart_items GROUP BY cart_id) AS lines
+        WHERE lines.cart_id = carts.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('carts', 'subtotal')
+    op.drop_column('carts', 'item_count')
+    op.drop_column('cart_items', 'price')
+    op.drop_column('cart_items', 'name')
@@ -0,0 +1,51 @@
+"""product search
+
+Revision ID: b81f3d2a6c57
+Revises: 5e2b7c91d4a0
+Create Date: 2026-10-18 12:14:52.630197
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81f3d2a6c57'
+down_revision: Union[str, None] = '5e2b7c91d4a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.execute("""
+        CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('english', NEW.name);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER products_search_vector_update BEFORE INSERT OR UPDATE OF name ON products
+        FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """)
+    # Rows written from here on are covered by the trigger.
+    op.execute("UPDATE products SET search_vector = to_tsvector('english', name)")
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_search_vector', 'products', ['search_vector'], postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_products_name_trgm', 'products', ['name'], postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_products_name_trgm', table_name='products', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_products_search_vector', table_name='products', postgresql_concurrently=True, if_exists=True)
+    op.execute("DROP TRIGGER IF EXISTS products_search_vector_update ON products")
+    op.execute("DROP FUNCTION IF EXISTS products_search_vector_update()")
+    op.drop_column('products', 'search_vector')
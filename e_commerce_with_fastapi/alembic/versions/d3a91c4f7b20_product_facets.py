@@ -0,0 +1,81 @@
+"""product facets
+
+Revision ID: d3a91c4f7b20
+Revises: b81f3d2a6c57
+Create Date: 2026-10-18 13:02:17.940266
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a91c4f7b20'
+down_revision: Union[str, None] = 'b81f3d2a6c57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRIGGERS = {
+    'insert': 'NEW TABLE AS new_rows',
+    'update': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'delete': 'OLD TABLE AS old_rows',
+}
+
+
+def upgrade() -> None:
+    op.create_table('product_facet_counts',
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('price_bucket', sa.Integer(), nullable=False),
+    sa.Column('in_stock', sa.Boolean(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('category_id', 'price_bucket', 'in_stock')
+    )
+    op.execute("""
+        CREATE OR REPLACE FUNCTION product_price_bucket(price numeric) RETURNS integer
+        LANGUAGE sql IMMUTABLE AS $$ SELECT width_bucket(price, '{10,25,50,100,250,500}'::numeric[]) $$
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION product_facet_counts_update() RETURNS trigger AS $$
+        DECLARE
+            changes text := CASE TG_OP
+                WHEN 'INSERT' THEN 'SELECT category_id, price, stock, 1 AS delta FROM new_rows'
+                WHEN 'DELETE' THEN 'SELECT category_id, price, stock, -1 AS delta FROM old_rows'
+                ELSE 'SELECT category_id, price, stock, 1 AS delta FROM new_rows '
+                     'UNION ALL SELECT category_id, price, stock, -1 FROM old_rows'
+            END;
+        BEGIN
+            EXECUTE 'INSERT INTO product_facet_counts AS f (category_id, price_bucket, in_stock, count) '
+                'SELECT category_id, product_price_bucket(price), stock > 0, sum(delta) FROM (' || changes || ') AS changes '
+                'GROUP BY 1, 2, 3 HAVING sum(delta) <> 0 ORDER BY 1, 2, 3 '
+                'ON CONFLICT (category_id, price_bucket, in_stock) DO UPDATE SET count = f.count + excluded.count';
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for operation, tables in TRIGGERS.items():
+        op.execute(
+            f"CREATE TRIGGER product_facet_counts_{operation} AFTER {operation.upper()} ON products "
+            f"REFERENCING {tables} FOR EACH STATEMENT EXECUTE FUNCTION product_facet_counts_update()"
+        )
+    # CREATE TRIGGER holds off writes to products until this commits, so no
+    # change can slip between the triggers and the backfill.
+    op.execute("""
+        INSERT INTO product_facet_counts (category_id, price_bucket, in_stock, count)
+        SELECT category_id, product_price_bucket(price), stock > 0, count(*) FROM products
+        GROUP BY 1, 2, 3
+    """)
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_facets', 'products', ['category_id', 'price', 'stock'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_products_facets', table_name='products', postgresql_concurrently=True, if_exists=True)
+    for operation in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS product_facet_counts_{operation} ON products")
+    op.execute("DROP FUNCTION IF EXISTS product_facet_counts_update()")
+    op.execute("DROP FUNCTION IF EXISTS product_price_bucket(numeric)")
+    op.drop_table('product_facet_counts')
@@ -0,0 +1,31 @@
+"""catalog versions
+
+Revision ID: f4c28e1d9b63
+Revises: d3a91c4f7b20
+Create Date: 2026-10-18 14:21:06.518347
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4c28e1d9b63'
+down_revision: Union[str, None] = 'd3a91c4f7b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('catalog_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name', 'shard')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('catalog_versions')
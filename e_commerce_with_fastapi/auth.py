@@ -2,18 +2,28 @@
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
-from fastapi import HTTPException
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+
+import config
+import schemas
 
 SECRET_KEY = "mysecretkey"  # You should store this securely in your environment variables
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
 # Function to create an access token
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
@@ -30,3 +40,105 @@ def verify_access_token(token: str) -> Optional[dict]:
         return payload if "sub" in payload else None
     except JWTError:
         raise credentials_exception
+
+
+class TokenCache:
+    """Decoded tokens, least-recently-used first, each kept until its exp."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def set(self, token: str, exp: float, jti: str, user: schemas.CurrentUser):
+        with self._lock:
+            self._entries[token] = (exp, jti, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class Denylist:
+    """Revoked token ids, each held only until the token would have expired anyway.
+
+    Per process: with several workers, a revocation reaches the others only
+    as fast as the token's own expiry.
+    """
+
+    def __init__(self):
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, jti: str, exp: float):
+        now = time.time()
+        with self._lock:
+            self._revoked = {key: until for key, until in self._revoked.items() if until > now}
+            self._revoked[jti] = exp
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._revoked
+
+
+token_cache = TokenCache(config.AUTH_TOKEN_CACHE_SIZE)
+denylist = Denylist()
+
+
+def decode_token(token: str):
+    """Return (exp, jti, user) for a valid token, decoding each token only once."""
+    entry = token_cache.get(token)
+    if entry is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            entry = (payload["exp"], payload["jti"], schemas.CurrentUser(id=payload["sub"], username=payload["username"]))
+        except (JWTError, KeyError, ValueError):
+            return None
+        token_cache.set(token, *entry)
+    if entry[1] in denylist:
+        return None
+    return entry
+
+
+def bearer_user_id(headers: dict):
+    """The user id in a raw ASGI request's valid bearer token, for middleware."""
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    entry = decode_token(token) if scheme.lower() == "bearer" and token else None
+    return int(entry[2].id) if entry is not None else None
+
+
+# Authenticates from the token's claims alone; routes that need the full user
+# row still load it themselves.
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> schemas.CurrentUser:
+    entry = decode_token(token)
+    if entry is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return entry[2]
+
+
+def ensure_owner(current_user: schemas.CurrentUser, user_id: int):
+    """403 unless the route's user_id is the caller's own."""
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed to act for another user")
+
+
+def revoke_token(token: str) -> bool:
+    entry = decode_token(token)
+    if entry is None:
+        return False
+    exp, jti, user = entry
+    denylist.revoke(jti, exp)
+    return True
@@ -0,0 +1,5 @@
+import os
+
+# Benchmarks measure the database paths; set CACHE_BACKEND explicitly to include
+# the catalog cache.
+os.environ.setdefault("CACHE_BACKEND", "none")
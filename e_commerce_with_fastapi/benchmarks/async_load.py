@@ -0,0 +1,127 @@
+"""Compare the threadpool (DB_ASYNC=0) and asyncio (DB_ASYNC=1) database paths.
+
+    python -m benchmarks.async_load --concurrency 256 --duration 20
+
+Starts ``uvicorn main:app`` once per mode against ``BENCH_DATABASE_URL`` and
+drives ``GET /products/`` with a fixed number of concurrent clients, reporting
+requests/sec and latency percentiles for each mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+import models
+from crud import UserCRUD
+from benchmarks.common import bench_engine, bench_sessionmaker, percentile
+
+
+def seed(engine, products):
+    Session = bench_sessionmaker(engine)
+    tag = uuid.uuid4().hex[:8]
+    with Session() as db:
+        category = models.Category(name=f"load-{tag}")
+        db.add(category)
+        db.flush()
+        db.add_all(
+            models.Product(name=f"load-{tag}-{i}", price=i % 100 + 1, stock=i % 7, category_id=category.id)
+            for i in range(products)
+        )
+        db.commit()
+        username = f"load-{tag}"
+        UserCRUD.create_user(db, username, f"{username}@example.com", "benchmark")
+        return username
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client, deadline=30):
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        try:
+            await client.get("/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(base_url, username, concurrency, duration):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await wait_ready(client)
+        login = await client.post("/login", json={"username": username, "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        latencies, errors = [], 0
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop_at:
+                started = time.perf_counter()
+                response = await client.get("/products/", params={"limit": 20}, headers=headers)
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / wall, 1),
+        "latency_ms_p50": round(percentile(latencies, 50), 2),
+        "latency_ms_p99": round(percentile(latencies, 99), 2),
+    }
+
+
+def run_mode(async_mode, database_url, username, args):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, DB_ASYNC="1" if async_mode else "0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        return asyncio.run(drive(f"http://127.0.0.1:{port}", username, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per mode")
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    database_url = engine.url.render_as_string(hide_password=False)
+    username = seed(engine, args.products)
+
+    report = {
+        "concurrency": args.concurrency,
+        "threadpool": run_mode(False, database_url, username, args),
+        "asyncio": run_mode(True, database_url, username, args),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
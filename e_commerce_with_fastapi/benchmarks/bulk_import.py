@@ -0,0 +1,131 @@
+"""Time POST /products/bulk and GET /products/export on a large catalog.
+
+    python -m benchmarks.bulk_import --rows 1000000
+
+Starts ``uvicorn main:app`` against ``BENCH_DATABASE_URL``, streams a
+generated CSV upload of --rows products, then streams the whole catalog back
+out. Reports rows/sec for each direction and the server's resident memory
+before and after, which should stay flat regardless of --rows.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+import models
+from crud import UserCRUD
+from hashing import pwd_context
+from benchmarks.async_load import free_port
+from benchmarks.common import bench_engine, bench_sessionmaker
+
+
+def seed(engine):
+    Session = bench_sessionmaker(engine)
+    tag = uuid.uuid4().hex[:8]
+    with Session() as db:
+        category = models.Category(name=f"bulk-{tag}")
+        db.add(category)
+        db.commit()
+        username = f"bulk-{tag}"
+        UserCRUD.create_user(db, username, f"{username}@example.com", password_hash=pwd_context.hash("benchmark"))
+        return username, category.id, tag
+
+
+def csv_upload(rows, category_id, tag, chunk_rows=10000):
+    yield b"name,price,stock,category_id\n"
+    for start in range(0, rows, chunk_rows):
+        yield "".join(
+            f"bulk-{tag}-{i},{i % 1000 + 0.99},{i % 50},{category_id}\n"
+            for i in range(start, min(rows, start + chunk_rows))
+        ).encode()
+
+
+def resident_mb(pid, field):
+    # VmRSS is current resident memory, VmHWM its peak so far (Linux only).
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return round(int(line.split()[1]) / 1024, 1)
+
+
+def wait_ready(client, deadline=30):
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        try:
+            client.get("/docs")
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    database_url = engine.url.render_as_string(hide_password=False)
+    username, category_id, tag = seed(engine)
+
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, CACHE_BACKEND="none")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            wait_ready(client)
+            login = client.post("/login", json={"username": username, "password": "benchmark"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            rss_before = resident_mb(server.pid, "VmRSS")
+
+            started = time.perf_counter()
+            response = client.post(
+                "/products/bulk",
+                content=csv_upload(args.rows, category_id, tag),
+                headers={**headers, "Content-Type": "text/csv"},
+            )
+            import_seconds = time.perf_counter() - started
+            result = response.json()
+            peak_after_import = resident_mb(server.pid, "VmHWM")
+
+            exported = 0
+            started = time.perf_counter()
+            with client.stream("GET", "/products/export", headers=headers) as export:
+                for line in export.iter_lines():
+                    exported += 1
+            export_seconds = time.perf_counter() - started
+            peak_after_export = resident_mb(server.pid, "VmHWM")
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "rows": args.rows,
+        "import": {
+            "imported": result["imported"],
+            "failed": result["failed"],
+            "seconds": round(import_seconds, 2),
+            "rows_per_sec": round(result["imported"] / import_seconds),
+        },
+        "export": {
+            "rows": exported - 1,
+            "seconds": round(export_seconds, 2),
+            "rows_per_sec": round((exported - 1) / export_seconds),
+        },
+        "server_rss_mb_before": rss_before,
+        "server_peak_rss_mb_after_import": peak_after_import,
+        "server_peak_rss_mb_after_export": peak_after_export,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
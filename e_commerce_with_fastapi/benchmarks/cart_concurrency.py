@@ -0,0 +1,148 @@
+"""Fire parallel add-to-cart calls at one user's cart and check for lost increments.
+
+    python -m benchmarks.cart_concurrency --adds 500 --workers 32 --batch 10
+
+The user starts without a cart, so the first adds also race to create it.
+Single adds all hit the same product. Batch adds (add_many_to_cart) each add
+one unit of --batch products. Every product must end with exactly one unit
+per add that included it, and the cart's item_count and subtotal must match
+its lines. With --reprice the products' prices keep changing during the adds,
+which must carry over to the lines and the subtotal.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import models, schemas
+from crud import CartCRUD, ProductCRUD
+from benchmarks.common import QueryCounter, bench_engine, bench_sessionmaker, percentile
+
+
+def seed(Session, products):
+    tag = uuid.uuid4().hex[:8]
+    with Session() as db:
+        category = models.Category(name=f"cart-{tag}")
+        user = models.User(username=f"cart-{tag}", email=f"cart-{tag}@example.com", password="x")
+        db.add_all([category, user])
+        db.flush()
+        items = [models.Product(name=f"cart-{tag}-{i}", price=1, stock=1, category_id=category.id) for i in range(products)]
+        db.add_all(items)
+        db.commit()
+        return user.id, [item.id for item in items]
+
+
+@contextmanager
+def repricing(Session, product_ids, enabled):
+    """Keep moving the products' prices between 1 and 9 until the block exits."""
+    stop = threading.Event()
+
+    def reprice():
+        with Session() as db:
+            products = {p: db.get(models.Product, p) for p in product_ids}
+            updates = [
+                (p, schemas.ProductCreate(name=product.name, price=product.price, stock=product.stock, category_id=product.category_id))
+                for p, product in products.items()
+            ]
+        step = 0
+        while not stop.is_set():
+            step += 1
+            for product_id, update in updates:
+                update.price = step % 9 + 1
+                with Session() as db:
+                    ProductCRUD.update_product(db, product_id, update)
+
+    thread = threading.Thread(target=reprice) if enabled else None
+    if thread:
+        thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        if thread:
+            thread.join()
+
+
+def run(Session, counter, workers, adds, add):
+    def timed(i):
+        with Session() as db, counter.counting() as queries:
+            started = time.perf_counter()
+            lines = add(db, i)
+            elapsed = time.perf_counter() - started
+        return lines is not None, queries[0], elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(timed, range(adds)))
+    wall = time.perf_counter() - started
+    latencies = [r[2] * 1000 for r in results]
+    return {
+        "calls": adds,
+        "failed": sum(1 for r in results if not r[0]),
+        "statements_per_call_max": max(r[1] for r in results),
+        "statements_per_call_p50": percentile([r[1] for r in results], 50),
+        "ms_p50": round(percentile(latencies, 50), 2),
+        "ms_p99": round(percentile(latencies, 99), 2),
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def quantities(Session, user_id):
+    with Session() as db:
+        cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).one()
+        return {item.product_id: item.quantity for item in cart.items}
+
+
+def summary_drift(Session, user_id):
+    """How far the cart's totals are from its lines, and its lines' prices from their products'."""
+    with Session() as db:
+        cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).one()
+        return {
+            "item_count": cart.item_count - sum(item.quantity for item in cart.items),
+            "subtotal": float(cart.subtotal - sum(item.quantity * item.price for item in cart.items)),
+            "stale_prices": sum(1 for item in cart.items if item.price != item.product.price),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--adds", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=10, help="products per add_many_to_cart call")
+    parser.add_argument("--reprice", action="store_true", help="change the products' prices while adding")
+    args = parser.parse_args()
+
+    engine = bench_engine(pool_size=args.workers + 1, max_overflow=0)
+    Session = bench_sessionmaker(engine)
+    counter = QueryCounter(engine)
+    report = {"dialect": engine.dialect.name, "workers": args.workers, "reprice": args.reprice}
+
+    user_id, (product_id,) = seed(Session, 1)
+    item = schemas.CartItemCreate(product_id=product_id, quantity=1)
+    with repricing(Session, [product_id], args.reprice):
+        report["add_to_cart"] = run(Session, counter, args.workers, args.adds, lambda db, i: CartCRUD.add_to_cart(db, user_id, item))
+    report["add_to_cart"]["lost_increments"] = args.adds - quantities(Session, user_id).get(product_id, 0)
+    report["add_to_cart"]["summary_drift"] = summary_drift(Session, user_id)
+
+    user_id, product_ids = seed(Session, args.batch)
+    items = [schemas.CartItemCreate(product_id=p, quantity=1) for p in product_ids]
+    with repricing(Session, product_ids, args.reprice):
+        report["add_many_to_cart"] = run(Session, counter, args.workers, args.adds, lambda db, i: CartCRUD.add_many_to_cart(db, user_id, items))
+    totals = quantities(Session, user_id)
+    report["add_many_to_cart"]["lost_increments"] = sum(args.adds - totals.get(p, 0) for p in product_ids)
+    report["add_many_to_cart"]["summary_drift"] = summary_drift(Session, user_id)
+
+    print(json.dumps(report, indent=2))
+    if report["add_to_cart"]["lost_increments"] or report["add_many_to_cart"]["lost_increments"]:
+        raise SystemExit("lost increments detected")
+    # Lines whose price lags their product's (see CartCRUD._reprice_lines) are
+    # reported, not failed; totals that disagree with the lines are.
+    if any(report[name]["summary_drift"][field] for name in ("add_to_cart", "add_many_to_cart") for field in ("item_count", "subtotal")):
+        raise SystemExit("cart totals drifted from the lines")
+
+
+if __name__ == "__main__":
+    main()
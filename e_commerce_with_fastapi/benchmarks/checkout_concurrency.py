@@ -0,0 +1,114 @@
+"""Fire parallel checkouts at a single hot SKU and check for oversell.
+
+    python -m benchmarks.checkout_concurrency --buyers 200 --stock 50 --lines 50
+
+Every buyer gets a cart holding one unit of the hot product plus ``lines - 1``
+other products, so the per-checkout statement count reflects a realistic cart.
+Exactly ``stock`` checkouts must succeed and the hot product must end at zero.
+With --hold each buyer first adds the hot product with ``hold=True``, and only
+buyers whose hold succeeded check out.
+Row locks only matter on PostgreSQL; SQLite serialises writers on its own.
+"""
+import argparse
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import models
+import schemas
+from crud import CartCRUD, InsufficientStock, OrderCRUD
+from benchmarks.common import QueryCounter, bench_engine, bench_sessionmaker, percentile
+
+
+def seed(Session, buyers, stock, lines, hold=False):
+    tag = uuid.uuid4().hex[:8]
+    with Session() as db:
+        category = models.Category(name=f"bench-{tag}")
+        db.add(category)
+        db.flush()
+        hot = models.Product(name=f"hot-{tag}", price=10, stock=stock, category_id=category.id)
+        filler = [
+            models.Product(name=f"filler-{tag}-{i}", price=1, stock=buyers * 10, category_id=category.id)
+            for i in range(lines - 1)
+        ]
+        db.add_all([hot] + filler)
+        db.flush()
+
+        carts = []
+        for i in range(buyers):
+            user = models.User(username=f"buyer-{tag}-{i}", email=f"buyer-{tag}-{i}@example.com", password="x")
+            db.add(user)
+            db.flush()
+            cart_products = filler if hold else [hot] + filler
+            cart = models.Cart(user_id=user.id, item_count=len(cart_products), subtotal=sum(p.price for p in cart_products))
+            db.add(cart)
+            db.flush()
+            db.add_all(models.CartItem(cart_id=cart.id, product_id=p.id, quantity=1, name=p.name, price=p.price) for p in cart_products)
+            carts.append((user.id, cart.id))
+        db.commit()
+        return hot.id, carts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=50, help="cart lines per checkout")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--hold", action="store_true", help="hold the hot product before checking out")
+    args = parser.parse_args()
+
+    engine = bench_engine(pool_size=args.workers, max_overflow=0)
+    Session = bench_sessionmaker(engine)
+    hot_id, carts = seed(Session, args.buyers, args.stock, args.lines, args.hold)
+    counter = QueryCounter(engine)
+
+    def checkout(user_cart):
+        user_id, cart_id = user_cart
+        with Session() as db, counter.counting() as queries:
+            started = time.perf_counter()
+            try:
+                if args.hold:
+                    CartCRUD.add_to_cart(db, user_id, schemas.CartItemCreate(product_id=hot_id, quantity=1), hold=True)
+                order = OrderCRUD.place_order(db, user_id, cart_id)
+            except InsufficientStock:
+                order = None
+            elapsed = time.perf_counter() - started
+        return order is not None, queries[0], elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(checkout, carts))
+    wall = time.perf_counter() - started
+
+    with Session() as db:
+        remaining = db.get(models.Product, hot_id).stock
+        sold = sum(
+            item.quantity
+            for item in db.query(models.OrderItem).filter(models.OrderItem.product_id == hot_id)
+        )
+
+    succeeded = [r for r in results if r[0]]
+    latencies = [r[2] * 1000 for r in succeeded]
+    report = {
+        "buyers": args.buyers,
+        "initial_stock": args.stock,
+        "cart_lines": args.lines,
+        "hold": args.hold,
+        "orders_placed": len(succeeded),
+        "units_sold": sold,
+        "remaining_stock": remaining,
+        "oversold": max(0, sold - args.stock),
+        "queries_per_successful_checkout": max((r[1] for r in succeeded), default=0),
+        "checkout_ms_p50": round(percentile(latencies, 50), 2),
+        "checkout_ms_p99": round(percentile(latencies, 99), 2),
+        "wall_seconds": round(wall, 3),
+    }
+    print(json.dumps(report, indent=2))
+    if report["oversold"] or remaining < 0 or len(succeeded) != min(args.buyers, args.stock):
+        raise SystemExit("oversell or lost sale detected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Shared helpers for the scripts in this package.
+
+Run the benchmarks from the ``e_commerce_with_fastapi`` directory, e.g.
+``python -m benchmarks.checkout_concurrency``. They connect to
+``BENCH_DATABASE_URL`` (falling back to the application database URL) and
+create the tables they need.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import DateTime, create_engine, event, inspect
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+
+
+def bench_engine(**kwargs):
+    url = os.getenv("BENCH_DATABASE_URL", database.SQLALCHEMY_DATABASE_URL)
+    engine = create_engine(url, **kwargs)
+    models.Base.metadata.create_all(engine)
+    # create_all skips tables that already exist; add what was declared since.
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector")
+            for statement in models.PRODUCT_SEARCH_DDL + models.PRODUCT_FACET_DDL:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(models.PRODUCT_FACET_BACKFILL)
+            connection.exec_driver_sql(
+                "ALTER TABLE carts ADD COLUMN IF NOT EXISTS item_count integer NOT NULL DEFAULT 0,"
+                " ADD COLUMN IF NOT EXISTS subtotal numeric NOT NULL DEFAULT 0"
+            )
+            if not any(column["name"] == "price" for column in inspect(connection).get_columns("cart_items")):
+                # Lines left by earlier runs: snapshot them and total their carts, as the migration does.
+                connection.exec_driver_sql("ALTER TABLE cart_items ADD COLUMN name varchar, ADD COLUMN price numeric")
+                connection.exec_driver_sql(
+                    "UPDATE cart_items SET name = products.name, price = products.price FROM products WHERE products.id = cart_items.product_id"
+                )
+                connection.exec_driver_sql("ALTER TABLE cart_items ALTER COLUMN name SET NOT NULL, ALTER COLUMN price SET NOT NULL")
+                connection.exec_driver_sql(
+                    "UPDATE carts SET item_count = lines.item_count, subtotal = lines.subtotal"
+                    " FROM (SELECT cart_id, sum(quantity) AS item_count, sum(quantity * price) AS subtotal FROM cart_items GROUP BY cart_id) AS lines"
+                    " WHERE lines.cart_id = carts.id"
+                )
+            created_at = next(column for column in inspect(connection).get_columns("orders") if column["name"] == "created_at")
+            if not isinstance(created_at["type"], DateTime):
+                connection.exec_driver_sql(
+                    "ALTER TABLE orders ALTER COLUMN created_at TYPE timestamptz"
+                    " USING COALESCE(NULLIF(created_at, '')::timestamp AT TIME ZONE 'UTC', now()),"
+                    " ALTER COLUMN created_at SET DEFAULT now(), ALTER COLUMN created_at SET NOT NULL"
+                )
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    return engine
+
+
+def bench_sessionmaker(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class QueryCounter:
+    """Counts statements sent to an engine, per thread and in total."""
+
+    def __init__(self, engine):
+        self.total = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.count = getattr(self._local, "count", 0) + 1
+        with self._lock:
+            self.total += 1
+
+    @contextmanager
+    def counting(self):
+        """Yields a list that receives this thread's statement count on exit."""
+        self._local.count = 0
+        result = []
+        try:
+            yield result
+        finally:
+            result.append(self._local.count)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
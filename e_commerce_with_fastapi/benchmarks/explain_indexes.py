@@ -0,0 +1,110 @@
+"""Check that every statement the hot CRUD paths issue can be served by an index.
+
+    python -m benchmarks.explain_indexes
+
+PostgreSQL only. Each CRUD call runs inside a transaction that is rolled back
+afterwards; its statements are captured and re-run under EXPLAIN with
+sequential scans disabled. A plan that still reads a table in full (a Seq
+Scan, or an index scan that only filters) has no usable index for its
+predicate. Exits non-zero when one is found.
+"""
+import json
+import sys
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models, schemas
+from crud import CartCRUD, OrderCRUD, ProductCRUD, UserCRUD
+from benchmarks.common import bench_engine
+
+
+def seed(db):
+    tag = uuid.uuid4().hex[:8]
+    user = models.User(username=f"explain-{tag}", email=f"explain-{tag}@example.com", password="x")
+    category = models.Category(name=f"explain-{tag}")
+    db.add_all([user, category])
+    db.flush()
+    products = [models.Product(name=f"explain-{tag}-{i}", price=i, stock=i % 3, category_id=category.id) for i in range(20)]
+    db.add_all(products)
+    db.flush()
+    return user, category, products
+
+
+def scenarios(db, user, category, products):
+    yield "get_user_by_id", lambda: UserCRUD.get_user_by_id(db, user.id)
+    yield "get_user_by_username", lambda: UserCRUD.get_user_by_username(db, user.username)
+    yield "get_user_by_email", lambda: UserCRUD.get_user_by_email(db, user.email)
+    yield "get_products(category)", lambda: ProductCRUD.get_products(db, category_id=category.id)
+    yield "get_products(in_stock)", lambda: ProductCRUD.get_products(db, in_stock=True)
+    yield "get_products(out_of_stock)", lambda: ProductCRUD.get_products(db, in_stock=False)
+    yield "get_products(price range)", lambda: ProductCRUD.get_products(db, min_price=5, max_price=10, sort="price")
+    yield "get_products(price cursor)", lambda: ProductCRUD.get_products(db, sort="price", after=(products[3].price, products[3].id))
+    yield "get_products(name cursor)", lambda: ProductCRUD.get_products(db, sort="name", after=(products[3].name, products[3].id))
+    yield "search_products", lambda: ProductCRUD.search_products(db, products[3].name, fuzzy=False)
+    yield "search_products(fuzzy)", lambda: ProductCRUD.search_products(db, products[3].name)
+    yield "get_cart", lambda: CartCRUD.get_cart(db, user.id)
+    yield "add_to_cart", lambda: CartCRUD.add_to_cart(db, user.id, schemas.CartItemCreate(product_id=products[2].id, quantity=1))
+    yield "add_to_cart(again)", lambda: CartCRUD.add_to_cart(db, user.id, schemas.CartItemCreate(product_id=products[2].id, quantity=1))
+    yield "add_many_to_cart", lambda: CartCRUD.add_many_to_cart(db, user.id, [schemas.CartItemCreate(product_id=p.id, quantity=1) for p in products[4:8]])
+    yield "place_order", lambda: OrderCRUD.place_order(db, user.id, CartCRUD.get_cart(db, user.id).id)
+
+
+def seq_scans(plan):
+    """Relations read in full: seq scans, and index scans that only filter."""
+    found = []
+    node = plan.get("Node Type")
+    if node == "Seq Scan" or (node in ("Index Scan", "Index Only Scan") and "Filter" in plan and "Index Cond" not in plan):
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def main():
+    engine = bench_engine()
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("explain_indexes needs PostgreSQL")
+
+    failures = []
+    with engine.connect() as connection:
+        outer = connection.begin()
+        # CRUD commits become savepoints, so the whole run can be rolled back.
+        db = Session(bind=connection, join_transaction_mode="create_savepoint", autoflush=False)
+        user, category, products = seed(db)
+
+        captured = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+                captured.append((statement, parameters))
+
+        for name, call in scenarios(db, user, category, products):
+            captured.clear()
+            event.listen(engine, "before_cursor_execute", capture)
+            try:
+                call()
+            finally:
+                event.remove(engine, "before_cursor_execute", capture)
+
+            for statement, parameters in list(captured):
+                connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+                # SSD-class page costs, so a short ordered walk of the primary key
+                # under LIMIT does not hide a missing filter index.
+                connection.exec_driver_sql("SET LOCAL random_page_cost = 1.1")
+                explain = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+                plan = (explain if isinstance(explain, list) else json.loads(explain))[0]["Plan"]
+                tables = seq_scans(plan)
+                status = "seq scan on " + ", ".join(tables) if tables else "index"
+                print(f"{name:28} {status:30} {statement.split(chr(10))[0][:70]}")
+                if tables:
+                    failures.append(name)
+        outer.rollback()
+
+    if failures:
+        sys.exit(f"sequential scans in: {', '.join(sorted(set(failures)))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Facet counts in one statement versus one count query per facet value.
+
+    python -m benchmarks.facets --rows 1000000
+
+Seeds the same catalog as ``benchmarks.pagination`` and, for a few filter
+sets, times ``ProductCRUD._count_facets`` (the uncached facets=true path:
+product_facet_counts on PostgreSQL without a price range, a GROUP BY over
+products otherwise) against what a client had to do before: one filtered
+count per category, per price bucket and per stock state.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import func
+
+import models
+from crud import ProductCRUD
+from benchmarks.common import QueryCounter, bench_engine, bench_sessionmaker
+from benchmarks.pagination import seed
+
+
+def per_facet_counts(db, category_id, min_price, max_price, in_stock):
+    def count(**extra):
+        filters = dict(category_id=category_id, min_price=min_price, max_price=max_price, in_stock=in_stock)
+        query = ProductCRUD._filter_products(db.query(func.count(models.Product.id)), **filters)
+        if "category" in extra:
+            query = query.filter(models.Product.category_id == extra["category"])
+        if "low" in extra and extra["low"] is not None:
+            query = query.filter(models.Product.price >= extra["low"])
+        if "high" in extra and extra["high"] is not None:
+            query = query.filter(models.Product.price < extra["high"])
+        if "available" in extra:
+            query = query.filter(models.Product.stock > 0 if extra["available"] else models.Product.stock == 0)
+        return query.scalar()
+
+    category_ids = [row[0] for row in db.query(models.Category.id)]
+    bounds = [None, *models.PRICE_FACET_BOUNDS, None]
+    return {
+        "categories": [count(category=c) for c in category_ids],
+        "price_buckets": [count(low=bounds[i], high=bounds[i + 1]) for i in range(len(bounds) - 1)],
+        "stock": [count(available=True), count(available=False)],
+    }
+
+
+def timed(counter, fn, repeat):
+    samples, statements = [], 0
+    for _ in range(repeat):
+        with counter.counting() as queries:
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        statements = queries[0]
+    return {"ms_p50": round(statistics.median(samples), 2), "statements": statements}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    category_id = seed(engine, args.rows)
+    counter = QueryCounter(engine)
+    Session = bench_sessionmaker(engine)
+
+    filter_sets = {
+        "none": dict(category_id=None, min_price=None, max_price=None, in_stock=None),
+        "category": dict(category_id=category_id, min_price=None, max_price=None, in_stock=None),
+        "category+price+in_stock": dict(category_id=category_id, min_price=10, max_price=100, in_stock=True),
+    }
+    results = {}
+    with Session() as db:
+        total_rows = db.scalar(func.count(models.Product.id).select())
+        for name, filters in filter_sets.items():
+            results[name] = {
+                "facets": timed(counter, lambda: ProductCRUD._count_facets(db, **filters), args.repeat),
+                "per_facet": timed(counter, lambda: per_facet_counts(db, **filters), args.repeat),
+            }
+
+    print(json.dumps({"dialect": engine.dialect.name, "catalog_rows": total_rows, "filters": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
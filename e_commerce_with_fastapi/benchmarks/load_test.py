@@ -0,0 +1,371 @@
+"""Scripted load test of the whole API, for comparing one commit with another.
+
+    python -m benchmarks.load_test --products 20000 --concurrency 32 --duration 30 --output before.json
+    python -m benchmarks.load_test --products 20000 --concurrency 32 --duration 30 --compare before.json
+
+Seeds users, categories, products, filled carts and past orders (--seed makes
+both the data and the request mix repeatable), starts ``uvicorn main:app``
+against that database (or targets an already running --base-url), and has
+--concurrency virtual users log in and then loop over a weighted mix of
+scenarios (--mix) for --duration seconds after a --warmup:
+
+    browse    GET /products/ with random filters and sort, following the next cursor half the time
+    cart      add a random product to the user's cart
+    checkout  add two or three products, read the cart and check out
+    orders    GET /users/{user_id}/orders, following the next cursor half the time
+    login     POST /login
+
+Prints, per endpoint, requests/sec, non-2xx responses, p50/p95/p99 latency
+and SQL statements per request (taken from the server's /metrics), as JSON.
+With --compare, the relative change against an earlier report is added.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy import insert, select
+
+import models
+from hashing import pwd_context
+from benchmarks.async_load import free_port, wait_ready
+from benchmarks.common import bench_engine, bench_sessionmaker, percentile
+
+PASSWORD = "benchmark"
+WORDS = ["red", "blue", "classic", "wool", "leather", "running", "travel", "compact", "shoes", "jacket", "lamp", "mug", "backpack", "watch", "chair", "scarf"]
+DEFAULT_MIX = "browse=65,cart=15,checkout=10,orders=5,login=5"
+METRIC_LINE = re.compile(r'^http_request_db_queries_(sum|count)\{method="([^"]+)",route="([^"]+)"\} (\S+)$')
+
+
+def seed(engine, args):
+    """Insert a fresh, tagged data set; returns the ids the scenarios draw from."""
+    rng = random.Random(args.seed)
+    tag = uuid.uuid4().hex[:8]
+    password_hash = pwd_context.hash(PASSWORD)
+    Session = bench_sessionmaker(engine)
+    with Session() as db:
+        db.execute(insert(models.User), [
+            {"username": f"load-{tag}-{i}", "email": f"load-{tag}-{i}@example.com", "password": password_hash}
+            for i in range(args.users)
+        ])
+        db.execute(insert(models.Category), [{"name": f"load-{tag}-{i}"} for i in range(args.categories)])
+        users = db.scalars(select(models.User.id).where(models.User.username.like(f"load-{tag}-%")).order_by(models.User.id)).all()
+        categories = db.scalars(select(models.Category.id).where(models.Category.name.like(f"load-{tag}-%"))).all()
+
+        for start in range(0, args.products, 10000):
+            db.execute(insert(models.Product), [
+                {
+                    "name": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {start + i}",
+                    "price": round(rng.uniform(1, 600), 2),
+                    # Plenty of stock so checkouts keep succeeding; a tenth is sold out for in_stock filters.
+                    "stock": 0 if rng.random() < 0.1 else 1_000_000,
+                    "category_id": rng.choice(categories),
+                }
+                for i in range(min(10000, args.products - start))
+            ])
+        products = db.execute(
+            select(models.Product.id, models.Product.price).where(models.Product.category_id.in_(categories))
+        ).all()
+        in_stock_products = db.execute(
+            select(models.Product.id, models.Product.name, models.Product.price)
+            .where(models.Product.category_id.in_(categories), models.Product.stock > 0)
+        ).all()
+        in_stock = [product.id for product in in_stock_products]
+
+        # Carts for the users the virtual users do not log in as, so the cart table has realistic volume.
+        cart_users = users[args.concurrency:args.concurrency + args.carts]
+        cart_lines = {
+            user_id: [(product, rng.randint(1, 3)) for product in rng.sample(in_stock_products, rng.randint(1, 5))]
+            for user_id in cart_users
+        }
+        if cart_lines:
+            db.execute(insert(models.Cart), [
+                {"user_id": user_id, "item_count": sum(quantity for _, quantity in lines), "subtotal": sum(product.price * quantity for product, quantity in lines)}
+                for user_id, lines in cart_lines.items()
+            ])
+            carts = dict(db.execute(select(models.Cart.user_id, models.Cart.id).where(models.Cart.user_id.in_(cart_users))).all())
+            db.execute(insert(models.CartItem), [
+                {"cart_id": carts[user_id], "product_id": product.id, "quantity": quantity, "name": product.name, "price": product.price}
+                for user_id, lines in cart_lines.items()
+                for product, quantity in lines
+            ])
+
+        now = datetime.now(timezone.utc)
+        stats = defaultdict(lambda: [0, 0])
+        for start in range(0, args.orders, 10000):
+            orders = []
+            for _ in range(min(10000, args.orders - start)):
+                items = [(*rng.choice(products), rng.randint(1, 3)) for _ in range(rng.randint(1, 3))]
+                orders.append((rng.choice(users), items))
+            rows = []
+            for user_id, items in orders:
+                total = sum(price * quantity for _, price, quantity in items)
+                stats[user_id][0] += 1
+                stats[user_id][1] += total
+                rows.append({
+                    "user_id": user_id, "total_price": total, "status": "Completed",
+                    "created_at": now - timedelta(seconds=rng.uniform(0, 365 * 86400)),
+                })
+            ids = db.scalars(insert(models.Order).returning(models.Order.id), rows).all()
+            db.execute(insert(models.OrderItem), [
+                {"order_id": order_id, "product_id": product_id, "quantity": quantity, "price": price}
+                for order_id, (_, items) in zip(ids, orders)
+                for product_id, price, quantity in items
+            ])
+        if stats:
+            db.execute(insert(models.UserOrderStats), [
+                {"user_id": user_id, "order_count": count, "total_spent": total}
+                for user_id, (count, total) in stats.items()
+            ])
+        db.commit()
+
+    return {
+        "usernames": [f"load-{tag}-{i}" for i in range(args.concurrency)],
+        "user_ids": users[:args.concurrency],
+        "categories": categories,
+        "in_stock": in_stock,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.measuring = False
+
+    async def request(self, client, endpoint, method, url, **kwargs):
+        """Send one request, recording it under endpoint ("METHOD /route/template")."""
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        if self.measuring:
+            if response is None or not response.is_success:
+                self.failures[endpoint] += 1
+            else:
+                self.latencies[endpoint].append((time.perf_counter() - started) * 1000)
+        return response if response is not None and response.is_success else None
+
+
+async def browse(client, recorder, user, rng, data):
+    params = {"limit": 20, "sort": rng.choice(["id", "price", "name"])}
+    if rng.random() < 0.6:
+        params["category_id"] = rng.choice(data["categories"])
+    if rng.random() < 0.4:
+        low = rng.choice([0, 10, 25, 50, 100])
+        params.update(min_price=low, max_price=low * 4 + 50)
+    if rng.random() < 0.3:
+        params["in_stock"] = "true"
+    response = await recorder.request(client, "GET /products/", "GET", "/products/", params=params, headers=user["headers"])
+    cursor = response.headers.get("x-next-cursor") if response is not None else None
+    if cursor and rng.random() < 0.5:
+        await recorder.request(client, "GET /products/", "GET", "/products/", params={**params, "cursor": cursor}, headers=user["headers"])
+
+
+async def add_to_cart(client, recorder, user, rng, data):
+    item = {"product_id": rng.choice(data["in_stock"]), "quantity": 1}
+    await recorder.request(client, "POST /{user_id}/cart/add", "POST", f"/{user['id']}/cart/add", json=item, headers=user["headers"])
+
+
+async def checkout(client, recorder, user, rng, data):
+    for product_id in rng.sample(data["in_stock"], rng.randint(2, 3)):
+        item = {"product_id": product_id, "quantity": 1}
+        await recorder.request(client, "POST /{user_id}/cart/add", "POST", f"/{user['id']}/cart/add", json=item, headers=user["headers"])
+    cart = await recorder.request(client, "GET /{user_id}/cart", "GET", f"/{user['id']}/cart", headers=user["headers"])
+    if cart is not None:
+        await recorder.request(client, "POST /checkout/{user_id}", "POST", f"/checkout/{user['id']}", params={"cart_id": cart.json()["id"]}, headers=user["headers"])
+
+
+async def order_history(client, recorder, user, rng, data):
+    response = await recorder.request(client, "GET /users/{user_id}/orders", "GET", f"/users/{user['id']}/orders", headers=user["headers"])
+    cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+    if cursor and rng.random() < 0.5:
+        await recorder.request(client, "GET /users/{user_id}/orders", "GET", f"/users/{user['id']}/orders", params={"cursor": cursor}, headers=user["headers"])
+
+
+async def login(client, recorder, user, rng, data):
+    await recorder.request(client, "POST /login", "POST", "/login", json={"username": user["username"], "password": PASSWORD})
+
+
+SCENARIOS = {"browse": browse, "cart": add_to_cart, "checkout": checkout, "orders": order_history, "login": login}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def query_counts(client):
+    """{(method, route): [statements, requests]} from the server's /metrics, if it has one."""
+    response = await client.get("/metrics")
+    counts = defaultdict(lambda: [0.0, 0.0])
+    if response.status_code != 200:
+        return None
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            counts[(method, route)][0 if kind == "sum" else 1] = float(value)
+    return counts
+
+
+async def drive(base_url, data, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    # /metrics is scraped on a connection of its own rather than queueing behind the load.
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client, httpx.AsyncClient(base_url=base_url, timeout=120) as scraper:
+        await wait_ready(client)
+        users = []
+        for user_id, username in zip(data["user_ids"], data["usernames"]):
+            token = (await client.post("/login", json={"username": username, "password": PASSWORD})).json()["access_token"]
+            users.append({"id": user_id, "username": username, "headers": {"Authorization": f"Bearer {token}"}})
+
+        recorder = Recorder()
+        names, weights = list(args.mix), list(args.mix.values())
+        stop_at = time.perf_counter() + args.warmup + args.duration
+
+        async def virtual_user(index, user):
+            rng = random.Random(args.seed * 1000 + index)
+            while time.perf_counter() < stop_at:
+                await SCENARIOS[rng.choices(names, weights)[0]](client, recorder, user, rng, data)
+
+        async def measure():
+            await asyncio.sleep(args.warmup)
+            before = await query_counts(scraper)
+            recorder.measuring = True
+            started = time.perf_counter()
+            await asyncio.sleep(max(0.0, stop_at - time.perf_counter()))
+            recorder.measuring = False
+            return before, time.perf_counter() - started
+
+        (before, wall), *_ = await asyncio.gather(measure(), *(virtual_user(i, user) for i, user in enumerate(users)))
+        after = await query_counts(scraper)
+
+    endpoints = {}
+    for endpoint in sorted(set(recorder.latencies) | set(recorder.failures)):
+        latencies = recorder.latencies[endpoint]
+        queries = None
+        if before is not None and after is not None:
+            route = tuple(endpoint.split(" ", 1))
+            statements, requests = (a - b for a, b in zip(after[route], before[route]))
+            queries = round(statements / requests, 2) if requests else None
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "failed": recorder.failures[endpoint],
+            "requests_per_sec": round(len(latencies) / wall, 1),
+            "latency_ms_p50": round(percentile(latencies, 50), 2),
+            "latency_ms_p95": round(percentile(latencies, 95), 2),
+            "latency_ms_p99": round(percentile(latencies, 99), 2),
+            "queries_per_request": queries,
+        }
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {"seconds": round(wall, 2), "requests": total, "requests_per_sec": round(total / wall, 1), "endpoints": endpoints}
+
+
+def start_server(database_url):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url)
+    # Every virtual user runs flat out from one address; per-caller rate limits
+    # would measure the limiter rather than the API.
+    env.setdefault("RATE_LIMIT_PER_SECOND", "0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare(report, baseline):
+    """Relative change of each endpoint's figures against a baseline report."""
+    def change(old, new):
+        if old is None or new is None:
+            return None
+        if not old:
+            return "n/a" if new else "+0.0%"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    changes = {"requests_per_sec": change(baseline.get("requests_per_sec"), report["requests_per_sec"]), "endpoints": {}}
+    for endpoint, now in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if before:
+            changes["endpoints"][endpoint] = {
+                metric: change(before.get(metric), now[metric])
+                for metric in ("requests_per_sec", "latency_ms_p50", "latency_ms_p95", "latency_ms_p99", "queries_per_request")
+            }
+    return {"baseline_commit": baseline.get("commit"), **changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--carts", type=int, default=500, help="pre-filled carts of users the load does not log in as")
+    parser.add_argument("--orders", type=int, default=5000, help="past orders")
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users, each logged in as its own user")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of load before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--base-url", help="drive a running server on the same database instead of starting one")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+    args.users = max(args.users, args.concurrency)
+
+    engine = bench_engine()
+    data = seed(engine, args)
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = start_server(engine.url.render_as_string(hide_password=False))
+    try:
+        results = asyncio.run(drive(base_url, data, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "dialect": engine.dialect.name,
+        "settings": {
+            name: getattr(args, name)
+            for name in ("users", "categories", "products", "carts", "orders", "concurrency", "duration", "warmup", "mix", "seed")
+        },
+        **results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Measure POST /login throughput with bcrypt in the threadpool vs. in worker processes.
+
+    BCRYPT_ROUNDS=12 python -m benchmarks.login_throughput --concurrency 64 --duration 20
+
+Starts ``uvicorn main:app`` once with HASH_WORKERS=0 (bcrypt runs on the
+request threadpool, as before the hashing pool existed) and once with
+--workers hashing processes, and reports logins/sec overall and per core.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+import config
+from crud import UserCRUD
+from hashing import pwd_context
+from benchmarks.async_load import free_port, wait_ready
+from benchmarks.common import bench_engine, bench_sessionmaker, percentile
+
+
+def seed(engine):
+    Session = bench_sessionmaker(engine)
+    username = f"login-{uuid.uuid4().hex[:8]}"
+    with Session() as db:
+        UserCRUD.create_user(db, username, f"{username}@example.com", password_hash=pwd_context.hash("benchmark"))
+    return username
+
+
+async def drive(base_url, username, concurrency, duration):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await wait_ready(client)
+        credentials = {"username": username, "password": "benchmark"}
+        await client.post("/login", json=credentials)  # start the hashing workers
+
+        latencies, errors = [], 0
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop_at:
+                started = time.perf_counter()
+                response = await client.post("/login", json=credentials)
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {
+        "logins": len(latencies),
+        "errors": errors,
+        "logins_per_sec": round(len(latencies) / wall, 2),
+        "latency_ms_p50": round(percentile(latencies, 50), 2),
+        "latency_ms_p99": round(percentile(latencies, 99), 2),
+    }
+
+
+def run_mode(hash_workers, database_url, username, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        HASH_WORKERS=str(hash_workers),
+        HASH_MAX_PENDING=str(args.concurrency),
+        CACHE_BACKEND="none",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        result = asyncio.run(drive(f"http://127.0.0.1:{port}", username, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+    result["logins_per_sec_per_core"] = round(result["logins_per_sec"] / max(1, hash_workers or os.cpu_count()), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per mode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="hashing processes")
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    database_url = engine.url.render_as_string(hide_password=False)
+    username = seed(engine)
+
+    report = {
+        "bcrypt_rounds": config.BCRYPT_ROUNDS,
+        "cpu_count": os.cpu_count(),
+        "concurrency": args.concurrency,
+        "threadpool": run_mode(0, database_url, username, args),
+        "process_pool": run_mode(args.workers, database_url, username, args),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Deep-page latency of OFFSET versus keyset pagination on GET /products/.
+
+    python -m benchmarks.pagination --rows 1000000 --pages 1,10,100,1000
+
+Seeds a dedicated category with ``rows`` products (once; reruns reuse it) and
+times ``ProductCRUD.get_products`` for each page number, once with ``skip``
+and once with the ``after`` key the previous page's cursor would carry.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import func, select, text
+
+import models
+from crud import ProductCRUD, PRODUCT_SORT_COLUMNS
+from benchmarks.common import bench_engine, bench_sessionmaker
+
+CATEGORY = "bench-pagination"
+
+
+def seed(engine, rows):
+    Session = bench_sessionmaker(engine)
+    with Session() as db:
+        category = db.query(models.Category).filter_by(name=CATEGORY).first()
+        if category is None:
+            category = models.Category(name=CATEGORY)
+            db.add(category)
+            db.commit()
+        existing = db.scalar(select(func.count()).where(models.Product.category_id == category.id))
+        missing = rows - existing
+        if missing > 0:
+            if engine.dialect.name == "postgresql":
+                db.execute(text(
+                    "INSERT INTO products (name, price, stock, category_id) "
+                    "SELECT 'item-' || md5(g::text), (g % 997) + 0.99, g % 50, :category "
+                    "FROM generate_series(1, :n) AS g"
+                ), {"category": category.id, "n": missing})
+            else:
+                for start in range(0, missing, 10000):
+                    db.execute(models.Product.__table__.insert(), [
+                        {"name": f"item-{start + i:08d}", "price": (start + i) % 997 + 0.99, "stock": i % 50, "category_id": category.id}
+                        for i in range(min(10000, missing - start))
+                    ])
+            db.commit()
+            if engine.dialect.name == "postgresql":
+                db.execute(text("ANALYZE products"))
+                db.commit()
+        return category.id
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", default="1,10,100,1000")
+    parser.add_argument("--sort", choices=sorted(PRODUCT_SORT_COLUMNS), default="price")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    category_id = seed(engine, args.rows)
+    Session = bench_sessionmaker(engine)
+    sort_column = PRODUCT_SORT_COLUMNS[args.sort]
+
+    results = []
+    with Session() as db:
+        for page in (int(p) for p in args.pages.split(",")):
+            skip = (page - 1) * args.limit
+            after = None
+            if skip:
+                # The key a client would hold after reading the previous page.
+                after = tuple(db.execute(
+                    select(sort_column, models.Product.id)
+                    .where(models.Product.category_id == category_id)
+                    .order_by(sort_column, models.Product.id)
+                    .offset(skip - 1).limit(1)
+                ).one())
+            offset_ms = timed(lambda: ProductCRUD.get_products(
+                db, category_id=category_id, skip=skip, limit=args.limit, sort=args.sort), args.repeat)
+            keyset_ms = timed(lambda: ProductCRUD.get_products(
+                db, category_id=category_id, limit=args.limit, sort=args.sort, after=after), args.repeat)
+            results.append({"page": page, "offset_ms": offset_ms, "keyset_ms": keyset_ms})
+
+    print(json.dumps({"rows": args.rows, "limit": args.limit, "sort": args.sort, "pages": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
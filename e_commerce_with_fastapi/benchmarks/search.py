@@ -0,0 +1,155 @@
+"""Latency of ProductCRUD.search_products on a multi-million-row catalog.
+
+    python -m benchmarks.search --rows 2000000 --queries 200
+
+PostgreSQL only. Seeds a dedicated category with ``rows`` products named from
+a small vocabulary ("<brand> <color> <material> <adjective> <noun>"; once,
+reruns reuse it), then times first-page searches for phrases a shopper would
+type, with and without fuzzy matching, plus misspelled phrases with fuzzy
+matching. Also prints the plan of one search so it can be checked that both
+GIN indexes are used.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from sqlalchemy import event, func, select, text
+
+import models
+from crud import ProductCRUD
+from benchmarks.common import bench_engine, bench_sessionmaker, percentile
+
+CATEGORY = "bench-search"
+BRANDS = [f"{prefix}{suffix}" for prefix in ("acme", "nordic", "urban", "alpine", "vertex", "summit", "harbor", "pioneer", "atlas", "zenith")
+          for suffix in ("wear", "gear", "works", "line", "craft", "labs", "co", "sport", "home", "outfitters")]
+COLORS = ["red", "blue", "green", "black", "white", "grey", "navy", "olive", "orange", "purple", "yellow", "brown", "pink", "teal", "beige", "maroon", "silver", "gold", "ivory", "charcoal"]
+MATERIALS = ["leather", "cotton", "wool", "linen", "denim", "suede", "canvas", "nylon", "polyester", "silk", "bamboo", "steel", "aluminium", "oak", "walnut", "ceramic", "glass", "rubber", "cashmere", "fleece", "velvet", "hemp", "cork", "copper", "marble"]
+ADJECTIVES = ["running", "hiking", "waterproof", "lightweight", "classic", "vintage", "slim", "oversized", "insulated", "breathable", "compact", "foldable", "wireless", "ergonomic", "handmade", "organic", "reversible", "stretch", "padded", "quilted",
+              "heavy", "soft", "rugged", "casual", "formal", "travel", "outdoor", "indoor", "kids", "premium"]
+NOUNS = ["shoes", "boots", "sandals", "sneakers", "jacket", "coat", "shirt", "sweater", "hoodie", "trousers", "shorts", "skirt", "dress", "scarf", "gloves", "hat", "backpack", "wallet", "belt", "watch",
+         "headphones", "speaker", "lamp", "chair", "table", "mug", "kettle", "blanket", "pillow", "towel", "umbrella", "tent", "bottle", "notebook", "pen", "socks", "vest", "cap", "bag", "rug"]
+
+
+def seed(engine, rows):
+    Session = bench_sessionmaker(engine)
+    with Session() as db:
+        category = db.query(models.Category).filter_by(name=CATEGORY).first()
+        if category is None:
+            category = models.Category(name=CATEGORY)
+            db.add(category)
+            db.commit()
+        existing = db.scalar(select(func.count()).where(models.Product.category_id == category.id))
+        missing = rows - existing
+        if missing > 0:
+            # Each word is picked by an independent hash of the row number, so
+            # every combination occurs; the trigger fills search_vector.
+            words = " || ' ' || ".join(
+                f"(:{name})[1 + abs(hashtext(g || '{name}')) % cardinality(:{name})]"
+                for name in ("brands", "colors", "materials", "adjectives", "nouns")
+            )
+            db.execute(text(
+                "INSERT INTO products (name, price, stock, category_id) "
+                f"SELECT initcap({words} || ' ' || to_hex(g)), "
+                "(g % 997) + 0.99, g % 50, :category "
+                "FROM generate_series(:start, :stop) AS g"
+            ), {
+                "brands": BRANDS, "colors": COLORS, "materials": MATERIALS, "adjectives": ADJECTIVES, "nouns": NOUNS,
+                "category": category.id, "start": existing + 1, "stop": rows,
+            })
+            db.commit()
+            db.execute(text("ANALYZE products"))
+            db.commit()
+        return category.id
+
+
+def misspell(word, rng):
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def phrases(count, rng):
+    shapes = [
+        lambda: f"{rng.choice(BRANDS)} {rng.choice(NOUNS)}",
+        lambda: f"{rng.choice(COLORS)} {rng.choice(MATERIALS)} {rng.choice(NOUNS)}",
+        lambda: f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(COLORS)}",
+    ]
+    return [rng.choice(shapes)() for _ in range(count)]
+
+
+def run(Session, queries, limit, fuzzy):
+    samples, hits = [], []
+    with Session() as db:
+        for q in queries:
+            started = time.perf_counter()
+            rows = ProductCRUD.search_products(db, q, limit=limit, fuzzy=fuzzy)
+            samples.append((time.perf_counter() - started) * 1000)
+            hits.append(len(rows))
+    return {
+        "queries": len(queries),
+        "ms_p50": round(statistics.median(samples), 3),
+        "ms_p95": round(percentile(samples, 95), 3),
+        "ms_p99": round(percentile(samples, 99), 3),
+        "empty_pages": sum(1 for h in hits if h == 0),
+    }
+
+
+def plan_indexes(engine, q):
+    """Indexes the plan of a fuzzy search for q reads."""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    Session = bench_sessionmaker(engine)
+    with Session() as db:
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            ProductCRUD.search_products(db, q, fuzzy=True)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        statement, parameters = captured[-1]
+        plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()[0]["Plan"]
+
+    found, nodes = set(), [plan]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            found.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+    return sorted(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("search needs PostgreSQL")
+    seed(engine, args.rows)
+    Session = bench_sessionmaker(engine)
+
+    rng = random.Random(args.seed)
+    queries = phrases(args.queries, rng)
+    typos = [" ".join(misspell(word, rng) if len(word) > 4 else word for word in q.split()) for q in phrases(args.queries, rng)]
+
+    run(Session, queries[:10], args.limit, False)  # warm the cache
+    report = {
+        "rows": args.rows,
+        "limit": args.limit,
+        "full_text": run(Session, queries, args.limit, False),
+        "fuzzy": run(Session, queries, args.limit, True),
+        "fuzzy_misspelled": run(Session, typos, args.limit, True),
+    }
+    report["plan_indexes"] = plan_indexes(engine, queries[0])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
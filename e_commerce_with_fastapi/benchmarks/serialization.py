@@ -0,0 +1,83 @@
+"""Rows/sec and peak memory of one large GET /products/ page, with and without FAST_RESPONSES.
+
+    python -m benchmarks.serialization --rows 10000 --repeat 5
+
+Seeds the same catalog as ``benchmarks.pagination`` and requests --rows of it
+as a single page from the app in-process, with the catalog cache off so
+every request loads and serializes all rows. Peak memory is the tracemalloc
+peak over one request, response body included. Also checks that both paths
+return the same JSON.
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from fastapi.testclient import TestClient
+
+import config
+from auth import create_access_token
+from database import get_db
+from main import app
+from benchmarks.common import bench_engine, bench_sessionmaker
+from benchmarks.pagination import seed
+
+
+def measure(client, params, headers, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get("/products/", params=params, headers=headers)
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+
+    tracemalloc.start()
+    body = client.get("/products/", params=params, headers=headers).content
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    rows = len(json.loads(body))
+    seconds = statistics.median(samples)
+    return {
+        "rows": rows,
+        "ms_p50": round(seconds * 1000, 1),
+        "rows_per_sec": round(rows / seconds),
+        "peak_mb": round(peak / 2**20, 1),
+        "body_bytes": len(body),
+    }, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    category_id = seed(engine, args.rows)
+    Session = bench_sessionmaker(engine)
+
+    def bench_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = bench_db
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "0", "username": f"bench-{uuid.uuid4().hex[:8]}"})}
+    params = {"category_id": category_id, "limit": args.rows}
+
+    report = {"dialect": engine.dialect.name}
+    bodies = {}
+    with TestClient(app) as client:
+        for name, fast in (("pydantic", False), ("fast", True)):
+            config.FAST_RESPONSES = fast
+            client.get("/products/", params=params, headers=headers)  # warm up
+            report[name], bodies[name] = measure(client, params, headers, args.repeat)
+    report["same_json"] = json.loads(bodies["pydantic"]) == json.loads(bodies["fast"])
+    report["speedup"] = round(report["fast"]["rows_per_sec"] / report["pydantic"]["rows_per_sec"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Compare cold starts of ``uvicorn main:app`` and ``serve.py``.
+
+    python -m benchmarks.startup --workers 2 --repeat 3
+
+Starts each server against ``BENCH_DATABASE_URL`` and, once it reports
+ready, logs in once and then sends ``GET /products/`` over a new connection
+each time, so requests spread over the workers. Reported per mode, as
+medians over the runs:
+
+- accept_seconds: launch until the first HTTP response
+- ready_seconds: launch until ``/health/ready`` answers 200
+- first_login_ms / steady_login_ms: the first login against the median of
+  ten after the listings
+- first_request_ms / steady_request_ms: the first listing against the
+  median of the last half
+- first_fast_seconds: launch until a listing completes within twice the
+  steady median (time-to-first-fast-request)
+
+uvicorn runs with WARM_UP=0, as it did before serve.py existed, so it
+reports ready as soon as it accepts.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.async_load import free_port, seed
+from benchmarks.common import bench_engine
+
+
+def wait_for(client, path, launched, deadline=60):
+    while time.perf_counter() - launched < deadline:
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter() - launched
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{path} did not answer 200")
+
+
+def timed(send):
+    started = time.perf_counter()
+    response = send()
+    response.raise_for_status()
+    return response, (time.perf_counter() - started) * 1000
+
+
+def run_once(mode, database_url, username, args):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, RATE_LIMIT_PER_SECOND="0")
+    if mode == "uvicorn":
+        env["WARM_UP"] = "0"
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "serve.py", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"]
+    launched = time.perf_counter()
+    server = subprocess.Popen(command, env=env)
+    # No keep-alive: every request opens a connection, which any worker may accept.
+    limits = httpx.Limits(max_keepalive_connections=0)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            accept_seconds = wait_for(client, "/health/live", launched)
+            ready_seconds = wait_for(client, "/health/ready", launched)
+            credentials = {"username": username, "password": "benchmark"}
+            login, first_login_ms = timed(lambda: client.post("/login", json=credentials))
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            samples = []
+            for _ in range(args.requests):
+                _, latency = timed(lambda: client.get("/products/", params={"limit": 20}, headers=headers))
+                samples.append((time.perf_counter() - launched, latency))
+            steady_login_ms = statistics.median(timed(lambda: client.post("/login", json=credentials))[1] for _ in range(10))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for _, latency in samples]
+    steady = statistics.median(latencies[len(latencies) // 2:])
+    first_fast = next(elapsed for elapsed, latency in samples if latency <= 2 * steady)
+    return {
+        "accept_seconds": accept_seconds,
+        "ready_seconds": ready_seconds,
+        "first_login_ms": first_login_ms,
+        "steady_login_ms": steady_login_ms,
+        "first_request_ms": latencies[0],
+        "steady_request_ms": steady,
+        "first_fast_seconds": first_fast,
+    }
+
+
+def run_mode(mode, database_url, username, args):
+    runs = [run_once(mode, database_url, username, args) for _ in range(args.repeat)]
+    return {name: round(statistics.median(run[name] for run in runs), 3) for name in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=200, help="listings per run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode")
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    database_url = engine.url.render_as_string(hide_password=False)
+    username = seed(engine, args.products)
+
+    report = {
+        "workers": args.workers,
+        "uvicorn": run_mode("uvicorn", database_url, username, args),
+        "serve": run_mode("serve", database_url, username, args),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
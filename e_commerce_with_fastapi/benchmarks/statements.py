@@ -0,0 +1,217 @@
+"""Per-call cost of the hot CRUD lookups, built per call as before and prebuilt now.
+
+    python -m benchmarks.statements --calls 2000
+
+Runs each lookup against ``BENCH_DATABASE_URL`` both as the ``db.query(...)``
+crud.py used to build on every call ("before") and through its prebuilt and
+lambda statements ("after"), reporting per call:
+
+- python_us: time outside the driver (building the query, compiling it or
+  finding it in SQLAlchemy's cache, loading the rows)
+- sql_us: time inside the driver
+
+On PostgreSQL it also reports planning_ms: the planning time EXPLAIN ANALYZE
+shows for each statement of the lookup sent as it is, as psycopg2 sends every
+statement, against EXECUTE of the same statement prepared once, as asyncpg
+does (medians of the last half of --plans runs, by when PostgreSQL has
+switched to a generic plan). With --async the "after" lookups are also timed
+on asyncpg, with its prepared statement cache off and on.
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import time
+import uuid
+
+from sqlalchemy import event, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import selectinload
+
+import config
+import database
+import models
+from crud import ORDER_RESPONSE_LOAD, PRODUCT_RESPONSE_LOAD, CartCRUD, CatalogCRUD, InventoryCRUD, OrderCRUD, ProductCRUD, UserCRUD
+from benchmarks.common import bench_engine, bench_sessionmaker
+
+WARMUP_CALLS = 50
+
+
+def seed(engine, products):
+    Session = bench_sessionmaker(engine)
+    tag = uuid.uuid4().hex[:8]
+    with Session() as db:
+        category = models.Category(name=f"stmt-{tag}")
+        user = models.User(username=f"stmt-{tag}", email=f"stmt-{tag}@example.com", password="x")
+        db.add_all([category, user])
+        db.flush()
+        items = [models.Product(name=f"stmt-{tag}-{i}", price=i % 100 + 1, stock=i % 7, category_id=category.id) for i in range(products)]
+        db.add_all(items)
+        db.flush()
+        cart = models.Cart(user_id=user.id, item_count=5, subtotal=sum(product.price for product in items[:5]))
+        db.add(cart)
+        db.flush()
+        db.add_all(models.CartItem(cart_id=cart.id, product_id=product.id, quantity=1, name=product.name, price=product.price) for product in items[:5])
+        db.add_all(models.Order(user_id=user.id, total_price=i) for i in range(30))
+        db.commit()
+        return {"user_id": user.id, "username": user.username, "category_id": category.id, "product_id": items[0].id}
+
+
+def lookups(ids):
+    """name -> (before, after); each takes a session and runs the lookup once."""
+    user_id, category_id, product_id = ids["user_id"], ids["category_id"], ids["product_id"]
+    Product = models.Product
+
+    def availability_before(db):
+        holds, shards = models.InventoryHold, models.InventoryShard
+        held = select(func.coalesce(func.sum(holds.quantity), 0)).where(holds.product_id == Product.id).scalar_subquery()
+        unheld = select(func.sum(shards.available)).where(shards.product_id == Product.id).scalar_subquery()
+        return db.execute(select(Product.stock, held, unheld).where(Product.id == product_id)).first()
+
+    def filtered_products_before(db):
+        query = db.query(Product).options(*PRODUCT_RESPONSE_LOAD).filter(Product.category_id == category_id, Product.stock > 0)
+        query = query.filter(tuple_(Product.price, Product.id) > tuple_(10, 0))
+        return query.order_by(Product.price, Product.id).offset(0).limit(20).all()
+
+    return {
+        "user_by_id": (
+            lambda db: db.query(models.User).filter(models.User.id == user_id).first(),
+            lambda db: UserCRUD.get_user_by_id(db, user_id),
+        ),
+        "user_by_username": (
+            lambda db: db.query(models.User).filter(models.User.username == ids["username"]).first(),
+            lambda db: UserCRUD.get_user_by_username(db, ids["username"]),
+        ),
+        "catalog_versions": (
+            lambda db: db.query(models.CatalogVersion.name, func.sum(models.CatalogVersion.version))
+            .filter(models.CatalogVersion.name.in_(("products", "categories"))).group_by(models.CatalogVersion.name).all(),
+            lambda db: CatalogCRUD.get_versions(db, ("products", "categories")),
+        ),
+        "products_page": (
+            lambda db: db.query(Product).options(*PRODUCT_RESPONSE_LOAD).order_by(Product.id).offset(0).limit(20).all(),
+            lambda db: ProductCRUD._query_products(db, None, None, None, None, 0, 20, "id", None),
+        ),
+        "products_filtered": (
+            filtered_products_before,
+            lambda db: ProductCRUD._query_products(db, category_id, None, None, True, 0, 20, "price", (10, 0)),
+        ),
+        "availability": (availability_before, lambda db: InventoryCRUD.get_availability(db, product_id)),
+        "cart": (
+            lambda db: db.query(models.Cart).options(selectinload(models.Cart.items)).filter(models.Cart.user_id == user_id).first(),
+            lambda db: CartCRUD.get_cart(db, user_id),
+        ),
+        "orders_page": (
+            lambda db: db.query(models.Order).options(*ORDER_RESPONSE_LOAD).filter(models.Order.user_id == user_id)
+            .order_by(models.Order.created_at.desc(), models.Order.id.desc()).limit(20).all(),
+            lambda db: OrderCRUD.get_orders(db, user_id, 20),
+        ),
+    }
+
+
+def per_call(wall, stats, calls):
+    return {"python_us": round((wall - stats.seconds) / calls * 1e6, 1), "sql_us": round(stats.seconds / calls * 1e6, 1)}
+
+
+def time_calls(Session, lookup, calls):
+    with Session() as db:
+        for _ in range(WARMUP_CALLS):
+            lookup(db)
+            db.expunge_all()
+        with database.track_queries() as stats:
+            started = time.perf_counter()
+            for _ in range(calls):
+                lookup(db)
+                db.expunge_all()
+            wall = time.perf_counter() - started
+    return per_call(wall, stats, calls)
+
+
+async def time_async_calls(engine, lookup, calls):
+    async with AsyncSession(engine) as db:
+        for _ in range(WARMUP_CALLS):
+            await db.run_sync(lookup)
+            db.expunge_all()
+        with database.track_queries() as stats:
+            started = time.perf_counter()
+            for _ in range(calls):
+                await db.run_sync(lookup)
+                db.expunge_all()
+            wall = time.perf_counter() - started
+    return per_call(wall, stats, calls)
+
+
+async def time_async_lookups(url, cache_size, ids, calls):
+    engine = create_async_engine(url, connect_args={"prepared_statement_cache_size": cache_size})
+    database.instrument(engine.sync_engine)
+    try:
+        return {name: await time_async_calls(engine, after, calls) for name, (_, after) in lookups(ids).items()}
+    finally:
+        await engine.dispose()
+
+
+def captured_statements(engine, Session, lookup):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with Session() as db:
+            lookup(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return statements
+
+
+def planning_ms(engine, statement, parameters, runs):
+    """Median planning time of statement sent as it is, and of EXECUTE once prepared."""
+    names = list(dict.fromkeys(re.findall(r"%\((\w+)\)s", statement)))
+    prepared = re.sub(r"%\((\w+)\)s", lambda match: f"${names.index(match.group(1)) + 1}", statement)
+    arguments = ", ".join(f"%({name})s" for name in names)
+    adhoc, reused = [], []
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f"PREPARE bench_statement AS {prepared}".replace("%", "%%"))
+        for _ in range(runs):
+            plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}", parameters).scalar()
+            adhoc.append(plan[0]["Planning Time"])
+            execute = f"EXPLAIN (ANALYZE, FORMAT JSON) EXECUTE bench_statement({arguments})" if names else "EXPLAIN (ANALYZE, FORMAT JSON) EXECUTE bench_statement"
+            plan = conn.exec_driver_sql(execute, parameters).scalar()
+            reused.append(plan[0]["Planning Time"])
+        conn.exec_driver_sql("DEALLOCATE bench_statement")
+        conn.rollback()
+    return statistics.median(adhoc[runs // 2:]), statistics.median(reused[runs // 2:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="calls per lookup and variant")
+    parser.add_argument("--plans", type=int, default=20, help="EXPLAIN runs per statement")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--async", dest="async_", action="store_true", help="also time asyncpg with and without prepared statements")
+    args = parser.parse_args()
+
+    engine = bench_engine()
+    database.instrument(engine)
+    Session = bench_sessionmaker(engine)
+    ids = seed(engine, args.products)
+
+    report = {"dialect": engine.dialect.name, "calls": args.calls, "lookups": {}}
+    for name, (before, after) in lookups(ids).items():
+        entry = {"before": time_calls(Session, before, args.calls), "after": time_calls(Session, after, args.calls)}
+        if engine.dialect.name == "postgresql":
+            plans = [planning_ms(engine, statement, parameters, args.plans) for statement, parameters in captured_statements(engine, Session, after)]
+            entry["planning_ms"] = {"sent_as_is": round(sum(adhoc for adhoc, _ in plans), 4), "prepared": round(sum(reused for _, reused in plans), 4)}
+        report["lookups"][name] = entry
+
+    if args.async_ and engine.dialect.name == "postgresql":
+        url = config.to_async_url(engine.url.render_as_string(hide_password=False))
+        for label, cache_size in (("asyncpg_unprepared", 0), ("asyncpg_prepared", 500)):
+            for name, timings in asyncio.run(time_async_lookups(url, cache_size, ids, args.calls)).items():
+                report["lookups"][name][label] = timings
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
+
+import config
+
+MISSING = object()
+
+
+class LRUCache:
+    """In-process backend: least-recently-used eviction plus a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace: str):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+def _off_the_loop(command, *args, **kwargs):
+    """Run a blocking client call, in a worker thread if this thread runs the event loop.
+
+    Under DB_ASYNC the CRUD methods that use the cache run inside
+    AsyncSession.run_sync, on the event loop; waiting there for a network
+    round trip would hold up every other request. await_only hands the
+    thread's coroutine to the loop the way run_sync's own queries are.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return command(*args, **kwargs)
+    return await_only(run_in_threadpool(command, *args, **kwargs))
+
+
+class RedisCache:
+    """Shared backend for any client with Redis' get/set/incr commands.
+
+    Entries are stored as JSON and expire through Redis' own TTL; eviction
+    under memory pressure is left to the server's maxmemory policy. Calls
+    are made off the event loop (see _off_the_loop).
+    """
+
+    def __init__(self, client, ttl: float, prefix: str = "catalog:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float):
+        import redis
+
+        return cls(redis.Redis.from_url(url), ttl)
+
+    def get(self, key):
+        raw = _off_the_loop(self.client.get, self.prefix + key)
+        return MISSING if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        _off_the_loop(self.client.set, self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def version(self, namespace: str) -> int:
+        return int(_off_the_loop(self.client.get, self.prefix + "version:" + namespace) or 0)
+
+    def bump(self, namespace: str):
+        _off_the_loop(self.client.incr, self.prefix + "version:" + namespace)
+
+    def size(self) -> int:
+        return None
+
+
+class Cache:
+    """Read-through cache whose entries are grouped into invalidatable namespaces.
+
+    Every key embeds its namespace's version number, so invalidating a
+    namespace is a single counter bump and stale entries simply age out.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, namespaces: tuple, key: tuple, loader):
+        """Return the cached value for key, or store and return loader().
+
+        The entry is dropped by invalidating any of the namespaces it reads from.
+        """
+        if self.backend is None:
+            return loader()
+        versions = ",".join(f"{ns}.{self.backend.version(ns)}" for ns in namespaces)
+        full_key = f"{versions}:{json.dumps(key, default=str)}"
+        value = self.backend.get(full_key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.backend.set(full_key, value)
+        return value
+
+    def invalidate(self, *namespaces: str):
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self.backend.bump(namespace)
+
+    def stats(self) -> dict:
+        if self.backend is None:
+            return {"backend": None}
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "size": self.backend.size(),
+        }
+
+
+def build_cache() -> Cache:
+    if config.CACHE_BACKEND == "none":
+        return Cache(None)
+    if config.CACHE_BACKEND == "redis":
+        return Cache(RedisCache.from_url(config.CACHE_URL, config.CACHE_TTL))
+    return Cache(LRUCache(config.CACHE_MAXSIZE, config.CACHE_TTL))
+
+
+catalog_cache = build_cache()
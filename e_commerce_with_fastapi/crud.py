@@ -1,16 +1,59 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import Float, and_, bindparam, case, delete, func, insert, lambda_stmt, literal, literal_column, or_, select, text, true, tuple_, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from passlib.context import CryptContext
-import models, schemas
+import csv
+import io
+import random
+import config, models, pagination, schemas
+from cache import catalog_cache
+from hashing import password_hasher
  
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Loader options for every nested field of the matching response schema, so
+# serializing a result never falls back to one lazy SELECT per row.
+PRODUCT_RESPONSE_LOAD = (joinedload(models.Product.category),)  # ProductResponse.category
+# The same fields as plain columns, for FAST_RESPONSES
+PRODUCT_RESPONSE_COLUMNS = (
+    models.Product.name, models.Product.price, models.Product.stock, models.Product.category_id, models.Product.id, models.Category.name,
+)
+CART_RESPONSE_LOAD = (joinedload(models.Cart.items),)  # CartResponse.items, in the cart's own SELECT
+ORDER_RESPONSE_LOAD = (selectinload(models.Order.items),)  # OrderInDB.items
+
+# Hot lookups, built once. A statement object keeps its cache key, so a call
+# goes straight to the SQL SQLAlchemy compiled for it the first time, with the
+# values passed as bind parameters. Queries whose shape depends on the
+# arguments are lambda_stmt()s, cached per combination of lambdas.
+USER_BY_ID = select(models.User).where(models.User.id == bindparam("user_id"))
+USER_BY_USERNAME = select(models.User).where(models.User.username == bindparam("username"))
+USER_BY_EMAIL = select(models.User).where(models.User.email == bindparam("email"))
+CATALOG_VERSIONS = (
+    select(models.CatalogVersion.name, func.sum(models.CatalogVersion.version))
+    .where(models.CatalogVersion.name.in_(bindparam("names", expanding=True)))
+    .group_by(models.CatalogVersion.name)
+)
+PRODUCT_BY_ID = select(models.Product).where(models.Product.id == bindparam("product_id"))
+CART_BY_USER = select(models.Cart).options(*CART_RESPONSE_LOAD).where(models.Cart.user_id == bindparam("user_id"))
+CART_ITEM_FOR_UPDATE = (
+    select(models.CartItem)
+    .where(models.CartItem.id == bindparam("cart_item_id"), models.CartItem.cart_id.in_(select(models.Cart.id).where(models.Cart.user_id == bindparam("user_id"))))
+    .with_for_update()
+)
+CART_SUMMARY_DELTA = (
+    update(models.Cart).where(models.Cart.id == bindparam("cart_id"))
+    .values(item_count=models.Cart.item_count + bindparam("item_count_delta"), subtotal=models.Cart.subtotal + bindparam("subtotal_delta"))
+    .execution_options(synchronize_session=False)
+)
  
  
 class UserCRUD:
     @staticmethod
-    def create_user(db: Session, username: str, email: str, password: str):
-        hashed_password = pwd_context.hash(password)
+    def create_user(db: Session, username: str, email: str, password: str = None, password_hash: str = None):
+        # Async callers hash beforehand (password_hasher.ahash) and pass the result.
+        hashed_password = password_hash or password_hasher.hash(password)
         db_user = models.User(username=username, email=email, password=hashed_password)
         db.add(db_user)
         try:
@@ -23,31 +66,38 @@ class UserCRUD:
  
     @staticmethod
     def get_user_by_id(db: Session, user_id: int):
-        return db.query(models.User).filter(models.User.id == user_id).first()
+        return db.scalars(USER_BY_ID, {"user_id": user_id}).first()
  
     @staticmethod
     def get_user_by_username(db: Session, username: str):
-        return db.query(models.User).filter(models.User.username == username).first()
+        return db.scalars(USER_BY_USERNAME, {"username": username}).first()
  
     @staticmethod
     def get_user_by_email(db: Session, email: str):
-        return db.query(models.User).filter(models.User.email == email).first()
+        return db.scalars(USER_BY_EMAIL, {"email": email}).first()
  
     @staticmethod
-    def update_user(db: Session, user_id: int, username: str = None, email: str = None, password: str = None):
+    def update_user(db: Session, user_id: int, username: str = None, email: str = None, password: str = None, password_hash: str = None):
         db_user = db.query(models.User).filter(models.User.id == user_id).first()
         if db_user:
             if username:
                 db_user.username = username
             if email:
                 db_user.email = email
-            if password:
-                db_user.password = pwd_context.hash(password)  
+            if password_hash:
+                db_user.password = password_hash
+            elif password:
+                db_user.password = password_hasher.hash(password)
             db.commit()
             db.refresh(db_user)
             return db_user
         return None
  
+    @staticmethod
+    def set_password_hash(db: Session, user_id: int, password_hash: str):
+        db.query(models.User).filter(models.User.id == user_id).update({"password": password_hash}, synchronize_session=False)
+        db.commit()
+ 
     @staticmethod
     def delete_user(db: Session, user_id: int):
         db_user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -58,25 +108,77 @@ class UserCRUD:
         return None
  
  
+class CatalogCRUD:
+    @staticmethod
+    def get_versions(db: Session, names: tuple):
+        """Current write counter of each catalog table in names, in one statement."""
+        versions = dict.fromkeys(names, 0)
+        rows = db.execute(CATALOG_VERSIONS, {"names": list(names)})
+        versions.update({name: int(version) for name, version in rows})
+        return versions
+
+
+def _bump_catalog_version(db: Session, name: str):
+    # Last statement before the commit, so the shard row stays locked only
+    # for the commit itself and the new version shows up with the write.
+    shard = random.randrange(config.CATALOG_VERSION_SHARDS)
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is None:
+        bumped = db.execute(
+            update(models.CatalogVersion)
+            .where(models.CatalogVersion.name == name, models.CatalogVersion.shard == shard)
+            .values(version=models.CatalogVersion.version + 1)
+        ).rowcount
+        if not bumped:
+            db.execute(insert(models.CatalogVersion).values(name=name, shard=shard, version=1))
+        return
+    stmt = dialect_insert(models.CatalogVersion).values(name=name, shard=shard, version=1)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.CatalogVersion.name, models.CatalogVersion.shard],
+        set_={"version": models.CatalogVersion.version + 1},
+    ))
+
+
 class CategoryCRUD:
     @staticmethod
     def create_category(db: Session, category: schemas.CategoryCreate):
         new_category = models.Category(name=category.name)
         db.add(new_category)
+        db.flush()
+        _bump_catalog_version(db, "categories")
         db.commit()
+        catalog_cache.invalidate("categories")
         db.refresh(new_category)
         return new_category
  
     @staticmethod
-    def get_categories(db: Session):
-        return db.query(models.Category).all()
+    def get_category_ids(db: Session):
+        return {category_id for (category_id,) in db.query(models.Category.id)}
+ 
+    @staticmethod
+    def get_categories(db: Session, catalog_version: str = None):
+        # catalog_version is the ETag the caller read; keying on it keeps a cached
+        # entry from outliving a write that went through another worker.
+        key = (catalog_version,)
+        if config.FAST_RESPONSES:
+            return catalog_cache.get_or_load(("categories",), key, lambda: [
+                {"name": name, "id": category_id}
+                for category_id, name in db.query(models.Category.id, models.Category.name).order_by(models.Category.id)
+            ])
+        return catalog_cache.get_or_load(("categories",), key, lambda: [
+            schemas.CategoryResponse.from_orm(category).dict()
+            for category in db.query(models.Category).order_by(models.Category.id)
+        ])
  
     @staticmethod
     def update_category(db: Session, category_id: int, category_update: schemas.CategoryCreate):
         category = db.query(models.Category).filter(models.Category.id == category_id).first()
         if category:
             category.name = category_update.name
+            db.flush()
+            _bump_catalog_version(db, "categories")
             db.commit()
+            catalog_cache.invalidate("categories")
             db.refresh(category)
             return category
         return None
@@ -86,11 +188,142 @@ class CategoryCRUD:
         category = db.query(models.Category).filter(models.Category.id == category_id).first()
         if category:
             db.delete(category)
+            db.flush()
+            _bump_catalog_version(db, "categories")
             db.commit()
+            catalog_cache.invalidate("categories")
             return True
         return False
  
  
+PRODUCT_SORT_COLUMNS = {
+    "id": models.Product.id,
+    "price": models.Product.price,
+    "name": models.Product.name,
+}
+ 
+ 
+def product_response_dict(row) -> dict:
+    """ProductResponse.from_orm(product).dict() for a PRODUCT_RESPONSE_COLUMNS row, without the models."""
+    name, price, stock, category_id, product_id, category_name = row
+    return {
+        "name": name, "price": float(price), "stock": stock, "category_id": category_id, "id": product_id,
+        "category": {"name": category_name, "id": category_id},
+    }
+ 
+ 
+def product_cursor(sort: str, value, product_id: int) -> str:
+    # value is the row's sort key as loaded, not the response's: a price must
+    # stay the exact Decimal for the next page to seek past it.
+    return pagination.encode_cursor(sort, value, product_id)
+ 
+ 
+def parse_product_cursor(sort: str, cursor: str) -> tuple:
+    values = pagination.decode_cursor(cursor)
+    if len(values) != 3 or values[0] != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+    try:
+        value = Decimal(values[1]) if sort == "price" else values[1]
+        return value, int(values[2])
+    except (ArithmeticError, TypeError, ValueError):
+        raise ValueError("Malformed cursor")
+ 
+ 
+def search_cursor(rank: float, product_id: int) -> str:
+    return pagination.encode_cursor("search", rank, product_id)
+ 
+ 
+def parse_search_cursor(cursor: str) -> tuple:
+    values = pagination.decode_cursor(cursor)
+    if len(values) != 3 or values[0] != "search":
+        raise ValueError("Cursor does not belong to a search")
+    try:
+        return float(values[1]), int(values[2])
+    except (TypeError, ValueError):
+        raise ValueError("Malformed cursor")
+ 
+ 
+def order_cursor(order) -> str:
+    return pagination.encode_cursor("orders", order.created_at, order.id)
+ 
+ 
+def parse_order_cursor(cursor: str) -> tuple:
+    values = pagination.decode_cursor(cursor)
+    if len(values) != 3 or values[0] != "orders":
+        raise ValueError("Cursor does not belong to an order history")
+    try:
+        return datetime.fromisoformat(values[1]), int(values[2])
+    except (TypeError, ValueError):
+        raise ValueError("Malformed cursor")
+ 
+ 
+# Must match the configuration products_search_vector_update() indexes with.
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+ 
+ 
+# Index of each product's price bucket, as models.product_price_bucket() numbers them.
+PRICE_BUCKET = case(
+    *((models.Product.price < bound, index) for index, bound in enumerate(models.PRICE_FACET_BOUNDS)),
+    else_=len(models.PRICE_FACET_BOUNDS),
+)
+ 
+ 
+PRODUCT_EXPORT_QUERY = select(
+    models.Product.id, models.Product.name, models.Product.price, models.Product.stock, models.Product.category_id
+).order_by(models.Product.id)
+ 
+ 
+def iter_product_partitions(db: Session, size: int):
+    # yield_per streams through a server-side cursor where the driver has one.
+    yield from db.execute(PRODUCT_EXPORT_QUERY.execution_options(yield_per=size)).partitions()
+ 
+ 
+async def aiter_product_partitions(db: AsyncSession, size: int):
+    result = await db.stream(PRODUCT_EXPORT_QUERY.execution_options(yield_per=size))
+    async for rows in result.partitions():
+        yield rows
+ 
+ 
+def _dialect_insert(db: Session):
+    # INSERT constructs that support ON CONFLICT; None for other databases.
+    return {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(db.get_bind().dialect.name)
+ 
+ 
+def _product_upsert(db: Session):
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is None:
+        return None
+    stmt = dialect_insert(models.Product)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Product.id],
+        set_={column: stmt.excluded[column] for column in ("name", "price", "stock", "category_id")},
+    )
+ 
+ 
+def _drop_inventory_shards(db: Session, product_ids: list):
+    # For products whose stock is being set: the next hold or sale splits the
+    # new stock over fresh shards, less whatever is held by then.
+    db.execute(delete(models.InventoryShard).where(models.InventoryShard.product_id.in_(product_ids)))
+
+
+def _copy_products(db: Session, products: list) -> bool:
+    """COPY new rows in where the driver supports it (psycopg2); False otherwise."""
+    dialect = db.get_bind().dialect
+    if dialect.driver != "psycopg2":
+        return False
+    columns = ("name", "price", "stock", "category_id")
+    statement = f"COPY products ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([product[column] for column in columns] for product in products)
+    buffer.seek(0)
+    with db.connection().connection.dbapi_connection.cursor() as cursor:
+        try:
+            cursor.copy_expert(statement, buffer)
+        except dialect.dbapi.Error as e:
+            raise DBAPIError.instance(statement, None, e, dialect.dbapi.Error)
+    return True
+ 
+ 
 class ProductCRUD:
     @staticmethod
     def create_product(db: Session, product: schemas.ProductCreate):
@@ -101,13 +334,117 @@ class ProductCRUD:
             category_id=product.category_id
         )
         db.add(new_product)
+        db.flush()
+        product_id = new_product.id
+        _bump_catalog_version(db, "products")
         db.commit()
-        db.refresh(new_product)
-        return new_product
+        catalog_cache.invalidate("products")
+        return db.get(models.Product, product_id, options=PRODUCT_RESPONSE_LOAD, populate_existing=True)
+ 
+    @staticmethod
+    def get_products(db: Session, category_id: int = None, min_price: float = None, max_price: float = None, in_stock: bool = None, skip: int = 0, limit: int = 10, sort: str = "id", after: tuple = None, catalog_version: str = None):
+        """The page of products as plain dicts, and the cursor of the next page (None on the last)."""
+        # Rows are cached as plain dicts so one result can serve any session. Without
+        # a catalog_version (see get_categories), stock moved by checkouts shows up
+        # once the entry's CACHE_TTL runs out. The cursor is cached with them since
+        # it has to come from the rows: the dicts only carry price as a float.
+        key = ("page", category_id or None, min_price or None, max_price or None, in_stock, skip, limit, sort, after, catalog_version)
+        if config.FAST_RESPONSES:
+            def load():
+                rows = ProductCRUD._query_products(db, category_id, min_price, max_price, in_stock, skip, limit, sort, after, rows=True)
+                sort_keys = [({"id": product_id, "price": price, "name": name}[sort], product_id) for name, price, _, _, product_id, _ in rows]
+                return ProductCRUD._product_page([product_response_dict(row) for row in rows], sort_keys, sort, limit)
+        else:
+            def load():
+                products = ProductCRUD._query_products(db, category_id, min_price, max_price, in_stock, skip, limit, sort, after)
+                sort_keys = [(getattr(product, sort), product.id) for product in products]
+                return ProductCRUD._product_page([schemas.ProductResponse.from_orm(product).dict() for product in products], sort_keys, sort, limit)
+        page = catalog_cache.get_or_load(("products", "categories"), key, load)
+        return page["items"], page["next_cursor"]
+
+    @staticmethod
+    def _product_page(items: list, sort_keys: list, sort: str, limit: int) -> dict:
+        next_cursor = product_cursor(sort, *sort_keys[-1]) if limit and len(items) == limit else None
+        return {"items": items, "next_cursor": next_cursor}
  
     @staticmethod
-    def get_products(db: Session, category_id: int = None, min_price: float = None, max_price: float = None, in_stock: bool = None, skip: int = 0, limit: int = 10):
-        query = db.query(models.Product)
+    def get_product_facets(db: Session, category_id: int = None, min_price: float = None, max_price: float = None, in_stock: bool = None, catalog_version: str = None):
+        """Category, price bucket and stock counts of the products matching the filters.
+ 
+        Counts come from one statement over (category, price bucket, in stock)
+        groups: on PostgreSQL, unless a price range is given, the groups are read
+        from product_facet_counts; otherwise one GROUP BY over products. Either
+        way the groups number at most categories x buckets x 2.
+        """
+        key = ("facets", category_id or None, min_price or None, max_price or None, in_stock, catalog_version)
+        return catalog_cache.get_or_load(("products", "categories"), key, lambda: ProductCRUD._count_facets(db, category_id, min_price, max_price, in_stock))
+ 
+    @staticmethod
+    def _count_facets(db: Session, category_id, min_price, max_price, in_stock):
+        if db.get_bind().dialect.name == "postgresql" and not min_price and not max_price:
+            counts = models.ProductFacetCount
+            query = db.query(counts.category_id, counts.price_bucket, counts.in_stock, counts.count)
+            if category_id:
+                query = query.filter(counts.category_id == category_id)
+            if in_stock is not None:
+                query = query.filter(counts.in_stock == in_stock)
+        else:
+            available = models.Product.stock > 0
+            query = db.query(models.Product.category_id, PRICE_BUCKET, available, func.count())
+            query = ProductCRUD._filter_products(query, category_id, min_price, max_price, in_stock)
+            query = query.group_by(models.Product.category_id, PRICE_BUCKET, available)
+ 
+        bounds = [None, *models.PRICE_FACET_BOUNDS, None]
+        categories, buckets, stock = {}, [0] * (len(bounds) - 1), {True: 0, False: 0}
+        for category, bucket, is_available, count in query:
+            categories[category] = categories.get(category, 0) + count
+            buckets[bucket] += count
+            stock[bool(is_available)] += count
+        return {
+            "total": sum(buckets),
+            "categories": [{"category_id": category, "count": count} for category, count in sorted(categories.items()) if count],
+            "price_buckets": [{"min": bounds[i], "max": bounds[i + 1], "count": count} for i, count in enumerate(buckets)],
+            "in_stock": stock[True],
+            "out_of_stock": stock[False],
+        }
+ 
+    @staticmethod
+    def _query_products(db: Session, category_id, min_price, max_price, in_stock, skip, limit, sort, after, rows=False):
+        # A lambda_stmt caches on which lambdas were added, so each condition
+        # needs its own lambda; the variables they close over become parameters.
+        sort_column = PRODUCT_SORT_COLUMNS[sort]
+        if rows:
+            stmt = lambda_stmt(lambda: select(*PRODUCT_RESPONSE_COLUMNS).join(models.Product.category))
+        else:
+            stmt = lambda_stmt(lambda: select(models.Product).options(*PRODUCT_RESPONSE_LOAD))
+        if category_id:
+            stmt += lambda s: s.where(models.Product.category_id == category_id)
+        if min_price:
+            stmt += lambda s: s.where(models.Product.price >= min_price)
+        if max_price:
+            stmt += lambda s: s.where(models.Product.price <= max_price)
+        if in_stock:
+            stmt += lambda s: s.where(models.Product.stock > 0)
+        elif in_stock is not None:
+            stmt += lambda s: s.where(models.Product.stock == 0)
+ 
+        # `after` is the (sort value, id) of the last row already seen; seeking past it
+        # through the (sort key, id) index keeps deep pages as cheap as the first.
+        after_value, after_id = after or (None, None)
+        if sort_column is models.Product.id:
+            if after is not None:
+                stmt += lambda s: s.where(models.Product.id > after_id)
+            stmt += lambda s: s.order_by(models.Product.id)
+        else:
+            if after is not None:
+                stmt += lambda s: s.where(tuple_(sort_column, models.Product.id) > tuple_(after_value, after_id))
+            stmt += lambda s: s.order_by(sort_column, models.Product.id)
+        stmt += lambda s: s.offset(skip).limit(limit)
+        result = db.execute(stmt)
+        return result.all() if rows else result.scalars().all()
+ 
+    @staticmethod
+    def _filter_products(query, category_id, min_price, max_price, in_stock):
         if category_id:
             query = query.filter(models.Product.category_id == category_id)
         if min_price:
@@ -116,86 +453,501 @@ class ProductCRUD:
             query = query.filter(models.Product.price <= max_price)
         if in_stock is not None:
             query = query.filter(models.Product.stock > 0 if in_stock else models.Product.stock == 0)
+        return query
+ 
+    @staticmethod
+    def search_products(db: Session, q: str, category_id: int = None, min_price: float = None, max_price: float = None, in_stock: bool = None, limit: int = 10, after: tuple = None, fuzzy: bool = True):
+        """Products whose name matches q, best match first, as (Product, rank) rows.
+ 
+        On PostgreSQL, q is a web-search style full-text query against the GIN
+        indexed search_vector. With fuzzy, a q none of whose matches survive the
+        filters is retried by trigram word similarity (pg_trgm), so misspelled
+        words still find products; both run as one statement. Other databases
+        fall back to a case-insensitive substring match with rank 0.
+        """
+        def matching(match, rank):
+            hits = select(models.Product.id, rank.cast(Float).label("rank")).where(match)
+            return ProductCRUD._filter_products(hits, category_id, min_price, max_price, in_stock)
+ 
+        if db.get_bind().dialect.name == "postgresql":
+            tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+            spelled = models.Product.search_vector.bool_op("@@")(tsquery)
+            hits = matching(spelled, func.ts_rank_cd(models.Product.search_vector, tsquery))
+            if fuzzy:
+                # NOT EXISTS over the CTE is evaluated once, so correctly spelled searches never scan the trigram index.
+                hits = hits.cte("spelled")
+                misspelled = and_(~select(hits.c.id).exists(), literal(q).bool_op("<%")(models.Product.name))
+                hits = union_all(select(hits), matching(misspelled, func.word_similarity(q, models.Product.name)))
+        else:
+            hits = matching(models.Product.name.icontains(q, autoescape=True), literal(0.0))
  
-        return query.offset(skip).limit(limit).all()
+        # Keyset on (rank descending, id): `after` is the last row already seen.
+        hits = hits.subquery()
+        page = select(hits).order_by(hits.c.rank.desc(), hits.c.id).limit(limit)
+        if after is not None:
+            page = page.where(or_(hits.c.rank < after[0], and_(hits.c.rank == after[0], hits.c.id > after[1])))
+        page = page.subquery()
+        return (
+            db.query(models.Product, page.c.rank)
+            .options(*PRODUCT_RESPONSE_LOAD)
+            .join(page, models.Product.id == page.c.id)
+            .order_by(page.c.rank.desc(), models.Product.id)
+            .all()
+        )
  
     @staticmethod
     def update_product(db: Session, product_id: int, product_update: schemas.ProductCreate):
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
+        product = db.scalars(PRODUCT_BY_ID, {"product_id": product_id}).first()
         if product:
+            repriced = product.price != Decimal(str(product_update.price)) or product.name != product_update.name
+            # Cart lines first, then shards and the product row: the order checkout locks them in.
+            repriced = repriced and CartCRUD._lock_lines(db, [product_id])
+            if product.stock != product_update.stock:
+                _drop_inventory_shards(db, [product_id])
             product.name = product_update.name
             product.price = product_update.price
             product.stock = product_update.stock
             product.category_id = product_update.category_id
+            db.flush()
+            if repriced:
+                CartCRUD._reprice_lines(db, [product_id])
+            _bump_catalog_version(db, "products")
             db.commit()
-            db.refresh(product)
-            return product
+            catalog_cache.invalidate("products")
+            return db.get(models.Product, product_id, options=PRODUCT_RESPONSE_LOAD, populate_existing=True)
         return None
  
+    @staticmethod
+    def import_products(db: Session, products: list):
+        """Insert a batch of products, updating those whose id already exists.
+ 
+        Returns (position, error) for each product that could not be written;
+        the rest of the batch is committed either way.
+        """
+        try:
+            ProductCRUD._write_products(db, products)
+            _bump_catalog_version(db, "products")
+            db.commit()
+            failures = []
+        except DBAPIError:
+            db.rollback()
+            failures = ProductCRUD._write_products_one_by_one(db, products)
+        catalog_cache.invalidate("products")
+        return failures
+ 
+    @staticmethod
+    def _write_products(db: Session, products: list):
+        new = [product for product in products if "id" not in product]
+        existing = [product for product in products if "id" in product]
+        if new and not _copy_products(db, new):
+            db.execute(insert(models.Product), new)
+        if existing:
+            held = CartCRUD._lock_lines(db, [product["id"] for product in existing])
+            _drop_inventory_shards(db, [product["id"] for product in existing])
+            upsert = _product_upsert(db)
+            if upsert is None:
+                for product in existing:
+                    db.merge(models.Product(**product))
+                db.flush()
+            else:
+                db.execute(upsert, existing)
+            if held:
+                CartCRUD._reprice_lines(db, [product["id"] for product in existing])
+            if db.get_bind().dialect.name == "postgresql":
+                # Explicit ids bypass the serial sequence; move it past them.
+                db.execute(text("SELECT setval(pg_get_serial_sequence('products', 'id'), (SELECT max(id) FROM products))"))
+ 
+    @staticmethod
+    def _write_products_one_by_one(db: Session, products: list):
+        failures = []
+        for position, product in enumerate(products):
+            try:
+                with db.begin_nested():
+                    ProductCRUD._write_products(db, [product])
+            except DBAPIError as e:
+                failures.append((position, str(e.orig).strip().splitlines()[0]))
+        if len(failures) < len(products):
+            _bump_catalog_version(db, "products")
+        db.commit()
+        return failures
+ 
     @staticmethod
     def delete_product(db: Session, product_id: int):
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
+        product = db.scalars(PRODUCT_BY_ID, {"product_id": product_id}).first()
         if product:
             db.delete(product)
+            db.flush()
+            _bump_catalog_version(db, "products")
             db.commit()
+            catalog_cache.invalidate("products")
             return True
         return False
  
  
+class InsufficientStock(Exception):
+    """Raised when units cannot be held because too few are neither sold nor held."""
+
+    def __init__(self, product_ids, message="Not enough stock for products"):
+        super().__init__(f"{message} {sorted(product_ids)}")
+        self.product_ids = sorted(product_ids)
+
+
+class CartNotFound(Exception):
+    """Raised when a checkout names a cart that is not the user's."""
+
+
+class ShardsBusy(InsufficientStock):
+    """The units may be there, but in shards other transactions have locked."""
+
+    def __init__(self, product_ids):
+        super().__init__(product_ids, "Stock is changing hands for products, retry shortly:")
+
+
+# Times a hold or checkout starts over after ShardsBusy before giving up.
+TAKE_ATTEMPTS = 5
+
+
+def _retry_when_busy(db: Session, write, *args):
+    # The rollback releases every shard this attempt locked, so whoever it
+    # was waiting on (or holding up) can finish before the next attempt.
+    for attempt in range(TAKE_ATTEMPTS):
+        try:
+            return write(db, *args)
+        except InsufficientStock as e:
+            db.rollback()
+            if not isinstance(e, ShardsBusy) or attempt == TAKE_ATTEMPTS - 1:
+                raise
+
+
+PRODUCT_AVAILABILITY = select(
+    models.Product.stock,
+    select(func.coalesce(func.sum(models.InventoryHold.quantity), 0))
+    .where(models.InventoryHold.product_id == models.Product.id).scalar_subquery(),
+    select(func.sum(models.InventoryShard.available))
+    .where(models.InventoryShard.product_id == models.Product.id).scalar_subquery(),
+).where(models.Product.id == bindparam("product_id"))
+
+
+class InventoryCRUD:
+    @staticmethod
+    def get_availability(db: Session, product_id: int):
+        """Stock on hand, units held in carts, and what is left to sell, in one statement."""
+        row = db.execute(PRODUCT_AVAILABILITY, {"product_id": product_id}).first()
+        if row is None:
+            return None
+        stock, held, unheld = row
+        available = unheld if unheld is not None else max(stock - held, 0)
+        return {"product_id": product_id, "stock": stock, "held": held, "available": available}
+
+    @staticmethod
+    def release_expired_holds(db: Session, batch_size: int = 1000):
+        """Give the units of expired holds back, batch_size holds per transaction; returns how many."""
+        holds = models.InventoryHold
+        released = 0
+        while True:
+            expired = (
+                select(holds.id).where(holds.expires_at < datetime.now(timezone.utc))
+                .order_by(holds.id).limit(batch_size).with_for_update(skip_locked=True)
+            )
+            pieces = InventoryCRUD._delete_holds(db, holds.id.in_(expired))
+            InventoryCRUD._add_to_shards(db, pieces)
+            db.commit()
+            released += len(pieces)
+            if len(pieces) < batch_size:
+                return released
+
+    @staticmethod
+    def _ensure_shards(db: Session, product_ids):
+        # Split what is neither sold nor held over the shards, for products
+        # that have none yet. Concurrent callers compute the same rows.
+        shards, holds, products = models.InventoryShard, models.InventoryHold, models.Product
+        count = config.INVENTORY_SHARDS
+        numbers = union_all(*(select(literal(number).label("shard")) for number in range(count))).subquery()
+        held = select(func.coalesce(func.sum(holds.quantity), 0)).where(holds.product_id == products.id).scalar_subquery()
+        free = case((products.stock > held, products.stock - held), else_=0)
+        rows = (
+            select(products.id, numbers.c.shard, free // count + case((numbers.c.shard < free % count, 1), else_=0))
+            .join_from(products, numbers, true())
+            .where(products.id.in_(product_ids), ~select(shards.product_id).where(shards.product_id == products.id).exists())
+            .order_by(products.id, numbers.c.shard)
+        )
+        dialect_insert = _dialect_insert(db)
+        stmt = (dialect_insert or insert)(shards).from_select(["product_id", "shard", "available"], rows)
+        db.execute(stmt.on_conflict_do_nothing() if dialect_insert is not None else stmt)
+
+    @staticmethod
+    def _take(db: Session, quantities: dict):
+        """Take quantities (product id -> units) out of the shards.
+
+        Returns the (product_id, shard, quantity) pieces taken. Raises
+        InsufficientStock if some product has too few units left, after which
+        the caller must roll back. Shards are only ever waited on in
+        (product_id, shard) order, so takes cannot deadlock each other.
+        """
+        shards = models.InventoryShard
+        pieces = InventoryCRUD._take_first_fit(db, quantities, all_or_nothing=True)
+        if len(pieces) == len(quantities):
+            return pieces
+        if not pieces:
+            # Some product has no shard with enough units (or no shards yet). Find
+            # out without locking anything whether it has enough units at all.
+            unheld = dict(db.execute(
+                select(shards.product_id, func.sum(shards.available))
+                .where(shards.product_id.in_(quantities))
+                .group_by(shards.product_id)
+            ).all())
+            short = [product_id for product_id, quantity in quantities.items() if product_id in unheld and unheld[product_id] < quantity]
+            if short:
+                raise InsufficientStock(short)
+            if len(unheld) < len(quantities):
+                InventoryCRUD._ensure_shards(db, [product_id for product_id in quantities if product_id not in unheld])
+            pieces = InventoryCRUD._take_first_fit(db, quantities, all_or_nothing=False)
+
+        # Shards that emptied while this waited on them, or no single shard with
+        # enough: gather the rest from every shard of the product. Rows of other
+        # products are locked by now, so waiting here could deadlock; shards
+        # other transactions hold are skipped instead and the caller starts over.
+        missing = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in {p for p, _, _ in pieces}}
+        if missing:
+            rows = db.execute(
+                select(shards.product_id, shards.shard, shards.available)
+                .where(shards.product_id.in_(missing), shards.available > 0)
+                .order_by(shards.product_id, shards.shard)
+                .with_for_update(skip_locked=True)
+            ).all()
+            gathered = []
+            for product_id, shard, available in rows:
+                quantity = min(available, missing[product_id])
+                if quantity:
+                    gathered.append((product_id, shard, quantity))
+                    missing[product_id] -= quantity
+            busy = [product_id for product_id, quantity in missing.items() if quantity]
+            if busy:
+                raise ShardsBusy(busy)
+            # Locked above, so every one of these rows is still there.
+            InventoryCRUD._add_to_shards(db, [(product_id, shard, -quantity) for product_id, shard, quantity in gathered])
+            pieces += gathered
+        return pieces
+
+    @staticmethod
+    def _take_first_fit(db: Session, quantities: dict, all_or_nothing: bool):
+        # Per product, the first shard with enough units counting from a random
+        # one, taken in one statement; with all_or_nothing, only if every
+        # product has such a shard. Rows are locked in (product_id, shard) order.
+        shards = models.InventoryShard
+        count = config.INVENTORY_SHARDS
+        wanted = case(quantities, value=shards.product_id)
+        candidate, locked = aliased(shards), aliased(shards)
+        rotation = random.randrange(count)
+        first_fit = (
+            select(candidate.product_id, (func.min((candidate.shard + count - rotation) % count) + rotation) % count)
+            .where(candidate.product_id.in_(quantities), candidate.available >= case(quantities, value=candidate.product_id))
+            .group_by(candidate.product_id)
+        )
+        lock = select(locked.product_id, locked.shard).where(tuple_(locked.product_id, locked.shard).in_(first_fit))
+        if all_or_nothing:
+            lock = lock.where(select(func.count()).select_from(first_fit.subquery()).scalar_subquery() == len(quantities))
+        taken = db.execute(
+            update(shards)
+            .where(
+                tuple_(shards.product_id, shards.shard).in_(lock.order_by(locked.product_id, locked.shard).with_for_update()),
+                shards.available >= wanted,
+            )
+            .values(available=shards.available - wanted)
+            .returning(shards.product_id, shards.shard)
+            .execution_options(synchronize_session=False)
+        ).all()
+        return [(product_id, shard, quantities[product_id]) for product_id, shard in taken]
+
+    @staticmethod
+    def _add_to_shards(db: Session, pieces: list):
+        # Units given back to shards dropped since they were taken are skipped:
+        # whoever creates the shards again counts them in from products.stock.
+        amounts = {}
+        for product_id, shard, quantity in pieces:
+            amounts[product_id, shard] = amounts.get((product_id, shard), 0) + quantity
+        if not amounts:
+            return
+        shards = models.InventoryShard.__table__
+        db.execute(
+            update(shards)
+            .where(shards.c.product_id == bindparam("b_product_id"), shards.c.shard == bindparam("b_shard"))
+            .values(available=shards.c.available + bindparam("b_quantity")),
+            [{"b_product_id": product_id, "b_shard": shard, "b_quantity": quantity} for (product_id, shard), quantity in sorted(amounts.items())],
+        )
+
+    @staticmethod
+    def _hold(db: Session, cart_id: int, quantities: dict):
+        pieces = InventoryCRUD._take(db, quantities)
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=config.INVENTORY_HOLD_SECONDS)
+        db.execute(insert(models.InventoryHold), [
+            {"cart_id": cart_id, "product_id": product_id, "shard": shard, "quantity": quantity, "expires_at": expires_at}
+            for product_id, shard, quantity in pieces
+        ])
+
+    @staticmethod
+    def _delete_holds(db: Session, *criteria):
+        holds = models.InventoryHold
+        return db.execute(
+            delete(holds).where(*criteria)
+            .returning(holds.product_id, holds.shard, holds.quantity)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+    @staticmethod
+    def _release_holds(db: Session, cart_id: int, product_id: int):
+        holds = models.InventoryHold
+        InventoryCRUD._add_to_shards(db, InventoryCRUD._delete_holds(db, holds.cart_id == cart_id, holds.product_id == product_id))
+
+ 
 class CartCRUD:
     @staticmethod
     def get_cart(db: Session, user_id: int):
-        cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).first()
+        cart = db.scalars(CART_BY_USER, {"user_id": user_id}).unique().first()
         if not cart:
-            cart = models.Cart(user_id=user_id)
-            db.add(cart)
+            db.execute(CartCRUD._create_cart(db, user_id))
             db.commit()
-            db.refresh(cart)
+            cart = db.scalars(CART_BY_USER, {"user_id": user_id}).unique().one()
         return cart
  
     @staticmethod
-    def add_to_cart(db: Session, user_id: int, item: schemas.CartItemCreate):
-        cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).first()
-        if not cart:
-            cart = models.Cart(user_id=user_id)
-            db.add(cart)
-            db.commit()
-            db.refresh(cart)
+    def _create_cart(db: Session, user_id: int):
+        # Concurrent first requests for a user race to create the cart; carts.user_id
+        # is unique, so the losers simply find the winner's cart.
+        return _dialect_insert(db)(models.Cart).values(user_id=user_id).on_conflict_do_nothing(index_elements=[models.Cart.user_id])
  
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            raise ValueError("Product not found")
+    @staticmethod
+    def add_to_cart(db: Session, user_id: int, item: schemas.CartItemCreate, hold: bool = False):
+        lines = CartCRUD.add_many_to_cart(db, user_id, [item], hold)
+        return lines[0] if lines else None
  
-        cart_item = db.query(models.CartItem).filter(
-            models.CartItem.cart_id == cart.id, models.CartItem.product_id == item.product_id
-        ).first()
+    @staticmethod
+    def add_many_to_cart(db: Session, user_id: int, items: list, hold: bool = False):
+        """Add items to the user's cart, creating it if needed, in one transaction.
  
-        if cart_item:
-            cart_item.quantity += item.quantity
-        else:
-            cart_item = models.CartItem(cart_id=cart.id, product_id=item.product_id, quantity=item.quantity)
-            db.add(cart_item)
+        Quantities are added by the database (ON CONFLICT ... DO UPDATE), so
+        concurrent adds of the same product never lose an increment; the cart's
+        item_count and subtotal move by what was added. Returns the
+        affected cart lines, or None if any product does not exist. With hold,
+        the added units are also held for the cart, or InsufficientStock raised.
+        """
+        quantities = {}
+        for item in items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        if not quantities:
+            return []
+        return _retry_when_busy(db, CartCRUD._add_many_to_cart, user_id, quantities, hold)
  
+    @staticmethod
+    def _add_many_to_cart(db: Session, user_id: int, quantities: dict, hold: bool):
+        lines = []
+        if db.get_bind().dialect.name == "postgresql":
+            # Cart upsert and line upsert in a single statement. The SELECT arm
+            # misses a cart created concurrently after this statement's snapshot;
+            # that rare case comes back empty and takes the two-statement path.
+            new_cart = CartCRUD._create_cart(db, user_id).returning(models.Cart.id).cte("new_cart")
+            cart = union_all(
+                select(new_cart.c.id),
+                select(models.Cart.id).where(models.Cart.user_id == user_id),
+            ).cte("cart")
+            lines = db.execute(CartCRUD._upsert_lines(db, cart, quantities)).all()
+        if not lines:
+            db.execute(CartCRUD._create_cart(db, user_id))
+            cart = select(models.Cart.id).where(models.Cart.user_id == user_id).subquery()
+            lines = db.execute(CartCRUD._upsert_lines(db, cart, quantities)).all()
+ 
+        if len(lines) != len(quantities):
+            db.rollback()
+            return None
+        CartCRUD._add_to_summary(
+            db, lines[0].cart_id, sum(quantities.values()),
+            sum((line.price * quantities[line.product_id] for line in lines), Decimal(0)),
+        )
+        if hold:
+            InventoryCRUD._hold(db, lines[0].cart_id, quantities)
         db.commit()
-        db.refresh(cart_item)
-        return cart_item
+        return lines
+ 
+    @staticmethod
+    def _upsert_lines(db: Session, cart, quantities: dict):
+        # `cart` yields the cart's id as its single row. Products that do not exist
+        # select no row, so they come back missing from RETURNING instead of
+        # failing the statement. An existing line keeps its price, which the
+        # cart's subtotal was built from.
+        items = models.CartItem
+        stmt = _dialect_insert(db)(items).from_select(
+            ["cart_id", "product_id", "quantity", "name", "price"],
+            select(cart.c.id, models.Product.id, case(quantities, value=models.Product.id), models.Product.name, models.Product.price)
+            .join_from(cart, models.Product, true())
+            .where(models.Product.id.in_(quantities)),
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[items.cart_id, items.product_id],
+            set_={"quantity": items.quantity + stmt.excluded.quantity},
+        ).returning(items.id, items.cart_id, items.product_id, items.quantity, items.name, items.price)
+
+    @staticmethod
+    def _add_to_summary(db: Session, cart_id: int, item_count: int, subtotal: Decimal):
+        db.execute(CART_SUMMARY_DELTA, {"cart_id": cart_id, "item_count_delta": item_count, "subtotal_delta": subtotal})
+
+    @staticmethod
+    def _lock_lines(db: Session, product_ids: list) -> bool:
+        """Lock the cart lines holding these products; False if there are none."""
+        items = models.CartItem
+        return bool(db.execute(select(items.id).where(items.product_id.in_(product_ids)).with_for_update()).all())
+
+    @staticmethod
+    def _reprice_lines(db: Session, product_ids: list):
+        """Copy the products' current name and price to the cart lines holding them.
+
+        Each affected cart's subtotal moves by the price difference times the
+        line's quantity. The caller has locked the lines (_lock_lines), so a
+        concurrent change of their quantity is counted entirely at the old
+        price or the new one. A line inserted by an add that read the old price
+        but commits after this runs keeps that price until the next update;
+        checkout charges the current price regardless.
+        """
+        items = models.CartItem
+        holding = items.product_id.in_(product_ids)
+        current_price = select(models.Product.price).where(models.Product.id == items.product_id).scalar_subquery()
+        current_name = select(models.Product.name).where(models.Product.id == items.product_id).scalar_subquery()
+        stale = and_(holding, items.price != current_price)
+        difference = select(func.sum((current_price - items.price) * items.quantity)).where(items.cart_id == models.Cart.id, stale).scalar_subquery()
+        db.execute(
+            update(models.Cart).where(models.Cart.id.in_(select(items.cart_id).where(stale)))
+            .values(subtotal=models.Cart.subtotal + difference)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            update(items).where(holding).values(name=current_name, price=current_price)
+            .execution_options(synchronize_session=False)
+        )
  
     @staticmethod
-    def update_cart_item(db: Session, cart_item_id: int, quantity: int):
-        cart_item = db.query(models.CartItem).filter(models.CartItem.id == cart_item_id).first()
+    def update_cart_item(db: Session, user_id: int, cart_item_id: int, quantity: int):
+        # Locked, so concurrent changes to the line each move the cart's totals by their own difference.
+        cart_item = db.scalars(CART_ITEM_FOR_UPDATE, {"cart_item_id": cart_item_id, "user_id": user_id}).first()
         if not cart_item:
             return None
  
+        added = quantity - cart_item.quantity
         cart_item.quantity = quantity
+        db.flush()
+        CartCRUD._add_to_summary(db, cart_item.cart_id, added, added * cart_item.price)
+        # A changed line keeps no hold; adding with hold=true holds again.
+        InventoryCRUD._release_holds(db, cart_item.cart_id, cart_item.product_id)
         db.commit()
         db.refresh(cart_item)
         return cart_item
  
     @staticmethod
-    def remove_cart_item(db: Session, cart_item_id: int):
-        cart_item = db.query(models.CartItem).filter(models.CartItem.id == cart_item_id).first()
+    def remove_cart_item(db: Session, user_id: int, cart_item_id: int):
+        cart_item = db.scalars(CART_ITEM_FOR_UPDATE, {"cart_item_id": cart_item_id, "user_id": user_id}).first()
         if cart_item:
             db.delete(cart_item)
+            db.flush()
+            CartCRUD._add_to_summary(db, cart_item.cart_id, -cart_item.quantity, -cart_item.quantity * cart_item.price)
+            InventoryCRUD._release_holds(db, cart_item.cart_id, cart_item.product_id)
             db.commit()
             return True
         return False
@@ -204,35 +956,248 @@ class CartCRUD:
 class OrderCRUD:
     @staticmethod
     def place_order(db: Session, user_id: int, cart_id: int):
-        cart_items = db.query(models.CartItem).filter(models.CartItem.cart_id == cart_id).all()
+        """Turn the cart into an order.
+
+        Units the cart holds are sold as they are; only the rest is taken from
+        the inventory shards. Product rows are not locked until the closing
+        stock UPDATE, so checkouts of a hot product queue on it only briefly.
+        Prices come from the cart lines, which product updates keep current.
+        Raises CartNotFound if cart_id is not the user's cart.
+        """
+        try:
+            return _retry_when_busy(db, OrderCRUD._place_order, user_id, cart_id)
+        except InsufficientStock:
+            return None
+
+    @staticmethod
+    def _place_order(db: Session, user_id: int, cart_id: int):
+        # Locking the cart lines makes a concurrent checkout of the same cart wait and
+        # then see the lines this one deletes, instead of ordering them twice.
+        cart_items = (
+            db.query(models.CartItem)
+            .filter(models.CartItem.cart_id == cart_id, models.CartItem.cart_id.in_(select(models.Cart.id).where(models.Cart.user_id == user_id)))
+            .order_by(models.CartItem.id)
+            .with_for_update()
+            .all()
+        )
         if not cart_items:
+            owner = db.scalar(select(models.Cart.user_id).where(models.Cart.id == cart_id))
+            db.rollback()
+            if owner != user_id:
+                raise CartNotFound(cart_id)
             return None  
  
-        total_price = Decimal(0)
+        quantities, prices = {}, {}
         for item in cart_items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            if product is None or product.stock < item.quantity:
-                return None  
-            total_price += product.price * item.quantity
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+            prices[item.product_id] = item.price
+ 
+        # Holds count for the cart even past expires_at until the sweeper has
+        # given them back; deleting them here keeps it from doing so twice.
+        needed, surplus = dict(quantities), []
+        for product_id, shard, quantity in InventoryCRUD._delete_holds(db, models.InventoryHold.cart_id == cart_id):
+            used = min(quantity, needed.get(product_id, 0))
+            if used:
+                needed[product_id] -= used
+            if quantity > used:
+                surplus.append((product_id, shard, quantity - used))
+        needed = {product_id: quantity for product_id, quantity in needed.items() if quantity}
+        if needed:
+            InventoryCRUD._take(db, needed)
+        InventoryCRUD._add_to_shards(db, surplus)
  
+        total_price = sum((prices[pid] * qty for pid, qty in quantities.items()), Decimal(0))
         order = models.Order(user_id=user_id, total_price=total_price)
         db.add(order)
-        db.commit()
-        db.refresh(order)
+        db.flush()
+        order_id = order.id
  
-        for item in cart_items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            order_item = models.OrderItem(
-                order_id=order.id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                price=product.price
+        db.execute(insert(models.OrderItem), [
+            {"order_id": order_id, "product_id": item.product_id, "quantity": item.quantity, "price": prices[item.product_id]}
+            for item in cart_items
+        ])
+        # Take off exactly the lines deleted; one added since the lock was taken stays, and stays counted.
+        deleted = db.execute(
+            delete(models.CartItem).where(models.CartItem.cart_id == cart_id)
+            .returning(models.CartItem.quantity, models.CartItem.price)
+            .execution_options(synchronize_session=False)
+        ).all()
+        CartCRUD._add_to_summary(db, cart_id, -sum(line.quantity for line in deleted), -sum((line.quantity * line.price for line in deleted), Decimal(0)))
+ 
+        # The shards already vouch for every unit; the stock >= qty predicate only
+        # guards against stock set lower than what was held since. Locking in id
+        # order keeps two checkouts that share products from deadlocking here.
+        decrement = case(quantities, value=models.Product.id)
+        locked = aliased(models.Product)
+        current_prices = db.execute(
+            update(models.Product)
+            .where(
+                # NO KEY UPDATE, or it would wait on the KEY SHARE locks other checkouts' order_items hold.
+                models.Product.id.in_(select(locked.id).where(locked.id.in_(quantities)).order_by(locked.id).with_for_update(key_share=True)),
+                models.Product.stock >= decrement,
             )
-            db.add(order_item)
-            product.stock -= item.quantity
+            .values(stock=models.Product.stock - decrement)
+            .returning(models.Product.id, models.Product.price)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(current_prices) != len(quantities):
+            db.rollback()
+            return None  
+        repriced = {product_id: price for product_id, price in current_prices if price != prices[product_id]}
+        if repriced:
+            # A line added while its product's price changed can miss the
+            # update to it (see CartCRUD._reprice_lines); charge the price the
+            # locked product row has now.
+            prices.update(repriced)
+            total_price = sum((prices[pid] * qty for pid, qty in quantities.items()), Decimal(0))
+            db.execute(update(models.Order).where(models.Order.id == order_id).values(total_price=total_price).execution_options(synchronize_session=False))
+            db.execute(
+                update(models.OrderItem)
+                .where(models.OrderItem.order_id == order_id, models.OrderItem.product_id.in_(repriced))
+                .values(price=case(repriced, value=models.OrderItem.product_id))
+                .execution_options(synchronize_session=False)
+            )
+        OrderCRUD._add_to_stats(db, user_id, total_price)
+        _bump_catalog_version(db, "products")
+        db.commit()
+        return db.get(models.Order, order_id, options=ORDER_RESPONSE_LOAD, populate_existing=True)
+
+    @staticmethod
+    def _add_to_stats(db: Session, user_id: int, total_price: Decimal):
+        stats = models.UserOrderStats
+        dialect_insert = _dialect_insert(db)
+        if dialect_insert is None:
+            updated = db.execute(
+                update(stats).where(stats.user_id == user_id)
+                .values(order_count=stats.order_count + 1, total_spent=stats.total_spent + total_price)
+            ).rowcount
+            if not updated:
+                db.execute(insert(stats).values(user_id=user_id, order_count=1, total_spent=total_price))
+            return
+        stmt = dialect_insert(stats).values(user_id=user_id, order_count=1, total_spent=total_price)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[stats.user_id],
+            set_={"order_count": stats.order_count + 1, "total_spent": stats.total_spent + stmt.excluded.total_spent},
+        ))
+
+    @staticmethod
+    def get_order(db: Session, order_id: int):
+        return db.get(models.Order, order_id, options=ORDER_RESPONSE_LOAD)
+
+    @staticmethod
+    def get_orders(db: Session, user_id: int, limit: int = 20, after: tuple = None):
+        """A user's orders, newest first, starting after the (created_at, id) of the last one seen."""
+        stmt = lambda_stmt(lambda: select(models.Order).options(*ORDER_RESPONSE_LOAD).where(models.Order.user_id == user_id))
+        if after is not None:
+            after_created_at, after_id = after
+            stmt += lambda s: s.where(tuple_(models.Order.created_at, models.Order.id) < tuple_(after_created_at, after_id))
+        stmt += lambda s: s.order_by(models.Order.created_at.desc(), models.Order.id.desc()).limit(limit)
+        return db.scalars(stmt).all()
+
+    @staticmethod
+    def get_order_stats(db: Session, user_id: int):
+        # Read from the row checkouts keep current, not aggregated over the user's orders.
+        row = db.get(models.UserOrderStats, user_id)
+        return {"order_count": row.order_count if row else 0, "total_spent": row.total_spent if row else 0}
+
+ 
  
+class IdempotencyCRUD:
+    @staticmethod
+    def claim(db: Session, user_id: int, key: str, request_hash: str, claimed_at: datetime):
+        """Reserve key for a request about to run.
+
+        Returns None when this call holds the key, otherwise the live row
+        already holding it; a retry of a finished request is answered by the
+        first lookup alone. A row past IDEMPOTENCY_TTL, or one still in
+        progress past IDEMPOTENCY_LEASE, is taken over in place. claimed_at
+        identifies this claim to complete() and release().
+        """
+        keys = models.IdempotencyKey
+        cutoff = claimed_at - timedelta(seconds=config.IDEMPOTENCY_TTL)
+        lease_cutoff = claimed_at - timedelta(seconds=config.IDEMPOTENCY_LEASE)
+        expired = or_(keys.created_at < cutoff, and_(keys.status_code.is_(None), keys.created_at < lease_cutoff))
+        live = lambda: db.query(keys).filter(keys.user_id == user_id, keys.key == key, ~expired).first()
+        existing = live()
+        if existing is not None:
+            return existing
+
+        fresh = {"request_hash": request_hash, "created_at": claimed_at, "status_code": None, "response_headers": None, "response_body": None}
+        dialect_insert = _dialect_insert(db)
+        if dialect_insert is None:
+            db.execute(delete(keys).where(keys.user_id == user_id, keys.key == key, expired))
+            try:
+                with db.begin_nested():
+                    db.execute(insert(keys).values(user_id=user_id, key=key, **fresh))
+                claimed = True
+            except IntegrityError:
+                claimed = False
+        else:
+            stmt = dialect_insert(keys).values(user_id=user_id, key=key, **fresh)
+            claimed = db.execute(stmt.on_conflict_do_update(
+                index_elements=[keys.user_id, keys.key], set_=fresh, where=expired,
+            )).rowcount == 1
+        db.commit()
+        # Otherwise a concurrent request with the same key got there first.
+        return None if claimed else live()
+
+    @staticmethod
+    def complete(db: Session, user_id: int, key: str, claimed_at: datetime, status_code: int, headers: str, body: bytes):
+        # Matching claimed_at leaves alone a claim that took over after this one's lease ran out.
+        keys = models.IdempotencyKey
+        db.execute(
+            update(keys)
+            .where(keys.user_id == user_id, keys.key == key, keys.created_at == claimed_at)
+            .values(status_code=status_code, response_headers=headers, response_body=body)
+        )
         db.commit()
-        db.query(models.CartItem).filter(models.CartItem.cart_id == cart_id).delete()
+
+    @staticmethod
+    def release(db: Session, user_id: int, key: str, claimed_at: datetime):
+        # The request failed without a response worth replaying; a retry runs it again.
+        keys = models.IdempotencyKey
+        db.execute(delete(keys).where(keys.user_id == user_id, keys.key == key, keys.created_at == claimed_at))
         db.commit()
-        return order
+
+    @staticmethod
+    def delete_expired(db: Session, batch_size: int = 1000):
+        """Delete keys older than IDEMPOTENCY_TTL, batch_size rows per transaction."""
+        keys = models.IdempotencyKey
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=config.IDEMPOTENCY_TTL)
+        deleted = 0
+        while True:
+            batch = select(keys.user_id, keys.key).where(keys.created_at < cutoff).limit(batch_size)
+            count = db.execute(delete(keys).where(tuple_(keys.user_id, keys.key).in_(batch))).rowcount
+            db.commit()
+            deleted += count
+            if count < batch_size:
+                return deleted
+ 
+ 
+def _awaitable(func):
+    async def wrapper(db, *args, **kwargs):
+        if isinstance(db, AsyncSession):
+            return await db.run_sync(func, *args, **kwargs)
+        return await run_in_threadpool(func, db, *args, **kwargs)
+    return staticmethod(wrapper)
+ 
+ 
+def _async_crud(crud_class):
+    # Each async method runs the sync implementation on the session's own
+    # connection, so the two APIs can never drift apart.
+    methods = {
+        name: _awaitable(getattr(crud_class, name))
+        for name, attr in vars(crud_class).items()
+        if isinstance(attr, staticmethod) and not name.startswith("_")
+    }
+    return type("Async" + crud_class.__name__, (), methods)
+ 
  
+AsyncUserCRUD = _async_crud(UserCRUD)
+AsyncCatalogCRUD = _async_crud(CatalogCRUD)
+AsyncCategoryCRUD = _async_crud(CategoryCRUD)
+AsyncProductCRUD = _async_crud(ProductCRUD)
+AsyncInventoryCRUD = _async_crud(InventoryCRUD)
+AsyncCartCRUD = _async_crud(CartCRUD)
+AsyncOrderCRUD = _async_crud(OrderCRUD)
+AsyncIdempotencyCRUD = _async_crud(IdempotencyCRUD)
@@ -0,0 +1,26 @@
+from fastapi import Request, Response
+
+import config
+
+
+def catalog_etag(versions: dict) -> str:
+    """Strong ETag for a response built from the given table versions."""
+    return '"' + "-".join(f"{name}.{version}" for name, version in sorted(versions.items())) + '"'
+
+
+def is_fresh(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names etag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # If-None-Match compares weakly: W/"x" matches "x".
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": config.CATALOG_CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
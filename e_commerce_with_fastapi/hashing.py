@@ -0,0 +1,147 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+import config
+from metrics import Histogram
+
+
+def crypt_context(rounds: int) -> CryptContext:
+    # Pinning min and max to the configured cost makes needs_update() flag any
+    # hash made with a different cost, upwards or downwards.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+pwd_context = crypt_context(config.BCRYPT_ROUNDS)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt in a pool of worker processes, off the request threads.
+
+    At most max_pending hashes may be queued or running at once; past that,
+    callers get HashingBusy instead of waiting behind a login storm. With
+    workers=0 hashes run in the calling thread (the threadpool for async
+    callers).
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.duration = Histogram()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn, not fork: the app process is multi-threaded by now.
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _claim(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy(f"{self.pending} password hashes already pending")
+            self.pending += 1
+
+    def _release(self, started: float):
+        self.duration.observe(time.monotonic() - started)
+        with self._lock:
+            self.pending -= 1
+
+    def _submit(self, fn, *args) -> Future:
+        self._claim()
+        started = time.monotonic()
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._release(started)
+            raise
+        future.add_done_callback(lambda _: self._release(started))
+        return future
+
+    def _run(self, fn, *args):
+        if self.workers:
+            return self._submit(fn, *args).result()
+        self._claim()
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            self._release(started)
+
+    async def _arun(self, fn, *args):
+        if self.workers:
+            return await asyncio.wrap_future(self._submit(fn, *args))
+        return await run_in_threadpool(self._run, fn, *args)
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(_verify, password, hashed)
+
+    async def ahash(self, password: str) -> str:
+        return await self._arun(_hash, password)
+
+    async def averify(self, password: str, hashed: str) -> bool:
+        return await self._arun(_verify, password, hashed)
+
+    def warm_up(self):
+        """Start every worker process and load bcrypt in each, ahead of the first login."""
+        # Checked against a cheap hash: verifying uses the cost the hash was made with.
+        cheap = crypt_context(4).hash("warm-up")
+        if self.workers:
+            # Each submission finding no idle process starts one.
+            for future in [self._pool().submit(_verify, "warm-up", cheap) for _ in range(self.workers)]:
+                future.result()
+        else:
+            _verify("warm-up", cheap)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return pwd_context.needs_update(hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": config.BCRYPT_ROUNDS,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "duration_seconds": self.duration.snapshot(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+password_hasher = PasswordHasher(config.HASH_WORKERS, config.HASH_MAX_PENDING)
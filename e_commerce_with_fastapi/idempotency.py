@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+
+from starlette.responses import JSONResponse
+
+import config
+from auth import bearer_user_id
+from crud import AsyncIdempotencyCRUD
+from database import session_scope
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_KEY_LENGTH = 255
+
+
+def request_hash(scope, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (scope["method"].encode(), scope["path"].encode(), scope["query_string"], body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+async def read_body(receive):
+    """The whole request body, or None once it grows past IDEMPOTENCY_MAX_BODY."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > config.IDEMPOTENCY_MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def replay(stored, digest: str, scope, receive, send):
+    if stored.request_hash != digest:
+        response = JSONResponse(status_code=422, content={"detail": "Idempotency-Key was already used for a different request"})
+    elif stored.status_code is None:
+        response = JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"}, headers={"Retry-After": "1"})
+    else:
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(stored.response_headers)]
+        await send({"type": "http.response.start", "status": stored.status_code, "headers": headers + [(REPLAYED_HEADER.lower().encode(), b"true")]})
+        await send({"type": "http.response.body", "body": stored.response_body})
+        return
+    await response(scope, receive, send)
+
+
+class IdempotencyMiddleware:
+    """Runs a mutating request carrying an Idempotency-Key header at most once.
+
+    Keys belong to the authenticated user. The first request claims the key
+    in its own transaction, and its response (unless a 5xx) is stored once
+    it has been sent; retries with the same key and request get that response
+    back without reaching the endpoint. Requests without a key or a valid
+    token pass straight through. A process dying mid-request leaves its key
+    answering 409 until IDEMPOTENCY_LEASE runs out, when a retry may claim it
+    again; a request still running that long can therefore run twice.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        key = headers.get(IDEMPOTENCY_HEADER, b"").decode("latin-1").strip()
+        user_id = bearer_user_id(headers) if key else None
+        if user_id is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await JSONResponse(status_code=400, content={"detail": f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters"})(scope, receive, send)
+            return
+
+        body = await read_body(receive)
+        if body is None:
+            await JSONResponse(status_code=413, content={"detail": f"Idempotency-Key needs a body of at most {config.IDEMPOTENCY_MAX_BODY} bytes"})(scope, receive, send)
+            return
+        digest = request_hash(scope, body)
+        claimed_at = datetime.now(timezone.utc)
+        async with session_scope() as db:
+            stored = await AsyncIdempotencyCRUD.claim(db, user_id, key, digest, claimed_at)
+        if stored is not None:
+            await replay(stored, digest, scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": None, "headers": [], "body": []}
+
+        async def send_and_capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_body, send_and_capture)
+        finally:
+            async with session_scope() as db:
+                if response["status"] is None or response["status"] >= 500:
+                    await AsyncIdempotencyCRUD.release(db, user_id, key, claimed_at)
+                else:
+                    await AsyncIdempotencyCRUD.complete(db, user_id, key, claimed_at, response["status"], json.dumps(response["headers"]), b"".join(response["body"]))
+
+
+async def purge_expired_keys():
+    """Delete expired keys every IDEMPOTENCY_CLEANUP_INTERVAL seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(config.IDEMPOTENCY_CLEANUP_INTERVAL)
+        try:
+            async with session_scope() as db:
+                deleted = await AsyncIdempotencyCRUD.delete_expired(db)
+            if deleted:
+                logger.info("purged %d expired idempotency keys", deleted)
+        except Exception:
+            logger.exception("purging expired idempotency keys failed")
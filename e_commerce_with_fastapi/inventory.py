@@ -0,0 +1,21 @@
+import asyncio
+import logging
+
+import config
+from crud import AsyncInventoryCRUD
+from database import session_scope
+
+logger = logging.getLogger(__name__)
+
+
+async def sweep_expired_holds():
+    """Give expired inventory holds back every INVENTORY_SWEEP_INTERVAL seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(config.INVENTORY_SWEEP_INTERVAL)
+        try:
+            async with session_scope() as db:
+                released = await AsyncInventoryCRUD.release_expired_holds(db)
+            if released:
+                logger.info("released %d expired inventory holds", released)
+        except Exception:
+            logger.exception("releasing expired inventory holds failed")
@@ -1,85 +1,194 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Union
+import asyncio
+import os
+import admission
+import config
+import etags
+import idempotency
+import inventory
+import product_io
+import replication
+import request_metrics
 import schemas
-from database import get_db
-from fastapi.security import OAuth2PasswordBearer
-from auth import create_access_token, verify_access_token
-from crud import UserCRUD, ProductCRUD, CategoryCRUD, CartCRUD, OrderCRUD
-from typing import List
+import warmup
+from database import get_db, get_read_db, pool_status
+from cache import catalog_cache
+from hashing import HashingBusy, password_hasher
+from pagination import NEXT_CURSOR_HEADER
+from query_budget import QueryBudgetMiddleware, query_budget
+from auth import create_access_token, ensure_owner, get_current_user, oauth2_scheme, revoke_token
+from crud import parse_product_cursor, search_cursor, parse_search_cursor, order_cursor, parse_order_cursor, iter_product_partitions, aiter_product_partitions
+from crud import CartNotFound, InsufficientStock, AsyncUserCRUD, AsyncCatalogCRUD, AsyncProductCRUD, AsyncCategoryCRUD, AsyncInventoryCRUD, AsyncCartCRUD, AsyncOrderCRUD
 
 app = FastAPI()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+app.add_middleware(QueryBudgetMiddleware)
+app.add_middleware(replication.ReadYourWritesMiddleware)
+# Outside the query budgets: its statements are bookkeeping around the endpoint, not part of it.
+app.add_middleware(idempotency.IdempotencyMiddleware)
+# Ahead of the idempotency claim, which already takes a connection.
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(request_metrics.RequestMetricsMiddleware)
+DbSession = Union[Session, AsyncSession]
+
+
+@app.on_event("shutdown")
+def stop_hashing_workers():
+    password_hasher.shutdown()
+
+
+@app.on_event("startup")
+async def start_idempotency_cleanup():
+    app.state.idempotency_cleanup = asyncio.create_task(idempotency.purge_expired_keys())
+
+
+@app.on_event("shutdown")
+async def stop_idempotency_cleanup():
+    app.state.idempotency_cleanup.cancel()
+
+
+@app.on_event("startup")
+async def start_replica_monitor():
+    app.state.replica_monitor = asyncio.create_task(replication.monitor_replicas())
+
+
+@app.on_event("shutdown")
+async def stop_replica_monitor():
+    app.state.replica_monitor.cancel()
+
+
+@app.on_event("startup")
+async def start_hold_sweeper():
+    app.state.hold_sweeper = asyncio.create_task(inventory.sweep_expired_holds())
+
+
+@app.on_event("shutdown")
+async def stop_hold_sweeper():
+    app.state.hold_sweeper.cancel()
+
+
+# Registered last, so the background tasks above are already running.
+@app.on_event("startup")
+async def start_warm_up():
+    app.state.draining = False
+    await warmup.start_warm_up(app.state)
+
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    if app.state.warm_up is not None:
+        app.state.warm_up.cancel()
+
+
+def fast_json(content, response: Response) -> ORJSONResponse:
+    """Send trusted rows as they are, without validating them against the response_model.
+
+    Headers already set on the endpoint's `response` are carried over.
+    """
+    fast = ORJSONResponse(content)
+    fast.headers.update({name: value for name, value in response.headers.items() if name != "content-length"})
+    return fast
+
+
+@app.exception_handler(HashingBusy)
+async def hashing_busy_handler(request: Request, exc: HashingBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many logins in progress, retry shortly"}, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(InsufficientStock)
+async def insufficient_stock_handler(request: Request, exc: InsufficientStock):
+    return JSONResponse(status_code=409, content={"detail": str(exc), "product_ids": exc.product_ids})
 
 
 # ----------------------
 # AUTH & USER ROUTES
 # ----------------------
 
-@app.post("/register", response_model=schemas.UserCreate)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+@app.post("/register", response_model=schemas.UserInDB)
+@query_budget(4)
+async def register(user: schemas.UserCreate, db: DbSession = Depends(get_db)):
     try:
-        existing_user = UserCRUD.get_user_by_username(db, user.username)
+        existing_user = await AsyncUserCRUD.get_user_by_username(db, user.username)
         if existing_user:
             raise HTTPException(status_code=400, detail="Username already taken")
         
-        existing_email = UserCRUD.get_user_by_email(db, user.email)
+        existing_email = await AsyncUserCRUD.get_user_by_email(db, user.email)
         if existing_email:
             raise HTTPException(status_code=400, detail="Email already taken")
         
-        return UserCRUD.create_user(db, user.username, user.email, user.password)
+        password_hash = await password_hasher.ahash(user.password)
+        return await AsyncUserCRUD.create_user(db, user.username, user.email, password_hash=password_hash)
+    except (HTTPException, HashingBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/login", response_model=schemas.Token)
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
+@query_budget(2)
+async def login(user: schemas.UserLogin, db: DbSession = Depends(get_db)):
     try:
-        db_user = UserCRUD.get_user_by_username(db, user.username)
-        if db_user is None or not db_user.verify_password(user.password):
+        db_user = await AsyncUserCRUD.get_user_by_username(db, user.username)
+        if db_user is None or not await password_hasher.averify(user.password, db_user.password):
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
-        access_token = create_access_token(data={"sub": str(db_user.id)})
+        user_id, username = db_user.id, db_user.username
+        # The plain password is only ever at hand here, so this is where hashes
+        # made under an older BCRYPT_ROUNDS get upgraded.
+        if password_hasher.needs_rehash(db_user.password):
+            password_hash = await password_hasher.ahash(user.password)
+            await AsyncUserCRUD.set_password_hash(db, user_id, password_hash)
+
+        access_token = create_access_token(data={"sub": str(user_id), "username": username})
         return {"access_token": access_token, "token_type": "bearer"}
+    except (HTTPException, HashingBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/protected")
-def protected_route(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = verify_access_token(token)
-        if payload is None:
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
+@app.post("/logout")
+@query_budget(0)
+async def logout(token: str = Depends(oauth2_scheme)):
+    if not revoke_token(token):
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return {"message": "Logged out"}
 
-        user_id = payload.get("sub")
-        db_user = UserCRUD.get_user_by_id(db, user_id)
-        if db_user is None:
-            raise HTTPException(status_code=401, detail="User not found")
 
-        return {"message": f"Hello {db_user.username}, this is a protected route."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/protected")
+@query_budget(0)
+async def protected_route(current_user: schemas.CurrentUser = Depends(get_current_user)):
+    return {"message": f"Hello {current_user.username}, this is a protected route."}
 
 
 @app.get("/users/{user_id}", response_model=schemas.UserInDB)
-def get_user_endpoint(user_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    db_user = UserCRUD.get_user_by_id(db, user_id)
+@query_budget(1)
+async def get_user_endpoint(user_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    db_user = await AsyncUserCRUD.get_user_by_id(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
 @app.put("/users/{user_id}", response_model=schemas.UserInDB)
-def update_user_endpoint(user_id: int, user: schemas.UserUpdate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    db_user = UserCRUD.update_user(db, user_id, username=user.username, email=user.email, password=user.password)
+@query_budget(3)
+async def update_user_endpoint(user_id: int, user: schemas.UserUpdate, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
+    password_hash = await password_hasher.ahash(user.password) if user.password else None
+    db_user = await AsyncUserCRUD.update_user(db, user_id, username=user.username, email=user.email, password_hash=password_hash)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
 @app.delete("/users/{user_id}")
-def delete_user_endpoint(user_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    db_user = UserCRUD.delete_user(db, user_id)
+@query_budget(4)
+async def delete_user_endpoint(user_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
+    db_user = await AsyncUserCRUD.delete_user(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
@@ -90,26 +199,38 @@ def delete_user_endpoint(user_id: int, token: str = Depends(oauth2_scheme), db:
 # ----------------------
 
 @app.post("/categories/", response_model=schemas.CategoryResponse)
-def create_category(category: schemas.CategoryCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return CategoryCRUD.create_category(db, category)
+@query_budget(3)
+async def create_category(category: schemas.CategoryCreate, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    return await AsyncCategoryCRUD.create_category(db, category)
 
 
+# Conditional GET: a matching If-None-Match is answered 304 after reading only catalog_versions.
 @app.get("/categories/", response_model=List[schemas.CategoryResponse])
-def get_categories(token: str = Depends(oauth2_scheme),db: Session = Depends(get_db)):
-    return CategoryCRUD.get_categories(db)
+@query_budget(2)
+async def get_categories(request: Request, response: Response, current_user: schemas.CurrentUser = Depends(get_current_user),db: DbSession = Depends(get_read_db)):
+    etag = etags.catalog_etag(await AsyncCatalogCRUD.get_versions(db, ("categories",)))
+    if etags.is_fresh(request, etag):
+        return etags.not_modified(etag)
+    response.headers.update(etags.cache_headers(etag))
+    categories = await AsyncCategoryCRUD.get_categories(db, etag)
+    if config.FAST_RESPONSES:
+        return fast_json(categories, response)
+    return categories
 
 
 @app.put("/categories/{category_id}", response_model=schemas.CategoryResponse)
-def update_category(category_id: int, category: schemas.CategoryCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    updated_category = CategoryCRUD.update_category(db, category_id, category)
+@query_budget(4)
+async def update_category(category_id: int, category: schemas.CategoryCreate, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    updated_category = await AsyncCategoryCRUD.update_category(db, category_id, category)
     if not updated_category:
         raise HTTPException(status_code=404, detail="Category not found")
     return updated_category
 
 
 @app.delete("/categories/{category_id}")
-def delete_category(category_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    deleted = CategoryCRUD.delete_category(db, category_id)
+@query_budget(4)
+async def delete_category(category_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    deleted = await AsyncCategoryCRUD.delete_category(db, category_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Category not found")
     return {"message": "Category deleted successfully"}
@@ -120,36 +241,144 @@ def delete_category(category_id: int, token: str = Depends(oauth2_scheme), db: S
 # ----------------------
 
 @app.post("/products/", response_model=schemas.ProductResponse)
-def create_product(product: schemas.ProductCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return ProductCRUD.create_product(db, product)
+@query_budget(3)
+async def create_product(product: schemas.ProductCreate, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    return await AsyncProductCRUD.create_product(db, product)
 
 
-@app.get("/products/", response_model=List[schemas.ProductResponse])
-def get_products(
+# facets=true wraps the page as {"items": [...], "facets": {...}}, counted in one more statement.
+# Conditional GET as for /categories/; the ETag covers categories too, whose names are embedded.
+@app.get("/products/", response_model=Union[List[schemas.ProductResponse], schemas.ProductListing])
+@query_budget(3)
+async def get_products(
     category_id: int = None, 
     min_price: float = None, 
     max_price: float = None, 
     in_stock: bool = None, 
     skip: int = 0, 
     limit: int = 10, 
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    sort: schemas.ProductSort = schemas.ProductSort.id,
+    cursor: str = None,
+    facets: bool = False,
+    request: Request = None,
+    response: Response = None,
+    current_user: schemas.CurrentUser = Depends(get_current_user),
+    db: DbSession = Depends(get_read_db)
+):
+    try:
+        after = parse_product_cursor(sort.value, cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    etag = etags.catalog_etag(await AsyncCatalogCRUD.get_versions(db, ("products", "categories")))
+    if etags.is_fresh(request, etag):
+        return etags.not_modified(etag)
+    response.headers.update(etags.cache_headers(etag))
+    products, next_cursor = await AsyncProductCRUD.get_products(db, category_id, min_price, max_price, in_stock, skip, limit, sort.value, after, etag)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if facets:
+        counts = await AsyncProductCRUD.get_product_facets(db, category_id, min_price, max_price, in_stock, etag)
+        products = {"items": products, "facets": counts}
+    if config.FAST_RESPONSES:
+        return fast_json(products, response)
+    return products
+
+
+@app.get("/products/search", response_model=List[schemas.ProductResponse])
+@query_budget(1)
+async def search_products(
+    q: str = Query(..., min_length=1),
+    category_id: int = None,
+    min_price: float = None,
+    max_price: float = None,
+    in_stock: bool = None,
+    limit: int = 10,
+    fuzzy: bool = True,
+    cursor: str = None,
+    response: Response = None,
+    current_user: schemas.CurrentUser = Depends(get_current_user),
+    db: DbSession = Depends(get_read_db)
 ):
-    return ProductCRUD.get_products(db, category_id, min_price, max_price, in_stock, skip, limit)
+    try:
+        after = parse_search_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rows = await AsyncProductCRUD.search_products(db, q, category_id, min_price, max_price, in_stock, limit, after, fuzzy)
+    if limit and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = search_cursor(rows[-1].rank, rows[-1].Product.id)
+    return [row.Product for row in rows]
+
+
+# No query budget: one INSERT batch per BULK_BATCH_SIZE rows.
+@app.post("/products/bulk", response_model=schemas.BulkImportResult)
+async def import_products(request: Request, format: schemas.DataFormat = None, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    fmt = format.value if format else product_io.format_from_content_type(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or pass ?format=")
+
+    category_ids = await AsyncCategoryCRUD.get_category_ids(db)
+    report = product_io.ImportReport()
+    batch, lines = [], []
+
+    async def write_batch():
+        failures = await AsyncProductCRUD.import_products(db, batch)
+        for position, error in failures:
+            report.fail(lines[position], error)
+        report.imported += len(batch) - len(failures)
+        batch.clear()
+        lines.clear()
+
+    async for line, record, error in product_io.iter_records(request.stream(), fmt):
+        if error is None:
+            try:
+                batch.append(product_io.parse_product(record, category_ids))
+                lines.append(line)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            report.fail(line, error)
+        if len(batch) >= config.BULK_BATCH_SIZE:
+            await write_batch()
+    if batch:
+        await write_batch()
+    return report.as_dict()
+
+
+@app.get("/products/export")
+@query_budget(1)
+async def export_products(format: schemas.DataFormat = schemas.DataFormat.csv, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    if isinstance(db, AsyncSession):
+        body = product_io.aexport_stream(aiter_product_partitions(db, config.BULK_BATCH_SIZE), format.value)
+    else:
+        body = product_io.export_stream(iter_product_partitions(db, config.BULK_BATCH_SIZE), format.value)
+    return StreamingResponse(body, media_type=product_io.MEDIA_TYPES[format.value])
+
+
+@app.get("/products/{product_id}/availability", response_model=schemas.ProductAvailability)
+@query_budget(1)
+async def get_product_availability(product_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    availability = await AsyncInventoryCRUD.get_availability(db, product_id)
+    if availability is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return availability
 
 
 @app.put("/products/{product_id}", response_model=schemas.ProductResponse)
-def update_product(product_id: int, product: schemas.ProductCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    updated_product = ProductCRUD.update_product(db, product_id, product)
+@query_budget(8)
+async def update_product(product_id: int, product: schemas.ProductCreate, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    updated_product = await AsyncProductCRUD.update_product(db, product_id, product)
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
     return updated_product
 
 
 @app.delete("/products/{product_id}")
-def delete_product(product_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@query_budget(3)
+async def delete_product(product_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
     try:
-        deleted = ProductCRUD.delete_product(db, product_id)
+        deleted = await AsyncProductCRUD.delete_product(db, product_id)
         if not deleted:
             raise HTTPException(status_code=404, detail="Product not found")
         return {"message": "Product deleted successfully"}
@@ -161,26 +390,47 @@ def delete_product(product_id: int, token: str = Depends(oauth2_scheme), db: Ses
 # ----------------------
 
 @app.get("/{user_id}/cart", response_model=schemas.CartResponse)
-def get_cart(user_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return CartCRUD.get_cart(db, user_id)
+@query_budget(3)
+async def get_cart(user_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    ensure_owner(current_user, user_id)
+    return await AsyncCartCRUD.get_cart(db, user_id)
 
 
 @app.post("/{user_id}/cart/add", response_model=schemas.CartItemResponse)
-def add_to_cart(user_id: int, item: schemas.CartItemCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return CartCRUD.add_to_cart(db, user_id, item)
+@query_budget(11)
+async def add_to_cart(user_id: int, item: schemas.CartItemCreate, hold: bool = False, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
+    cart_item = await AsyncCartCRUD.add_to_cart(db, user_id, item, hold)
+    if cart_item is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return cart_item
+
+
+@app.post("/{user_id}/cart/add-many", response_model=List[schemas.CartItemResponse])
+@query_budget(11)
+async def add_many_to_cart(user_id: int, items: List[schemas.CartItemCreate], hold: bool = False, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
+    cart_items = await AsyncCartCRUD.add_many_to_cart(db, user_id, items, hold)
+    if cart_items is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return cart_items
 
 
 @app.put("/{user_id}/cart/update/{cart_item_id}", response_model=schemas.CartItemResponse)
-def update_cart_item(user_id: int, cart_item_id: int, quantity: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    cart_item = CartCRUD.update_cart_item(db, cart_item_id, quantity)
+@query_budget(6)
+async def update_cart_item(user_id: int, cart_item_id: int, quantity: int = Query(..., gt=0), current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
+    cart_item = await AsyncCartCRUD.update_cart_item(db, user_id, cart_item_id, quantity)
     if not cart_item:
         raise HTTPException(status_code=404, detail="Cart item not found")
     return cart_item
 
 
 @app.delete("/{user_id}/cart/remove/{cart_item_id}")
-def remove_cart_item(user_id: int, cart_item_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    removed = CartCRUD.remove_cart_item(db, cart_item_id)
+@query_budget(5)
+async def remove_cart_item(user_id: int, cart_item_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
+    removed = await AsyncCartCRUD.remove_cart_item(db, user_id, cart_item_id)
     if not removed:
         raise HTTPException(status_code=404, detail="Cart item not found")
     return {"message": "Cart item removed"}
@@ -191,11 +441,92 @@ def remove_cart_item(user_id: int, cart_item_id: int, token: str = Depends(oauth
 # ----------------------
 
 @app.post("/checkout/{user_id}", response_model=schemas.OrderInDB)
-def checkout(user_id: int, cart_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@query_budget(18)
+async def checkout(user_id: int, cart_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_db)):
+    ensure_owner(current_user, user_id)
     try:
-        order = OrderCRUD.place_order(db, user_id, cart_id)
+        order = await AsyncOrderCRUD.place_order(db, user_id, cart_id)
         if order is None:
             raise HTTPException(status_code=400, detail="Not enough stock or cart is empty")
         return order
+    except HTTPException:
+        raise
+    except CartNotFound:
+        raise HTTPException(status_code=404, detail="Cart not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/users/{user_id}/orders", response_model=List[schemas.OrderInDB])
+@query_budget(2)
+async def get_user_orders(user_id: int, limit: int = Query(20, ge=1, le=100), cursor: str = None, response: Response = None, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    ensure_owner(current_user, user_id)
+    try:
+        after = parse_order_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    orders = await AsyncOrderCRUD.get_orders(db, user_id, limit, after)
+    if len(orders) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = order_cursor(orders[-1])
+    return orders
+
+
+@app.get("/users/{user_id}/orders/stats", response_model=schemas.OrderStats)
+@query_budget(1)
+async def get_user_order_stats(user_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    ensure_owner(current_user, user_id)
+    return await AsyncOrderCRUD.get_order_stats(db, user_id)
+
+
+@app.get("/orders/{order_id}", response_model=schemas.OrderInDB)
+@query_budget(2)
+async def get_order(order_id: int, current_user: schemas.CurrentUser = Depends(get_current_user), db: DbSession = Depends(get_read_db)):
+    order = await AsyncOrderCRUD.get_order(db, order_id)
+    # Someone else's order is reported missing, so order ids can't be probed.
+    if order is None or order.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+
+
+# ----------------------
+# OPERATIONS ROUTES
+# ----------------------
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+
+# 503 while warming up or draining, so load balancers hold traffic back.
+@app.get("/health/ready")
+async def readiness():
+    status = "draining" if app.state.draining else "ready" if app.state.ready else "warming_up"
+    content = {"status": status, "pid": os.getpid(), "warm_up_seconds": app.state.warm_up_seconds}
+    return JSONResponse(status_code=200 if status == "ready" else 503, content=content)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(request_metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    return pool_status()
+
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return catalog_cache.stats()
+
+
+@app.get("/metrics/hashing")
+async def hashing_metrics():
+    return password_hasher.stats()
+
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    return admission.stats()
@@ -0,0 +1,108 @@
+import threading
+from bisect import bisect_left
+
+# Seconds; tuned for waits and latencies between sub-millisecond and pool_timeout.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative["+Inf" if bound == float("inf") else repr(bound)] = running
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+class Family:
+    """A named metric with one child per combination of label values, for /metrics."""
+
+    def __init__(self, name: str, kind: str, help: str, labels: tuple = (), factory=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label_names = labels
+        self.factory = factory or {"counter": Counter, "gauge": Gauge, "histogram": Histogram}[kind]
+        self._children = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def wrap(cls, name: str, kind: str, help: str, metric):
+        """Expose an existing unlabelled metric under name."""
+        family = cls(name, kind, help, factory=lambda: metric)
+        family.labels()
+        return family
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+        return child
+
+    def collect(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+def _label_text(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(families) -> str:
+    """Render families in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for values, child in family.collect():
+            if family.kind != "histogram":
+                lines.append(f"{family.name}{_label_text(family.label_names, values)} {child.value}")
+                continue
+            snapshot = child.snapshot()
+            labels = _label_text(family.label_names, values)
+            for bound, count in snapshot["buckets"].items():
+                le = 'le="%s"' % bound
+                lines.append(f"{family.name}_bucket{_label_text(family.label_names, values, le)} {count}")
+            lines.append(f"{family.name}_sum{labels} {snapshot['sum']}")
+            lines.append(f"{family.name}_count{labels} {snapshot['count']}")
+    return "\n".join(lines) + "\n"
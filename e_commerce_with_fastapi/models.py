@@ -1,16 +1,15 @@
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, ForeignKey, Numeric
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, Boolean, DateTime, LargeBinary, String, ForeignKey, Numeric, Index, Text, DDL, event, func, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from database import Base
-from datetime import datetime
-from passlib.context import CryptContext
+from datetime import datetime, timezone
+from hashing import password_hasher
 
 
 Base = declarative_base()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 class User(Base):
     __tablename__ = "users"
@@ -25,11 +24,11 @@ class User(Base):
 
      # Method to hash password
     def set_password(self, password: str):
-        self.password = pwd_context.hash(password)
+        self.password = password_hasher.hash(password)
 
     # Method to check if the provided password is correct
     def verify_password(self, password: str):
-        return pwd_context.verify(password, self.password)
+        return password_hasher.verify(password, self.password)
 
 
 class Category(Base):
@@ -50,29 +49,205 @@ class Product(Base):
     stock = Column(Integer, nullable=False)
     
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
+
+    # Full-text document for /products/search, filled in by a trigger on PostgreSQL
+    # and left empty elsewhere. Deferred so listings never load it.
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
     
     # Relationship with Category
     category = relationship("Category", back_populates="products")
+
+    __table_args__ = (
+        # Keyset pagination: ORDER BY <sort key>, id
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        # Filters on the listing, still in id order
+        Index("ix_products_category_id_id", "category_id", "id"),
+        Index("ix_products_stock_id", "stock", "id"),
+        # in_stock=true listings only ever look at this slice of the table
+        Index("ix_products_in_stock", "id", postgresql_where=text("stock > 0"), sqlite_where=text("stock > 0")),
+        # Facet counts group by these three only, so they can be read from the index alone
+        Index("ix_products_facets", "category_id", "price", "stock"),
+        # Search: full-text matches, and trigram matches for misspelled terms
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_products_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+# Statements that set up products.search_vector's trigger (and the extension the
+# trigram index needs); each is safe to re-run.
+PRODUCT_SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('english', NEW.name);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS products_search_vector_update ON products",
+    """
+    CREATE TRIGGER products_search_vector_update BEFORE INSERT OR UPDATE OF name ON products
+    FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """,
+)
+event.listen(Product.__table__, "before_create", DDL(PRODUCT_SEARCH_DDL[0]).execute_if(dialect="postgresql"))
+for statement in PRODUCT_SEARCH_DDL[1:]:
+    event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+# Upper bounds of the price buckets products are counted in for facets; the
+# last bucket is open-ended. Changing them needs product_facet_counts rebuilt.
+PRICE_FACET_BOUNDS = (10, 25, 50, 100, 250, 500)
+
+
+class ProductFacetCount(Base):
+    """Products per (category, price bucket, in stock), for facet counts.
+
+    Kept current on PostgreSQL by statement-level triggers on products, so
+    every writer (imports, checkouts) is covered; unused elsewhere.
+    """
+    __tablename__ = "product_facet_counts"
+
+    category_id = Column(Integer, primary_key=True)
+    price_bucket = Column(Integer, primary_key=True)
+    in_stock = Column(Boolean, primary_key=True)
+    count = Column(BigInteger, nullable=False)
+
+
+# Each trigger applies one aggregated delta per statement; changes that leave
+# every count as it was (most stock updates) write nothing.
+PRODUCT_FACET_DDL = (
+    """
+    CREATE OR REPLACE FUNCTION product_price_bucket(price numeric) RETURNS integer
+    LANGUAGE sql IMMUTABLE AS $$ SELECT width_bucket(price, '{%s}'::numeric[]) $$
+    """ % ",".join(str(bound) for bound in PRICE_FACET_BOUNDS),
+    """
+    CREATE OR REPLACE FUNCTION product_facet_counts_update() RETURNS trigger AS $$
+    DECLARE
+        changes text := CASE TG_OP
+            WHEN 'INSERT' THEN 'SELECT category_id, price, stock, 1 AS delta FROM new_rows'
+            WHEN 'DELETE' THEN 'SELECT category_id, price, stock, -1 AS delta FROM old_rows'
+            ELSE 'SELECT category_id, price, stock, 1 AS delta FROM new_rows '
+                 'UNION ALL SELECT category_id, price, stock, -1 FROM old_rows'
+        END;
+    BEGIN
+        EXECUTE 'INSERT INTO product_facet_counts AS f (category_id, price_bucket, in_stock, count) '
+            'SELECT category_id, product_price_bucket(price), stock > 0, sum(delta) FROM (' || changes || ') AS changes '
+            'GROUP BY 1, 2, 3 HAVING sum(delta) <> 0 ORDER BY 1, 2, 3 '
+            'ON CONFLICT (category_id, price_bucket, in_stock) DO UPDATE SET count = f.count + excluded.count';
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+) + tuple(
+    statement
+    for operation, tables in (
+        ("insert", "NEW TABLE AS new_rows"),
+        ("update", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ("delete", "OLD TABLE AS old_rows"),
+    )
+    for statement in (
+        f"DROP TRIGGER IF EXISTS product_facet_counts_{operation} ON products",
+        f"CREATE TRIGGER product_facet_counts_{operation} AFTER {operation.upper()} ON products "
+        f"REFERENCING {tables} FOR EACH STATEMENT EXECUTE FUNCTION product_facet_counts_update()",
+    )
+)
+# Fills product_facet_counts from scratch if it is empty.
+PRODUCT_FACET_BACKFILL = """
+    INSERT INTO product_facet_counts (category_id, price_bucket, in_stock, count)
+    SELECT category_id, product_price_bucket(price), stock > 0, count(*) FROM products
+    WHERE NOT EXISTS (SELECT 1 FROM product_facet_counts)
+    GROUP BY 1, 2, 3
+"""
+for statement in PRODUCT_FACET_DDL:
+    event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+class CatalogVersion(Base):
+    """Write counters behind the catalog ETags, one set of rows per table.
+
+    A table's version is the sum of its shards. Each write bumps one shard
+    chosen at random as the last statement of its own transaction, so the
+    new version commits with the write and concurrent checkouts rarely
+    queue on the same row.
+    """
+    __tablename__ = "catalog_versions"
+
+    name = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class InventoryShard(Base):
+    """Units of a product neither sold nor held, split over INVENTORY_SHARDS rows.
+
+    Holds and checkouts take from one row with enough units, picked at random.
+    The rows are created from products.stock the first time the product is
+    held or sold, and dropped whenever its stock is set, to be created again
+    from the new figure.
+    """
+    __tablename__ = "inventory_shards"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    available = Column(Integer, nullable=False)
+
+
 class Cart(Base):
     __tablename__ = "carts"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Added foreign key to User
+    # Kept current by every change to the cart's lines, so showing the cart's
+    # totals needs no sum over them.
+    item_count = Column(Integer, nullable=False, default=0, server_default="0")
+    subtotal = Column(Numeric, nullable=False, default=0, server_default="0")
     items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
 
     user = relationship("User", back_populates="carts")  # Link back to the User model
 
+    __table_args__ = (
+        # One cart per user, which add-to-cart's ON CONFLICT (user_id) relies on.
+        Index("uq_carts_user_id", "user_id", unique=True),
+    )
+
 class CartItem(Base):
     __tablename__ = "cart_items"
 
     id = Column(Integer, primary_key=True, index=True)
     cart_id = Column(Integer, ForeignKey("carts.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))  # Linking to products
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)  # Linking to products
     quantity = Column(Integer, default=1)
+    # The product's name and price, copied when the line is added and carried
+    # along by product updates (see CartCRUD._reprice_lines)
+    name = Column(String, nullable=False)
+    price = Column(Numeric, nullable=False)
 
     cart = relationship("Cart", back_populates="items")
     product = relationship("Product")  # Linking to Product Model
 
+    __table_args__ = (
+        # One line per product in a cart; also serves lookups by cart_id alone.
+        Index("uq_cart_items_cart_id_product_id", "cart_id", "product_id", unique=True),
+    )
+
+class InventoryHold(Base):
+    """Units taken from an inventory shard for a cart, until checkout or expires_at."""
+    __tablename__ = "inventory_holds"
+
+    id = Column(Integer, primary_key=True)
+    cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    shard = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        Index("ix_inventory_holds_cart_id_product_id", "cart_id", "product_id"),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -80,19 +255,49 @@ class Order(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     total_price = Column(Numeric, nullable=False)
     status = Column(String, default="Pending")  # Order status (e.g., Pending, Completed, Canceled)
-    created_at = Column(String, default=datetime.utcnow().isoformat())
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc), server_default=func.now())
 
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # A user's order history, newest first, paged by (created_at, id).
+        Index("ix_orders_user_id_created_at", "user_id", "created_at", "id"),
+    )
+
+class UserOrderStats(Base):
+    """Lifetime order count and spend per user, added to by every checkout."""
+    __tablename__ = "user_order_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    order_count = Column(BigInteger, nullable=False, default=0)
+    total_spent = Column(Numeric, nullable=False, default=0)
+
+
 class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
     price = Column(Numeric, nullable=False)  # The price at the time of purchase
 
     order = relationship("Order", back_populates="items")
-    product = relationship("Product")
\ No newline at end of file
+    product = relationship("Product")
+
+
+class IdempotencyKey(Base):
+    """A mutating request sent with an Idempotency-Key header and, once it finished, its response.
+
+    status_code stays NULL while the first request with the key is running.
+    """
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    status_code = Column(Integer)
+    response_headers = Column(Text)
+    response_body = Column(LargeBinary)
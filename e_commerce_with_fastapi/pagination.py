@@ -0,0 +1,31 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(*values) -> str:
+    """Pack the last row's sort key into an opaque, URL-safe token."""
+    payload = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor")
+    if not isinstance(values, list):
+        raise ValueError("Malformed cursor")
+    return values
@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+from decimal import Decimal
+
+FIELDS = ("id", "name", "price", "stock", "category_id")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+MAX_REPORTED_ERRORS = 100
+
+
+def format_from_content_type(content_type: str):
+    content_type = (content_type or "").lower()
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+        return "ndjson"
+    return None
+
+
+def _decode(line: bytes):
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError:
+        return None
+
+
+async def iter_lines(chunks):
+    """Split a stream of byte chunks into (line number, text) pairs, one line in memory at a time.
+
+    The text is None for a line that is not valid UTF-8.
+    """
+    buffer = b""
+    number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            yield number, _decode(line)
+    if buffer:
+        yield number + 1, _decode(buffer)
+
+
+async def iter_records(chunks, fmt: str):
+    """Yield (line number, raw record, error) for each record of a CSV or NDJSON upload.
+
+    Exactly one of record and error is set. A CSV record may span lines
+    inside a quoted field; it is numbered by its first line.
+    """
+    header = None
+    pending, first_line = "", None
+    async for number, line in iter_lines(chunks):
+        if line is None:
+            # Drops the CSV record the line belongs to, if it continues one.
+            yield first_line or number, None, "not valid UTF-8"
+            pending, first_line = "", None
+            continue
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, None, "invalid JSON"
+                continue
+            if isinstance(record, dict):
+                yield number, record, None
+            else:
+                yield number, None, "expected a JSON object"
+            continue
+
+        # An odd number of quote characters so far means a quoted field is still open.
+        pending = pending + "\n" + line if first_line is not None else line
+        first_line = first_line or number
+        if pending.count('"') % 2:
+            continue
+        text, number, pending, first_line = pending, first_line, "", None
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            missing = set(FIELDS) - {"id"} - set(header)
+            if missing:
+                yield number, None, f"header is missing {', '.join(sorted(missing))}"
+                return
+        elif len(values) != len(header):
+            yield number, None, f"expected {len(header)} fields, got {len(values)}"
+        else:
+            yield number, dict(zip(header, values)), None
+    if first_line is not None:
+        yield first_line, None, "unterminated quoted field"
+
+
+def _field(record: dict, name: str, convert):
+    value = record.get(name)
+    if value is None or value == "":
+        raise ValueError(f"{name} is required")
+    try:
+        return convert(value)
+    except (ArithmeticError, TypeError, ValueError):
+        raise ValueError(f"{name}: invalid value {value!r}")
+
+
+def _integer(value) -> int:
+    # int() would truncate 1.7 to 1 and take true for 1.
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError
+    return int(value)
+
+
+def _text(value) -> str:
+    value = str(value).strip()
+    if not value:
+        raise ValueError
+    return value
+
+
+def parse_product(record: dict, category_ids: set) -> dict:
+    """Validate one raw record into column values for products; raises ValueError."""
+    product = {
+        "name": _field(record, "name", _text),
+        "price": _field(record, "price", lambda value: Decimal(str(value))),
+        "stock": _field(record, "stock", _integer),
+        "category_id": _field(record, "category_id", _integer),
+    }
+    if not product["price"].is_finite() or product["price"] < 0:
+        raise ValueError(f"price: invalid value {record['price']!r}")
+    if product["stock"] < 0:
+        raise ValueError(f"stock: invalid value {record['stock']!r}")
+    if product["category_id"] not in category_ids:
+        raise ValueError(f"category {product['category_id']} does not exist")
+    if record.get("id") not in (None, ""):
+        product["id"] = _field(record, "id", _integer)
+    return product
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def as_dict(self) -> dict:
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+def encode_rows(rows, fmt: str) -> str:
+    """Serialize (id, name, price, stock, category_id) rows in export format."""
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps({"id": id, "name": name, "price": str(price), "stock": stock, "category_id": category_id}) + "\n"
+            for id, name, price, stock, category_id in rows
+        )
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(rows)
+    return out.getvalue()
+
+
+def export_stream(partitions, fmt: str):
+    if fmt == "csv":
+        yield ",".join(FIELDS) + "\n"
+    for rows in partitions:
+        yield encode_rows(rows, fmt)
+
+
+async def aexport_stream(partitions, fmt: str):
+    if fmt == "csv":
+        yield ",".join(FIELDS) + "\n"
+    async for rows in partitions:
+        yield encode_rows(rows, fmt)
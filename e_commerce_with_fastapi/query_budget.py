@@ -0,0 +1,45 @@
+import logging
+
+import config
+from database import track_queries
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit: int):
+    """Declare the most SQL statements one request to this endpoint may issue."""
+    def decorate(endpoint):
+        endpoint.query_budget = limit
+        return endpoint
+    return decorate
+
+
+class QueryBudgetMiddleware:
+    """Counts statements per request and compares them to the endpoint's budget.
+
+    Overruns are logged; with QUERY_BUDGET_ENFORCE=1 (meant for test runs) they
+    raise QueryBudgetExceeded so the offending request fails loudly.
+    """
+
+    def __init__(self, app, enforce: bool = None):
+        self.app = app
+        self.enforce = config.QUERY_BUDGET_ENFORCE if enforce is None else enforce
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            await self.app(scope, receive, send)
+
+        budget = getattr(scope.get("endpoint"), "query_budget", None)
+        if budget is not None and stats.count > budget:
+            message = f"{scope['method']} {scope['path']} issued {stats.count} queries, budget is {budget}"
+            if self.enforce:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
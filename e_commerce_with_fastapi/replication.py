@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import config
+import database
+from auth import bearer_user_id
+
+logger = logging.getLogger(__name__)
+
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class RecentWriters:
+    """Users who sent a mutating request in the last DB_READ_YOUR_WRITES_SECONDS."""
+
+    def __init__(self):
+        # user id -> time of the write, oldest first.
+        self._written = OrderedDict()
+
+    def add(self, user_id: int):
+        self._written[user_id] = time.monotonic()
+        self._written.move_to_end(user_id)
+        self._expire()
+
+    def __contains__(self, user_id) -> bool:
+        self._expire()
+        return user_id in self._written
+
+    def _expire(self):
+        cutoff = time.monotonic() - config.DB_READ_YOUR_WRITES_SECONDS
+        while self._written and next(iter(self._written.values())) < cutoff:
+            self._written.popitem(last=False)
+
+
+recent_writers = RecentWriters()
+
+
+class ReadYourWritesMiddleware:
+    """Sends a user's reads to the primary for a while after each of their writes.
+
+    Replicas trail the primary, so a cart read right after adding to the cart
+    could miss the new line. The window is per process; it covers clients that
+    keep their connection to one worker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not database.replicas:
+            await self.app(scope, receive, send)
+            return
+        user_id = bearer_user_id(dict(scope["headers"]))
+        if user_id is None:
+            await self.app(scope, receive, send)
+            return
+        token = database.read_from_primary.set(user_id in recent_writers)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            database.read_from_primary.reset(token)
+            if scope["method"] in MUTATING_METHODS:
+                recent_writers.add(user_id)
+
+
+async def check_replica(replica):
+    try:
+        lag = await asyncio.wait_for(replica.measure_lag(), config.DB_REPLICA_CHECK_INTERVAL)
+    except Exception as exc:
+        lag, reason = None, f"unreachable ({exc!r})"
+    else:
+        reason = f"{lag:.1f}s behind"
+    healthy = lag is not None and lag <= config.DB_REPLICA_MAX_LAG
+    if healthy and not replica.healthy:
+        logger.info("replica %s back in rotation", replica.name)
+    elif not healthy and (replica.healthy or replica.checked_at is None):
+        logger.warning("replica %s out of rotation: %s", replica.name, reason)
+    replica.healthy, replica.lag, replica.checked_at = healthy, lag, time.time()
+
+
+async def monitor_replicas():
+    """Check every replica's lag every DB_REPLICA_CHECK_INTERVAL seconds, until cancelled."""
+    while database.replicas:
+        await asyncio.gather(*(check_replica(replica) for replica in database.replicas))
+        await asyncio.sleep(config.DB_REPLICA_CHECK_INTERVAL)
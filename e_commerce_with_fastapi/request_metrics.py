@@ -0,0 +1,98 @@
+import time
+
+from starlette.routing import Match
+
+import database
+from metrics import Counter, Family, Gauge, Histogram, prometheus_text
+
+# Statements per request: budgets are single digits, bulk imports run into the thousands.
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 50, 100, 1000, 10000)
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Family("http_requests_total", "counter", "Requests served, by route and response status.", ROUTE_LABELS + ("status",))
+requests_in_progress = Family("http_requests_in_progress", "gauge", "Requests currently being served.", ROUTE_LABELS)
+request_seconds = Family("http_request_duration_seconds", "histogram", "Time from receiving a request to sending the last byte of its response.", ROUTE_LABELS)
+request_queries = Family("http_request_db_queries", "histogram", "SQL statements issued per request.", ROUTE_LABELS, lambda: Histogram(QUERY_COUNT_BUCKETS))
+request_db_seconds = Family("http_request_db_seconds", "histogram", "Time per request spent in SQL statements.", ROUTE_LABELS)
+admission_decisions = Family("admission_decisions_total", "counter", "Requests admitted at once, admitted after queueing, rate limited (429) or shed (503).", ("decision", "priority"))
+admission_in_flight = Gauge()
+admission_waiting = Gauge()
+admission_wait_seconds = Histogram()
+rate_limit_backend_errors = Counter()
+replica_in_rotation = Family("db_replica_in_rotation", "gauge", "1 while the replica serves reads, 0 while it lags or is unreachable.", ("replica",))
+replica_lag_seconds = Family("db_replica_lag_seconds", "gauge", "Replication lag at the last health check; -1 if unreachable.", ("replica",))
+replica_reads_in_progress = Family("db_replica_reads_in_progress", "gauge", "Requests currently reading from the replica.", ("replica",))
+
+FAMILIES = (
+    requests_total,
+    requests_in_progress,
+    request_seconds,
+    request_queries,
+    request_db_seconds,
+    admission_decisions,
+    Family.wrap("admission_requests_in_flight", "gauge", "Requests holding an admission slot.", admission_in_flight),
+    Family.wrap("admission_requests_waiting", "gauge", "Requests queued for an admission slot.", admission_waiting),
+    Family.wrap("admission_wait_seconds", "histogram", "Time queued requests waited for a slot.", admission_wait_seconds),
+    Family.wrap("rate_limit_backend_errors_total", "counter", "Shared rate limit backend failures; requests are let through.", rate_limit_backend_errors),
+    replica_in_rotation,
+    replica_lag_seconds,
+    replica_reads_in_progress,
+    Family.wrap("db_query_duration_seconds", "histogram", "Duration of every SQL statement.", database.query_seconds),
+    Family.wrap("db_slow_queries_total", "counter", "Statements slower than SLOW_QUERY_SECONDS.", database.slow_queries),
+    Family.wrap("db_pool_checkout_wait_seconds", "histogram", "Time requests waited for a pooled connection.", database.pool_wait_seconds),
+)
+
+
+def route_label(scope) -> str:
+    # The route's path template, so /products/{product_id} is one series rather than
+    # one per id. A path matched only for another method (a 405) keeps its template.
+    label = "unmatched"
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and label == "unmatched":
+            label = route.path
+    return label
+
+
+def prometheus() -> str:
+    for replica in database.replicas:
+        replica_in_rotation.labels(replica.name).value = int(replica.healthy)
+        replica_lag_seconds.labels(replica.name).value = -1 if replica.lag is None else replica.lag
+        replica_reads_in_progress.labels(replica.name).value = replica.in_flight.value
+    return prometheus_text(FAMILIES)
+
+
+class RequestMetricsMiddleware:
+    """Latency, status, in-flight count, statement count and SQL time per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (scope["method"], route_label(scope))
+        status = 500
+
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = requests_in_progress.labels(*labels)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            with database.track_queries() as stats:
+                await self.app(scope, receive, send_and_record_status)
+        finally:
+            in_progress.dec()
+            request_seconds.labels(*labels).observe(time.perf_counter() - started)
+            requests_total.labels(*labels, str(status)).inc()
+            request_queries.labels(*labels).observe(stats.count)
+            request_db_seconds.labels(*labels).observe(stats.seconds)
@@ -1,6 +1,8 @@
+from pydantic import BaseModel, conint
 from pydantic import BaseModel
-from pydantic import BaseModel
+from datetime import datetime
 from typing import List, Optional
+from enum import Enum
 
 class PostCreate(BaseModel):
     title: str
@@ -40,16 +42,56 @@ class ProductResponse(ProductBase):
     class Config:
         orm_mode = True
 
+class CategoryFacet(BaseModel):
+    category_id: int
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    min: Optional[float]
+    max: Optional[float]
+    count: int
+
+class ProductFacets(BaseModel):
+    total: int
+    categories: List[CategoryFacet]
+    price_buckets: List[PriceBucketFacet]
+    in_stock: int
+    out_of_stock: int
+
+class ProductListing(BaseModel):
+    items: List[ProductResponse]
+    facets: ProductFacets
+
+class ProductSort(str, Enum):
+    id = "id"
+    price = "price"
+    name = "name"
+
+class DataFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[BulkImportError]
+
 class CartItemBase(BaseModel):
     product_id: int
     quantity: int
 
 class CartItemCreate(CartItemBase):
-    pass
+    quantity: conint(gt=0)
 
 class CartItemResponse(CartItemBase):
     id: int
     cart_id: int
+    name: str
+    price: float
 
     class Config:
         orm_mode = True
@@ -57,6 +99,8 @@ class CartItemResponse(CartItemBase):
 class CartResponse(BaseModel):
     id: int
     user_id: int
+    item_count: int
+    subtotal: float
     items: List[CartItemResponse]
 
     class Config:
@@ -91,12 +135,22 @@ class OrderInDB(BaseModel):
     user_id: int
     total_price: float
     status: str
-    created_at: str
+    created_at: datetime
     items: List[OrderItemInDB]
 
     class Config:
         orm_mode = True
 
+class ProductAvailability(BaseModel):
+    product_id: int
+    stock: int
+    held: int
+    available: int
+
+class OrderStats(BaseModel):
+    order_count: int
+    total_spent: float
+
 
 class UserBase(BaseModel):
     username: str
@@ -116,4 +170,8 @@ class UserLogin(BaseModel):
 
 class Token(BaseModel):
     access_token: str
-    token_type: str
\ No newline at end of file
+    token_type: str
+
+class CurrentUser(BaseModel):
+    id: int
+    username: str
@@ -0,0 +1,139 @@
+"""Production entry point: load the app once, then fork warmed-up workers.
+
+    python serve.py --host 0.0.0.0 --port 8000 [--workers N]
+
+The parent imports the app and does the one-off work every worker would
+otherwise repeat (mapper configuration, the OpenAPI schema, loading bcrypt),
+binds the socket and forks SERVE_WORKERS workers sharing it. Each worker
+warms up before it accepts a connection (see warmup.py); workers that die
+are replaced. SIGTERM or SIGINT to the parent drains and stops every worker.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+import uvicorn
+
+import config
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class DrainingServer(uvicorn.Server):
+    """A uvicorn server that fails readiness for SERVE_DRAIN_SECONDS before stopping on SIGTERM."""
+
+    def __init__(self, server_config, app, index: int, launched: float):
+        super().__init__(server_config)
+        self.app = app
+        self.index = index
+        self.launched = launched
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        if not self.should_exit:
+            logger.info(
+                "worker %d [%d] accepting %.2fs after launch (warm-up %s)",
+                self.index, os.getpid(), time.time() - self.launched,
+                "%.2fs" % self.app.state.warm_up_seconds if self.app.state.ready else "unfinished",
+            )
+
+    def handle_exit(self, sig, frame):
+        if sig == signal.SIGTERM and not self.app.state.draining and config.SERVE_DRAIN_SECONDS > 0:
+            self.app.state.draining = True
+            logger.info("worker %d [%d] draining for %ss", self.index, os.getpid(), config.SERVE_DRAIN_SECONDS)
+            asyncio.get_running_loop().call_later(config.SERVE_DRAIN_SECONDS, super().handle_exit, sig, frame)
+            return
+        super().handle_exit(sig, frame)
+
+
+def run_worker(server_config, app, sock, index: int, launched: float):
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    DrainingServer(server_config, app, index, launched).run(sockets=[sock])
+
+
+def spawn(server_config, app, sock, index: int, launched: float) -> int:
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            run_worker(server_config, app, sock, index, launched)
+            status = 0
+        except BaseException:
+            logger.exception("worker %d [%d] failed", index, os.getpid())
+        finally:
+            os._exit(status)
+    return pid
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=config.SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+def serve(argv=None):
+    args = parse_args(argv)
+    launched = time.time()
+    if "HASH_WORKERS" not in os.environ:
+        # Split the CPUs between the workers' hashing pools instead of giving every worker one per CPU.
+        config.HASH_WORKERS = max(1, (os.cpu_count() or 1) // args.workers)
+
+    from sqlalchemy.orm import configure_mappers
+
+    import hashing
+    from main import app
+
+    configure_mappers()
+    app.openapi()
+    hashing.crypt_context(4).hash("preload")
+    server_config = uvicorn.Config(app, host=args.host, port=args.port, log_level=args.log_level, timeout_graceful_shutdown=config.SERVE_GRACEFUL_TIMEOUT)
+    sock = server_config.bind_socket()
+    logger.info("loaded the app in %.2fs, starting %d workers", time.time() - launched, args.workers)
+
+    stopping = False
+    workers = {}
+
+    def stop(sig, frame):
+        nonlocal stopping
+        stopping = True
+        # SIGTERM either way: a worker seeing SIGINT twice (from the terminal and
+        # from here) would skip its graceful shutdown.
+        for pid in list(workers):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(args.workers):
+        workers[spawn(server_config, app, sock, index, launched)] = (index, time.monotonic())
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in workers:
+            continue
+        index, started = workers.pop(pid)
+        if stopping:
+            continue
+        logger.warning("worker %d [%d] exited with status %d, replacing it", index, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < 1:
+            # Don't spin on a worker that can't start.
+            time.sleep(1)
+            if stopping:
+                continue
+        workers[spawn(server_config, app, sock, index, time.time())] = (index, time.monotonic())
+    sock.close()
+    logger.info("all workers stopped")
+
+
+if __name__ == "__main__":
+    sys.exit(serve())
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# The app reads its settings at import time, so they are set before anything imports it.
+DB_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("WARM_UP", "0")
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("QUERY_BUDGET_ENFORCE", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+
+    import models
+    from main import app
+
+    models.Base.metadata.create_all(create_engine(os.environ["DATABASE_URL"]))
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_user(client):
+    """Register a user and return (id, auth headers)."""
+    def make(name):
+        username = f"{name}-{uuid.uuid4().hex[:8]}"
+        user = client.post("/register", json={"username": username, "email": f"{username}@example.com", "password": "pw"})
+        assert user.status_code == 200, user.text
+        token = client.post("/login", json={"username": username, "password": "pw"}).json()["access_token"]
+        return user.json()["id"], {"Authorization": f"Bearer {token}"}
+
+    return make
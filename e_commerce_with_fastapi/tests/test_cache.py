@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import fakeredis
+from sqlalchemy.util import greenlet_spawn
+
+from cache import Cache, RedisCache
+
+
+class ThreadRecordingRedis(fakeredis.FakeRedis):
+    def execute_command(self, *args, **kwargs):
+        self.threads.add(threading.get_ident())
+        return super().execute_command(*args, **kwargs)
+
+
+def redis_cache():
+    client = ThreadRecordingRedis()
+    client.threads = set()
+    return Cache(RedisCache(client, ttl=60)), client
+
+
+def test_redis_round_trips_leave_the_event_loop():
+    cache, client = redis_cache()
+
+    async def under_run_sync():
+        # greenlet_spawn is what AsyncSession.run_sync runs the CRUD methods in.
+        value = await greenlet_spawn(cache.get_or_load, ("products",), ("key",), lambda: [1])
+        await greenlet_spawn(cache.invalidate, "products")
+        return value, threading.get_ident()
+
+    value, loop_thread = asyncio.run(under_run_sync())
+    assert value == [1]
+    assert client.threads and loop_thread not in client.threads
+
+
+def test_redis_cache_without_a_loop_calls_directly():
+    cache, client = redis_cache()
+    assert cache.get_or_load(("products",), ("key",), lambda: [1]) == [1]
+    assert cache.get_or_load(("products",), ("key",), lambda: [2]) == [1]
+    cache.invalidate("products")
+    assert cache.get_or_load(("products",), ("key",), lambda: [3]) == [3]
+    assert client.threads == {threading.get_ident()}
@@ -0,0 +1,21 @@
+import uuid
+
+import pytest
+
+
+@pytest.mark.parametrize("quantity", [0, -2])
+def test_cart_rejects_quantities_below_one(client, make_user, quantity):
+    user_id, headers = make_user("cart")
+    category = client.post("/categories/", json={"name": f"cart-{uuid.uuid4().hex[:8]}"}, headers=headers).json()
+    product = client.post("/products/", json={"name": "cart", "price": 4, "stock": 5, "category_id": category["id"]}, headers=headers).json()
+
+    line = {"product_id": product["id"], "quantity": quantity}
+    assert client.post(f"/{user_id}/cart/add", json=line, headers=headers).status_code == 422
+    assert client.post(f"/{user_id}/cart/add-many", json=[line], headers=headers).status_code == 422
+
+    added = client.post(f"/{user_id}/cart/add", json={**line, "quantity": 1}, headers=headers).json()
+    updated = client.put(f"/{user_id}/cart/update/{added['id']}", params={"quantity": quantity}, headers=headers)
+    assert updated.status_code == 422
+    cart = client.get(f"/{user_id}/cart", headers=headers).json()
+    assert cart["item_count"] == 1
+    assert cart["items"][0]["quantity"] == 1
@@ -0,0 +1,46 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import config
+import database
+import models
+from idempotency import request_hash
+
+
+def claim_left_running(user_id: int, key: str, path: str, body: bytes, seconds_ago: float):
+    """A claim whose request never finished, as a crashed worker leaves it."""
+    digest = request_hash({"method": "POST", "path": path, "query_string": b""}, body)
+    with database.SessionLocal() as db:
+        db.add(models.IdempotencyKey(
+            user_id=user_id, key=key, request_hash=digest,
+            created_at=datetime.now(timezone.utc) - timedelta(seconds=seconds_ago),
+        ))
+        db.commit()
+
+
+def test_checkout_client_error_is_stored_and_replayed(client, make_user):
+    user_id, headers = make_user("checkout")
+    headers = {**headers, "Idempotency-Key": uuid.uuid4().hex}
+    cart = client.get(f"/{user_id}/cart", headers=headers).json()
+
+    first = client.post(f"/checkout/{user_id}", params={"cart_id": cart["id"]}, headers=headers)
+    assert first.status_code == 400
+    retry = client.post(f"/checkout/{user_id}", params={"cart_id": cart["id"]}, headers=headers)
+    assert retry.status_code == 400
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+
+
+def test_claim_in_progress_answers_409_until_its_lease_runs_out(client, make_user):
+    user_id, headers = make_user("lease")
+    running, abandoned = uuid.uuid4().hex, uuid.uuid4().hex
+    body = f'{{"name": "lease-{uuid.uuid4().hex[:8]}"}}'.encode()
+    claim_left_running(user_id, running, "/categories/", body, 1)
+    claim_left_running(user_id, abandoned, "/categories/", body, config.IDEMPOTENCY_LEASE + 1)
+    headers = {**headers, "Content-Type": "application/json"}
+
+    assert client.post("/categories/", content=body, headers={**headers, "Idempotency-Key": running}).status_code == 409
+    taken_over = client.post("/categories/", content=body, headers={**headers, "Idempotency-Key": abandoned})
+    assert taken_over.status_code == 200
+    replayed = client.post("/categories/", content=body, headers={**headers, "Idempotency-Key": abandoned})
+    assert replayed.headers.get("Idempotent-Replayed") == "true"
+    assert replayed.json() == taken_over.json()
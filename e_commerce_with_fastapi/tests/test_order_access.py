@@ -0,0 +1,80 @@
+def place_order(client, headers, user_id):
+    category = client.post("/categories/", json={"name": f"orders-{user_id}"}, headers=headers).json()
+    product = client.post("/products/", json={"name": f"order-{user_id}", "price": 3, "stock": 5, "category_id": category["id"]}, headers=headers).json()
+    line = client.post(f"/{user_id}/cart/add", json={"product_id": product["id"], "quantity": 1}, headers=headers)
+    assert line.status_code == 200, line.text
+    order = client.post(f"/checkout/{user_id}", params={"cart_id": line.json()["cart_id"]}, headers=headers)
+    assert order.status_code == 200, order.text
+    return order.json()
+
+
+def test_orders_of_another_user_are_forbidden(client, make_user):
+    owner_id, owner = make_user("owner")
+    _, other = make_user("other")
+    place_order(client, owner, owner_id)
+
+    assert client.get(f"/users/{owner_id}/orders", headers=other).status_code == 403
+    orders = client.get(f"/users/{owner_id}/orders", headers=owner)
+    assert orders.status_code == 200
+    assert len(orders.json()) == 1
+
+
+def test_order_stats_of_another_user_are_forbidden(client, make_user):
+    owner_id, owner = make_user("owner")
+    _, other = make_user("other")
+    place_order(client, owner, owner_id)
+
+    assert client.get(f"/users/{owner_id}/orders/stats", headers=other).status_code == 403
+    stats = client.get(f"/users/{owner_id}/orders/stats", headers=owner)
+    assert stats.status_code == 200
+    assert stats.json()["order_count"] == 1
+
+
+def test_order_of_another_user_is_not_found(client, make_user):
+    owner_id, owner = make_user("owner")
+    _, other = make_user("other")
+    order = place_order(client, owner, owner_id)
+
+    assert client.get(f"/orders/{order['id']}", headers=other).status_code == 404
+    assert client.get(f"/orders/{order['id']}", headers=owner).json()["id"] == order["id"]
+
+
+def test_cart_routes_of_another_user_are_forbidden(client, make_user):
+    owner_id, owner = make_user("owner")
+    _, other = make_user("other")
+    category = client.post("/categories/", json={"name": f"carts-{owner_id}"}, headers=owner).json()
+    product = client.post("/products/", json={"name": f"cart-{owner_id}", "price": 3, "stock": 5, "category_id": category["id"]}, headers=owner).json()
+    line = client.post(f"/{owner_id}/cart/add", json={"product_id": product["id"], "quantity": 1}, headers=owner).json()
+    item = {"product_id": product["id"], "quantity": 1}
+
+    assert client.get(f"/{owner_id}/cart", headers=other).status_code == 403
+    assert client.post(f"/{owner_id}/cart/add", json=item, params={"hold": True}, headers=other).status_code == 403
+    assert client.post(f"/{owner_id}/cart/add-many", json=[item], headers=other).status_code == 403
+    assert client.put(f"/{owner_id}/cart/update/{line['id']}", params={"quantity": 2}, headers=other).status_code == 403
+    assert client.delete(f"/{owner_id}/cart/remove/{line['id']}", headers=other).status_code == 403
+    assert client.post(f"/checkout/{owner_id}", params={"cart_id": line["cart_id"]}, headers=other).status_code == 403
+    cart = client.get(f"/{owner_id}/cart", headers=owner).json()
+    assert [(item["id"], item["quantity"]) for item in cart["items"]] == [(line["id"], 1)]
+
+
+def test_cart_lines_and_carts_of_another_user_are_not_found(client, make_user):
+    owner_id, owner = make_user("owner")
+    other_id, other = make_user("other")
+    category = client.post("/categories/", json={"name": f"lines-{owner_id}"}, headers=owner).json()
+    product = client.post("/products/", json={"name": f"line-{owner_id}", "price": 3, "stock": 5, "category_id": category["id"]}, headers=owner).json()
+    line = client.post(f"/{owner_id}/cart/add", json={"product_id": product["id"], "quantity": 1}, headers=owner).json()
+
+    assert client.put(f"/{other_id}/cart/update/{line['id']}", params={"quantity": 2}, headers=other).status_code == 404
+    assert client.delete(f"/{other_id}/cart/remove/{line['id']}", headers=other).status_code == 404
+    assert client.post(f"/checkout/{other_id}", params={"cart_id": line["cart_id"]}, headers=other).status_code == 404
+    assert client.get(f"/{owner_id}/cart", headers=owner).json()["item_count"] == 1
+
+
+def test_accounts_of_another_user_cannot_be_changed(client, make_user):
+    owner_id, _ = make_user("owner")
+    _, other = make_user("other")
+
+    update = {"username": f"taken-{owner_id}", "email": f"taken-{owner_id}@example.com"}
+    assert client.put(f"/users/{owner_id}", json=update, headers=other).status_code == 403
+    assert client.delete(f"/users/{owner_id}", headers=other).status_code == 403
+    assert client.get(f"/users/{owner_id}", headers=other).json()["username"].startswith("owner-")
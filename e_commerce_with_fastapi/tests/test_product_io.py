@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+import product_io
+
+
+def records(body: bytes, fmt: str):
+    async def chunks():
+        yield body
+
+    async def collect():
+        return [item async for item in product_io.iter_records(chunks(), fmt)]
+
+    return asyncio.run(collect())
+
+
+def test_undecodable_line_is_reported_and_the_rest_read():
+    body = b"name,price,stock,category_id\nbad\xff,1,1,1\ngood,2,3,1\n"
+    assert records(body, "csv") == [
+        (2, None, "not valid UTF-8"),
+        (3, {"name": "good", "price": "2", "stock": "3", "category_id": "1"}, None),
+    ]
+    assert records(b'{"name": "bad\xff"}\n{"name": "good"}\n', "ndjson") == [
+        (1, None, "not valid UTF-8"),
+        (2, {"name": "good"}, None),
+    ]
+
+
+@pytest.mark.parametrize("stock", [1.7, -1, "-1", True])
+def test_invalid_stock_is_rejected(stock):
+    with pytest.raises(ValueError, match="stock"):
+        product_io.parse_product({"name": "p", "price": "1", "stock": stock, "category_id": 1}, {1})
+
+
+def test_whole_stock_is_accepted():
+    assert product_io.parse_product({"name": "p", "price": "1", "stock": 2.0, "category_id": "1"}, {1})["stock"] == 2
+
+
+def test_undecodable_bulk_row_is_a_row_error(client, make_user):
+    _, headers = make_user("bulk")
+    category = client.post("/categories/", json={"name": "bulk-decode"}, headers=headers).json()
+    body = f"name,price,stock,category_id\nbad\xff,1,1,{category['id']}\ngood,2,3,{category['id']}\n".encode("latin-1")
+    response = client.post("/products/bulk", content=body, headers={**headers, "Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json() == {"imported": 1, "failed": 1, "errors": [{"line": 2, "error": "not valid UTF-8"}]}
@@ -0,0 +1,31 @@
+import uuid
+from decimal import Decimal
+
+from crud import parse_product_cursor, product_cursor
+from pagination import NEXT_CURSOR_HEADER
+
+
+def test_price_cursor_keeps_the_exact_price():
+    assert parse_product_cursor("price", product_cursor("price", Decimal("19.99"), 7)) == (Decimal("19.99"), 7)
+
+
+def test_price_pages_through_equal_prices_once(client, make_user):
+    _, headers = make_user("pages")
+    category = client.post("/categories/", json={"name": f"pages-{uuid.uuid4().hex[:8]}"}, headers=headers).json()
+    created = {
+        client.post("/products/", json={"name": f"p{i}", "price": price, "stock": 1, "category_id": category["id"]}, headers=headers).json()["id"]
+        for i, price in enumerate([19.99] * 7 + [0.1, 20.01])
+    }
+
+    seen, cursor = [], None
+    for _ in range(len(created)):
+        params = {"category_id": category["id"], "sort": "price", "limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/products/", params=params, headers=headers)
+        assert page.status_code == 200, page.text
+        seen += [product["id"] for product in page.json()]
+        cursor = page.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+    assert cursor is None
+    assert len(seen) == len(set(seen))
+    assert set(seen) == created
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+import config
+import database
+import etags
+from crud import AsyncCatalogCRUD, AsyncCategoryCRUD, AsyncProductCRUD, AsyncInventoryCRUD, AsyncOrderCRUD, AsyncUserCRUD
+from hashing import password_hasher
+
+logger = logging.getLogger(__name__)
+
+# No user, product or order has id 0, so the lookups below find nothing.
+# (A cart lookup would create the cart, which is why carts are left out.)
+NO_ID = 0
+
+
+def _fill_sync_pool(engine, size: int):
+    connections = [engine.connect() for _ in range(size)]
+    for connection in connections:
+        connection.close()
+
+
+async def fill_pool(engine, async_engine=None):
+    """Open DB_POOL_SIZE connections at once and hand them back to the pool."""
+    if config.DB_POOL_MODE == "null" or engine.dialect.name == "sqlite":
+        return
+    if async_engine is not None:
+        connections = await asyncio.gather(*(async_engine.connect() for _ in range(config.DB_POOL_SIZE)))
+        await asyncio.gather(*(connection.close() for connection in connections))
+    else:
+        await run_in_threadpool(_fill_sync_pool, engine, config.DB_POOL_SIZE)
+
+
+async def run_hot_queries(replica=None):
+    """Run each read the hot endpoints make once, so the engine has compiled and cached it."""
+    async with database.session_scope(replica) as db:
+        categories_etag = etags.catalog_etag(await AsyncCatalogCRUD.get_versions(db, ("categories",)))
+        await AsyncCategoryCRUD.get_categories(db, categories_etag)
+        products_etag = etags.catalog_etag(await AsyncCatalogCRUD.get_versions(db, ("products", "categories")))
+        await AsyncProductCRUD.get_products(db, None, None, None, None, 0, 10, "id", None, products_etag)
+        await AsyncProductCRUD.search_products(db, "warm up")
+        await AsyncInventoryCRUD.get_availability(db, NO_ID)
+        await AsyncOrderCRUD.get_orders(db, NO_ID)
+        await AsyncOrderCRUD.get_order_stats(db, NO_ID)
+        await AsyncOrderCRUD.get_order(db, NO_ID)
+        await AsyncUserCRUD.get_user_by_id(db, NO_ID)
+        await AsyncUserCRUD.get_user_by_username(db, "")
+
+
+async def warm_up() -> float:
+    """Get this process ready for its first requests; returns the seconds it took.
+
+    Fills the primary's and each replica's pool and runs the hot read
+    queries on each, then starts the password hashing processes. Raises if
+    the primary can't be reached; an unreachable replica is only logged.
+    """
+    started = time.perf_counter()
+    await fill_pool(database.engine if database.async_engine is None else database.async_engine.sync_engine, database.async_engine)
+    await run_hot_queries()
+    for replica in database.replicas:
+        try:
+            await fill_pool(replica.engine, replica.async_engine)
+            await run_hot_queries(replica)
+        except Exception as exc:
+            logger.warning("could not warm up replica %s: %r", replica.name, exc)
+    await run_in_threadpool(password_hasher.warm_up)
+    return time.perf_counter() - started
+
+
+async def warm_up_until_ready(state):
+    """Retry warm_up every WARM_UP_RETRY_INTERVAL seconds until it succeeds, then mark state ready."""
+    while True:
+        try:
+            state.warm_up_seconds = await warm_up()
+        except Exception:
+            logger.exception("warm-up failed, retrying in %ss", config.WARM_UP_RETRY_INTERVAL)
+            await asyncio.sleep(config.WARM_UP_RETRY_INTERVAL)
+        else:
+            state.ready = True
+            logger.info("warmed up in %.2fs", state.warm_up_seconds)
+            return
+
+
+async def start_warm_up(state):
+    """Warm up in the background, waiting up to WARM_UP_TIMEOUT seconds for it to finish."""
+    state.ready = not config.WARM_UP
+    state.warm_up_seconds = None
+    state.warm_up = None
+    if not config.WARM_UP:
+        return
+    state.warm_up = asyncio.create_task(warm_up_until_ready(state))
+    await asyncio.wait({state.warm_up}, timeout=config.WARM_UP_TIMEOUT)
+    if not state.ready:
+        logger.warning("still warming up after %ss, serving anyway", config.WARM_UP_TIMEOUT)